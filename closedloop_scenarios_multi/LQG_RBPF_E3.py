@@ -1,14 +1,12 @@
 # Control using multiple linear models and measuring both concentration and temperature
 
 import numpy
-import scipy.stats
 import closedloop_scenarios_single.closedloop_params as params
 import src.Results as Results
 import src.RBPF as RBPF
 import src.LQR as LQR
-import src.MPC as MPC
+import src.Noise as Noise
 import matplotlib.pyplot as plt
-import typing
 
 tend = 150
 params = params.Params(tend)
@@ -35,16 +33,11 @@ maxtrack = numpy.zeros([len(linsystems), params.N])
 # Setup the controllers
 setpoint = linsystems[2].op[0]
 H = numpy.matrix([1.0, 0.0])
-controllers = [None]*len(models)  # type: typing.List[LQR.Controller]
-for k in range(len(models)):
-    ysp = numpy.matrix(setpoint - models[k].b[0])  # set point is set here
-    x_off, u_off = LQR.offset(models[k].A, models[k].B, params.C2, H, ysp)
-    K = LQR.lqr(models[k].A, numpy.matrix(models[k].B), params.QQ, params.RR)
-    controllers[k] = LQR.Controller(K, x_off, u_off)
+controllers = LQR.ControllerBank(linsystems, params.QQ, params.RR, params.C2, H, setpoint)
 
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R2, block=params.N)
 params.xs[:, 0] = init_state
 params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measured from actual plant
 
@@ -61,13 +54,8 @@ for k in range(len(linsystems)):
 
 maxtrack[:, 0] = RBPF.get_max_track(particles, numModels)
 
-# Controller Input
-ind = numpy.argmax(maxtrack[:, 0])  # use this model and controller
-horizon = 150
-
-params.us[0] = MPC.mpc_lqr(params.rbpfmeans[:, 0] - models[ind].b, horizon, models[ind].A, numpy.matrix(models[ind].B),
-                           numpy.matrix(params.QQ), numpy.matrix(params.RR),
-                           controllers[ind].x_off, numpy.array([controllers[ind].u_off[0]]))
+# Controller Input: the LQR actions of the models weighted by the switch probabilities
+params.us[0] = controllers.control(params.rbpfmeans[:, 0], switchtrack[:, 0])[0]
 # Loop through the rest of time
 
 for t in range(1, params.N):
@@ -88,11 +76,7 @@ for t in range(1, params.N):
 
     # Controller Input
     if t % 10 == 0:
-        ind = numpy.argmax(maxtrack[:, t])  # use this model and controller
-        params.us[t] = MPC.mpc_lqr(params.rbpfmeans[:, t] - models[ind].b, horizon, models[ind].A,
-                                   numpy.matrix(models[ind].B),
-                                   numpy.matrix(params.QQ), numpy.matrix(params.RR),
-                                   controllers[ind].x_off, numpy.array([controllers[ind].u_off[0]]))
+        params.us[t] = controllers.control(params.rbpfmeans[:, t], switchtrack[:, t])[0]
     else:
         params.us[t] = params.us[t-1]
 
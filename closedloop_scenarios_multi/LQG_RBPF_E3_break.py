@@ -1,12 +1,12 @@
 # Control using multiple linear models and measuring both concentration and temperature
 
 import numpy
-import scipy.stats
 import closedloop_scenarios_single.closedloop_params as params
 import src.Results as Results
 import src.RBPF as RBPF
 import src.LQR as LQR
 import src.MPC as MPC
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 import typing
 
@@ -43,8 +43,8 @@ for k in range(len(models)):
     controllers[k] = LQR.Controller(K, x_off, u_off)
 
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R2, block=params.N)
 params.xs[:, 0] = init_state
 params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measured from actual plant
 
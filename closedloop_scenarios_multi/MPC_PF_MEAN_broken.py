@@ -2,12 +2,12 @@
 # the system to the unstead operating point. Deterministic contraints.
 
 import numpy
-import scipy.stats
 import closedloop_scenarios_single.closedloop_params as params
 import src.Results as Results
 import src.LQR as LQR
 import src.MPC as MPC
 import src.PF as PF
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 
 tend = 300
@@ -46,10 +46,10 @@ cstr_pf = PF.Model(f, g)
 
 # Initialise the PF
 nP = 200  # number of particles.
-prior_dist = scipy.stats.multivariate_normal(mean=init_state, cov=params.init_state_covar)  # prior distribution
+prior_dist = Noise.Gaussian(params.init_state_covar, mean=init_state)  # prior distribution
 particles = PF.init_pf(prior_dist, nP, 2)  # initialise the particles
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)  # state distribution
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)  # measurement distribution
+state_noise_dist = Noise.Gaussian(params.Q)  # state distribution
+meas_noise_dist = Noise.Gaussian(params.R2)  # measurement distribution
 
 # First time step of the simulation
 params.xs[:, 0] = init_state  # set simulation starting point to the random initial state
@@ -1,13 +1,13 @@
 # Control using two nonlinear models and measuring both states
 
 import numpy
-import scipy.stats
 import closedloop_scenarios_single.closedloop_params as params
 import src.Results as Results
 import src.LQR as LQR
 import src.MPC as MPC
 import src.SPF as SPF
 import src.RBPF as RBPF
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 import typing
 
@@ -22,11 +22,11 @@ A = numpy.array([[0.999, 0.001],
 
 
 def fun1(x, u, w):
-    return params.cstr_model.run_reactor(x, u, params.h) + w
+    return params.cstr_model.run_reactor_batch(x, u, params.h) + w
 
 
 def fun2(x, u, w):
-    return params.cstr_model_broken.run_reactor(x, u, params.h) + w
+    return params.cstr_model_broken.run_reactor_batch(x, u, params.h) + w
 
 
 def gs(x):
@@ -37,12 +37,12 @@ F = [fun1, fun2]
 G = [gs, gs]
 numSwitches = 2
 
-ydists = numpy.array([scipy.stats.multivariate_normal(cov=params.R2), scipy.stats.multivariate_normal(cov=params.R2)])
-xdists = numpy.array([scipy.stats.multivariate_normal(cov=params.Q), scipy.stats.multivariate_normal(cov=params.Q)])
-cstr_filter = SPF.Model(F, G, A, xdists, ydists)
+ydists = numpy.array([Noise.Gaussian(params.R2), Noise.Gaussian(params.R2)])
+xdists = numpy.array([Noise.Gaussian(params.Q), Noise.Gaussian(params.Q)])
+cstr_filter = SPF.Model(F, G, A, xdists, ydists, batch=True)
 
 nP = 500  # number of particles
-xdist = scipy.stats.multivariate_normal(mean=init_state, cov=params.init_state_covar)
+xdist = Noise.Gaussian(params.init_state_covar, mean=init_state)
 sdist = [0.9, 0.1]
 particles = SPF.init_spf(xdist, sdist, nP, 2)
 
@@ -50,8 +50,8 @@ switchtrack = numpy.zeros([2, params.N])
 maxtrack = numpy.zeros([numSwitches, params.N])
 smoothedtrack = numpy.zeros([numSwitches, params.N])
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R2, block=params.N)
 
 # Setup control (use linear control)
 linsystems = params.cstr_model.get_nominal_linear_systems(params.h)
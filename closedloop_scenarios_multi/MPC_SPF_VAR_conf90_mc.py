@@ -1,30 +1,25 @@
 # Control using two nonlinear models and measuring both states
 
 import numpy
-import scipy.stats
-import closedloop_scenarios_single.closedloop_params as params
-import src.Results as Results
+import closedloop_scenarios_single.closedloop_params as closedloop_params
 import src.LQR as LQR
+import src.MonteCarlo as MonteCarlo
 import src.MPC as MPC
 import src.SPF as SPF
+import src.Store as Store
 import src.RBPF as RBPF
-import typing
+import src.Noise as Noise
 
 tend = 200
-params = params.Params(tend)
-
-mcN = 50
-mcdists = numpy.zeros([2, mcN])
-xconcen = numpy.zeros([params.N, mcN])
-mcerr = numpy.zeros(mcN)
-mciter = -1
 
 aline = 10.  # slope of constraint line ax + by + c = 0
 cline = -410.0  # negative of the y axis intercept
 bline = 1.0
 
 
-def fun():
+def fun(rng):
+    """Return the arrays of one run (see MonteCarlo.fields) or None if it failed."""
+    params = closedloop_params.Params(tend)  # every run has its own buffers
     isDone = True
     init_state = numpy.array([0.55, 450])  # initial state
 
@@ -33,10 +28,10 @@ def fun():
                      [0.001, 0.999]])
 
     def fun1(x, u, w):
-        return params.cstr_model.run_reactor(x, u, params.h) + w
+        return params.cstr_model.run_reactor_batch(x, u, params.h) + w
 
     def fun2(x, u, w):
-        return params.cstr_model_broken.run_reactor(x, u, params.h) + w
+        return params.cstr_model_broken.run_reactor_batch(x, u, params.h) + w
 
     def gs(x):
         return params.C2 @ x
@@ -45,29 +40,30 @@ def fun():
     G = [gs, gs]
     numSwitches = 2
 
+    nP = 500  # number of particles
     ydists = numpy.array(
-        [scipy.stats.multivariate_normal(cov=params.R2), scipy.stats.multivariate_normal(cov=params.R2)])
-    xdists = numpy.array([scipy.stats.multivariate_normal(cov=params.Q), scipy.stats.multivariate_normal(cov=params.Q)])
-    cstr_filter = SPF.Model(F, G, A, xdists, ydists)
+        [Noise.Gaussian(params.R2), Noise.Gaussian(params.R2)])
+    xdists = numpy.array([Noise.Gaussian(params.Q, rng=rng, block=10*nP),
+                          Noise.Gaussian(params.Q, rng=rng, block=10*nP)])
+    cstr_filter = SPF.Model(F, G, A, xdists, ydists, batch=True)
 
-    nP = 500  # number of particles
-    xdist = scipy.stats.multivariate_normal(mean=init_state, cov=params.init_state_covar)
+    xdist = Noise.Gaussian(params.init_state_covar, mean=init_state)
     sdist = [0.9, 0.1]
-    particles = SPF.init_spf(xdist, sdist, nP, 2)
+    particles = SPF.init_spf(xdist, sdist, nP, 2, rng)
 
     switchtrack = numpy.zeros([2, params.N])
     maxtrack = numpy.zeros([numSwitches, params.N])
     smoothedtrack = numpy.zeros([numSwitches, params.N])
 
-    state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-    meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+    state_noise_dist = Noise.Gaussian(params.Q, rng=rng, block=params.N)
+    meas_noise_dist = Noise.Gaussian(params.R2, rng=rng, block=params.N)
 
     # Setup control (use linear control)
     linsystems = params.cstr_model.get_nominal_linear_systems(params.h)
     linsystems_broken = params.cstr_model_broken.get_nominal_linear_systems(params.h)
     opoint = 1  # the specific linear model we will use
 
-    lin_models = [None] * 2  # type: typing.List[RBPF.Model]
+    lin_models = [None] * 2
     lin_models[0] = RBPF.Model(linsystems[opoint].A, linsystems[opoint].B, linsystems[opoint].b,
                                params.C2, params.Q, params.R2)
     lin_models[1] = RBPF.Model(linsystems_broken[opoint].A, linsystems_broken[opoint].B, linsystems_broken[opoint].b,
@@ -79,7 +75,6 @@ def fun():
     for k in range(len(lin_models)):
         sp = setpoint[0] - lin_models[k].b[0]
         x_off, usp = LQR.offset(lin_models[k].A, numpy.matrix(lin_models[k].B), params.C2, H, numpy.matrix([sp]))
-        ysp = x_off
         usp = numpy.array([usp])
         usps[k] = usp
 
@@ -88,9 +83,9 @@ def fun():
 
     # Setup simulation
     params.xs[:, 0] = init_state
-    params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measured from actual plant
+    params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs(random_state=rng)  # measured plant
 
-    SPF.init_filter(particles, params.ys2[:, 0], cstr_filter)
+    SPF.init_filter(particles, params.ys2[:, 0], cstr_filter, rng=rng)
 
     for k in range(numSwitches):
         switchtrack[k, 0] = numpy.sum(particles.w[numpy.where(particles.s == k)[0]])
@@ -111,7 +106,7 @@ def fun():
 
     # Loop through the rest of time
     for t in range(1, params.N):
-        random_element = state_noise_dist.rvs()
+        random_element = state_noise_dist.rvs(random_state=rng)
         if params.ts[t] < 100:  # break here
             params.xs[:, t] = params.cstr_model.run_reactor(params.xs[:, t - 1], params.us[t - 1],
                                                             params.h) + random_element
@@ -119,9 +114,9 @@ def fun():
             params.xs[:, t] = params.cstr_model_broken.run_reactor(params.xs[:, t - 1], params.us[t - 1], params.h)
             params.xs[:, t] += random_element
 
-        params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measured from actual plant
+        params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs(random_state=rng)  # measured plant
 
-        SPF.spf_filter(particles, params.us[t - 1], params.ys2[:, t], cstr_filter)
+        SPF.spf_filter(particles, params.us[t - 1], params.ys2[:, t], cstr_filter, rng=rng)
         params.spfmeans[:, t], params.spfcovars[:, :, t] = SPF.get_stats(particles)
 
         for k in range(numSwitches):
@@ -144,30 +139,17 @@ def fun():
             if params.us[t] is None or numpy.isnan(params.us[t]):
                 isDone = False
                 break
-    return isDone, setpoint
-
-
-while mciter < mcN-1:
-    try:
-        res, setpoint = fun()
-
-        if res:
-            mciter += 1
-            mcerr[mciter] = Results.calc_error1(params.xs, setpoint[0])
-            Results.get_mc_res(params.xs, params.spfcovars, [aline, cline], mcdists, mciter, params.h)
-            xconcen[:, mciter] = params.xs[0, :]
-    except:
-        continue
-
-mcave = sum(abs(mcerr))/mcN
-print("Monte Carlo average concentration error: ", mcave)
-nocount = len(mcdists[0]) - numpy.count_nonzero(mcdists[0])
-filteredResults = numpy.zeros([2, mcN - nocount])
-counter = 0
-for k in range(mcN):
-    if mcdists[0, k] != 0.0:
-        filteredResults[:, counter] = mcdists[:, k]
-        counter += 1
-
-numpy.savetxt("spf_var90.csv", filteredResults, delimiter=",", fmt="%f")
-numpy.savetxt("spf_var90_mc2.csv", xconcen, delimiter=",", fmt="%f")
+    if not isDone:
+        return None
+    return dict(xs=params.xs, ys=params.ys2, us=params.us, means=params.spfmeans, covars=params.spfcovars,
+                switches=maxtrack, setpoint=setpoint[0])
+
+
+if __name__ == '__main__':
+    mcN = 50
+    setup = closedloop_params.Params(tend)
+    store = Store.create("spf_var90", MonteCarlo.fields(setup.N), mcN, aline=aline, bline=bline, cline=cline, h=setup.h)
+    results = MonteCarlo.Aggregate(mcN, setup.N, [aline, cline], setup.h, store)
+    MonteCarlo.run(fun, mcN, results.collect)
+
+    print("Monte Carlo average concentration error: ", results.average_error())
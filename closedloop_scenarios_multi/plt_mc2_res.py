@@ -2,8 +2,8 @@
 import matplotlib as mpc
 import matplotlib.pyplot as plt
 import numpy
-import pandas
 import src.Results as Results
+import src.MonteCarlo as MonteCarlo
 
 # mcN = 50
 # include("lin_mod_kf_lin_mpc_mean_mc.jl")
@@ -15,9 +15,10 @@ mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 mpc.rc("figure", figsize=(6.0, 3))
 
-mc1 = abs(pandas.read_csv("spf_mean_mc2.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("spf_var90_mc2.csv", header=None).as_matrix())
-mc3 = abs(pandas.read_csv("spf_var99_mc2.csv", header=None).as_matrix())
+
+mc1 = abs(MonteCarlo.load_concentrations("spf_mean"))
+mc2 = abs(MonteCarlo.load_concentrations("spf_var90"))
+mc3 = abs(MonteCarlo.load_concentrations("spf_var99"))
 
 
 rows, cols = mc1.shape  # all will have the same dimension
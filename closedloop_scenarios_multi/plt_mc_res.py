@@ -1,10 +1,10 @@
 # Plot the Linear Model KF MC results
 import matplotlib as mpc
 import matplotlib.pyplot as plt
-import pandas
 import numpy
 import src.Auxiliary as Auxiliary
 import src.Ellipse as Ellipse
+import src.MonteCarlo as MonteCarlo
 
 # mcN = 500
 # include("lin_mod_kf_lin_mpc_mean_mc.jl")
@@ -19,9 +19,10 @@ mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 mpc.rc("figure", figsize=(6.0, 3))
 
-mc1 = abs(pandas.read_csv("spf_mean.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("spf_var90.csv", header=None).as_matrix())
-mc3 = abs(pandas.read_csv("spf_var99.csv", header=None).as_matrix())
+
+mc1 = abs(MonteCarlo.load_violations("spf_mean"))
+mc2 = abs(MonteCarlo.load_violations("spf_var90"))
+mc3 = abs(MonteCarlo.load_violations("spf_var99"))
 
 mc1 = Auxiliary.remove_outliers(mc1, 3)
 mc2 = Auxiliary.remove_outliers(mc2, 3)
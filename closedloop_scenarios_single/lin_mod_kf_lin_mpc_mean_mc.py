@@ -3,4 +3,5 @@
 
 import closedloop_scenarios_single.lin_mpc_mean
 
-closedloop_scenarios_single.lin_mpc_mean.main(mcN=2, linear=True, pf=False)
+if __name__ == '__main__':  # the Monte Carlo workers import this module
+    closedloop_scenarios_single.lin_mpc_mean.main(mcN=2, linear=True, pf=False)
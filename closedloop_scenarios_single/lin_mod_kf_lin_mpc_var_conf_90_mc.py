@@ -3,4 +3,5 @@
 
 import closedloop_scenarios_single.lin_mpc_var_conf
 
-closedloop_scenarios_single.lin_mpc_var_conf.main(90, mcN=2, linear=True)
+if __name__ == '__main__':  # the Monte Carlo workers import this module
+    closedloop_scenarios_single.lin_mpc_var_conf.main(90, mcN=2, linear=True)
@@ -3,9 +3,9 @@
 import closedloop_scenarios_single.closedloop_params
 import src.LQR as LQR
 import src.LLDS as LLDS
-import scipy.stats
 import src.MPC as MPC
 import src.Results as Results
+import src.Noise as Noise
 import numpy
 import matplotlib.pyplot as plt
 
@@ -32,8 +32,8 @@ usp = numpy.array([usp])
 
 # Set up the KF
 kf_cstr = LLDS.LLDS(A, B, params.C2, params.Q, params.R2)  # set up the KF object (measuring both states)
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R2, block=params.N)
 
 # First time step of the simulation
 params.xs[:, 0] = init_state - b  # set simulation starting point to the random initial state
@@ -4,16 +4,72 @@
 import closedloop_scenarios_single.closedloop_params
 import src.LQR as LQR
 import src.LLDS as LLDS
-import scipy.stats
 import src.MPC as MPC
 import src.Results as Results
 import numpy
 import matplotlib.pyplot as plt
 import src.PF as PF
+import src.Noise as Noise
+import src.MonteCarlo as MonteCarlo
+import src.Store as Store
+import functools
+
+
+tend = 80
+
+# add state constraints
+aline = 10  # slope of constraint line ax + by + c = 0
+bline = 1
+clines = {True: -411, False: -404}  # negative of the y axis intercept for the linear and nonlinear plant
 
 
 def main(mcN=1, linear=True, pf=False):
-    tend = 80
+    cline = clines[linear]
+    if mcN > 1:
+        setup = closedloop_scenarios_single.closedloop_params.Params(tend)
+        name = "{0}mod_{1}_mean".format("lin" if linear else "nonlin", "pf" if pf else "kf")
+        store = Store.create(name, MonteCarlo.fields(setup.N, nS=0), mcN, aline=aline, bline=bline, cline=cline,
+                             h=setup.h, linear=linear, pf=pf)
+        results = MonteCarlo.Aggregate(mcN, setup.N, [aline, cline], setup.h, store)
+        MonteCarlo.run(functools.partial(sample, linear=linear, pf=pf), mcN, results.collect)
+        print("The absolute MC average error is: ", results.average_error())
+        return None
+
+    run = None
+    while run is None:  # repeat until the MPC succeeds throughout
+        run = simulate(linear, pf)
+    params = run["params"]
+    setpoint = run["setpoint"]
+
+    # Plot the results
+    if pf:
+        Results.plot_tracking1(params.ts, params.xs, params.ys2, params.pfmeans, params.us, 2, setpoint)
+        Results.plot_ellipses2(params.ts, params.xs, params.pfmeans, params.pfcovars,
+                               [aline, cline], run["op"], True, -2.0 * numpy.log(1 - 0.9), 1, "best")
+    else:
+        Results.plot_tracking1(params.ts, params.xs, params.ys2, params.kfmeans, params.us, 2, setpoint)
+        Results.plot_ellipses2(params.ts, params.xs, params.kfmeans, params.kfcovars,
+                               [aline, cline], run["op"], True, -2.0*numpy.log(1-0.9), 1, "best")
+    Results.check_constraint(params.ts, params.xs, [aline, cline])
+    Results.calc_error1(params.xs, setpoint)
+    Results.calc_energy(params.us, 0.0)
+    plt.show()
+
+
+def sample(rng, linear=True, pf=False):
+    """Return the arrays of one Monte Carlo run (see MonteCarlo.Aggregate) or None if the MPC failed."""
+    run = simulate(linear, pf, rng)
+    if run is None:
+        return None
+    params = run["params"]
+    means, covars = (params.pfmeans, params.pfcovars) if pf else (params.kfmeans, params.kfcovars)
+    return dict(xs=params.xs, ys=params.ys2, us=params.us, means=means, covars=covars, setpoint=run["setpoint"])
+
+
+def simulate(linear=True, pf=False, rng=None):
+    """Run one closed loop simulation and return a dict with the Params (trajectories in absolute
+    variables), the setpoint and the operating point. Returns None if the MPC failed.
+    rng => stream of the noise and the PF (None => the global numpy.random state)"""
     params = closedloop_scenarios_single.closedloop_params.Params(tend)  # end time of simulation
 
     # Get the linear model
@@ -35,8 +91,8 @@ def main(mcN=1, linear=True, pf=False):
     usp = numpy.array([usp])
 
     # Noise distributions
-    state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-    meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+    state_noise_dist = Noise.Gaussian(params.Q, rng=rng)
+    meas_noise_dist = Noise.Gaussian(params.R2, rng=rng)
 
     # PF functions
     def f(x, u, w):
@@ -52,145 +108,80 @@ def main(mcN=1, linear=True, pf=False):
 
     # Setup MPC
     horizon = 150
-
-    # add state constraints
-    aline = 10  # slope of constraint line ax + by + c = 0
-    if linear:
-        cline = -411  # negative of the y axis intercept
-    else:
-        cline = -404  # negative of the y axis intercept
-    bline = 1
+    cline = clines[linear]
 
     if linear:
         lim_u = 10000
     else:
         lim_u = 20000
 
-    mcdists = numpy.zeros([2, mcN])
-    xconcen = numpy.zeros([params.N, mcN])
-    mcerrs = numpy.zeros(mcN)
     particles = None
+    # First time step of the simulation
+    if linear:
+        params.xs[:, 0] = init_state - b  # set simulation starting point to the random initial state
+        params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
+        temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0])  # filter
+        params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
+    else:
+        params.xs[:, 0] = init_state  # set simulation starting point to the random initial state
+        params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
+        temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0] - b)  # filter
+        params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
 
-    for mciter in range(mcN):
-        # First time step of the simulation
-        if linear:
-            params.xs[:, 0] = init_state - b  # set simulation starting point to the random initial state
-            params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
-            temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0])  # filter
-            params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
-        else:
-            params.xs[:, 0] = init_state  # set simulation starting point to the random initial state
-            params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
-            temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0] - b)  # filter
-            params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
-
-        if pf:
-            nP = 200
-            prior_dist = scipy.stats.multivariate_normal(mean=init_state,
-                                                         cov=params.init_state_covar)  # prior distribution
+    if pf:
+        nP = 200
+        prior_dist = Noise.Gaussian(params.init_state_covar, mean=init_state)  # prior distribution
 
-            particles = PF.init_pf(prior_dist, nP, 2)  # initialise the particles
+        particles = PF.init_pf(prior_dist, nP, 2, rng)  # initialise the particles
 
-            particles = PF.init_filter(particles, params.ys2[:, 0], meas_noise_dist, cstr_pf)
-            params.pfmeans[:, 0], params.pfcovars[:, :, 0] = PF.get_stats(particles)
+        particles = PF.init_filter(particles, params.ys2[:, 0], meas_noise_dist, cstr_pf, rng=rng)
+        params.pfmeans[:, 0], params.pfcovars[:, :, 0] = PF.get_stats(particles)
 
-            params.us[0] = MPC.mpc_mean(params.pfmeans[:, 0]-b, horizon, A, numpy.matrix(B), b,
-                                        aline, bline, cline, params.QQ, params.RR, ysp,
-                                        usp[0], lim_u, 1000.0)  # get the controller input
-        else:
-            params.us[0] = MPC.mpc_mean(params.kfmeans[:, 0], horizon, A, numpy.matrix(B), b,
-                                        aline, bline, cline, params.QQ, params.RR, ysp,
-                                        usp[0], lim_u, 1000.0)  # get the controller input
-        for t in range(1, params.N):
-            if linear:
-                params.xs[:, t] = A @ params.xs[:, t - 1] + B * params.us[t - 1] + state_noise_dist.rvs()
-                params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
-                params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
-                                                                                     params.kfcovars[:, :, t-1],
-                                                                                     params.us[t-1], params.ys2[:, t])
-            else:
-                params.xs[:, t] = params.cstr_model.run_reactor(params.xs[:, t - 1], params.us[t - 1], params.h)
-                params.xs[:, t] += state_noise_dist.rvs()  # actual plant
-                params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
-                params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
-                                                                                     params.kfcovars[:, :, t-1],
-                                                                                     params.us[t-1],
-                                                                                     params.ys2[:, t]-b)
-            if pf:
-                PF.pf_filter(particles, params.us[t - 1], params.ys2[:, t], state_noise_dist, meas_noise_dist, cstr_pf)
-                params.pfmeans[:, t], params.pfcovars[:, :, t] = PF.get_stats(particles)
-
-            if t % 10 == 0:
-                if pf:
-                    params.us[t] = MPC.mpc_mean(params.pfmeans[:, t]-b, horizon, A, numpy.matrix(B), b,
-                                                aline, bline, cline, params.QQ,
-                                                params.RR, ysp, usp[0], lim_u, 1000.0)
-                else:
-                    params.us[t] = MPC.mpc_mean(params.kfmeans[:, t], horizon, A, numpy.matrix(B), b,
-                                                aline, bline, cline, params.QQ,
-                                                params.RR, ysp, usp[0], lim_u, 1000.0)
-                if params.us[t] is None or numpy.isnan(params.us[t]):
-                    break
-            else:
-                params.us[t] = params.us[t-1]
-
-        for i in range(len(params.kfmeans[0])):
-            params.kfmeans[:, i] += b
-            if linear:
-                params.xs[:, i] += b
-                params.ys2[:, i] += b
-
-        if mcN > 1:
-            xconcen[:, mciter] = params.xs[0, :]
-            mcerrs[mciter] = Results.calc_error1(params.xs, ysp[0] + b[0])
-            Results.get_mc_res(params.xs, params.kfcovars, [aline, cline], mcdists, mciter, params.h)
-        if mcN == 1:
-            # Plot the results
-            if pf:
-                Results.plot_tracking1(params.ts, params.xs, params.ys2, params.pfmeans, params.us, 2, ysp[0] + b[0])
-                Results.plot_ellipses2(params.ts, params.xs, params.pfmeans, params.pfcovars,
-                                       [aline, cline], linsystems[1].op, True, -2.0 * numpy.log(1 - 0.9), 1, "best")
-            else:
-                Results.plot_tracking1(params.ts, params.xs, params.ys2, params.kfmeans, params.us, 2, ysp[0]+b[0])
-                Results.plot_ellipses2(params.ts, params.xs, params.kfmeans, params.kfcovars,
-                                       [aline, cline], linsystems[1].op, True, -2.0*numpy.log(1-0.9), 1, "best")
-            Results.check_constraint(params.ts, params.xs, [aline, cline])
-            Results.calc_error1(params.xs, ysp[0]+b[0])
-            Results.calc_energy(params.us, 0.0)
-            plt.show()
-
-    if mcN != 1:
-        print("The absolute MC average error is: ", sum(abs(mcerrs)) / mcN)
+        params.us[0] = MPC.mpc_mean(params.pfmeans[:, 0]-b, horizon, A, numpy.matrix(B), b,
+                                    aline, bline, cline, params.QQ, params.RR, ysp,
+                                    usp[0], lim_u, 1000.0)  # get the controller input
+    else:
+        params.us[0] = MPC.mpc_mean(params.kfmeans[:, 0], horizon, A, numpy.matrix(B), b,
+                                    aline, bline, cline, params.QQ, params.RR, ysp,
+                                    usp[0], lim_u, 1000.0)  # get the controller input
+    for t in range(1, params.N):
         if linear:
-            if pf:
-                numpy.savetxt("linmod_pf_mean_mc2.csv", xconcen, delimiter=",")
-            else:
-                numpy.savetxt("linmod_kf_mean_mc2.csv", xconcen, delimiter=",")
+            params.xs[:, t] = A @ params.xs[:, t - 1] + B * params.us[t - 1] + state_noise_dist.rvs()
+            params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
+            params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
+                                                                                 params.kfcovars[:, :, t-1],
+                                                                                 params.us[t-1], params.ys2[:, t])
         else:
+            params.xs[:, t] = params.cstr_model.run_reactor(params.xs[:, t - 1], params.us[t - 1], params.h)
+            params.xs[:, t] += state_noise_dist.rvs()  # actual plant
+            params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
+            params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
+                                                                                 params.kfcovars[:, :, t-1],
+                                                                                 params.us[t-1],
+                                                                                 params.ys2[:, t]-b)
+        if pf:
+            PF.pf_filter(particles, params.us[t - 1], params.ys2[:, t], state_noise_dist, meas_noise_dist, cstr_pf,
+                         rng=rng)
+            params.pfmeans[:, t], params.pfcovars[:, :, t] = PF.get_stats(particles)
+
+        if t % 10 == 0:
             if pf:
-                numpy.savetxt("nonlinmod_pf_mean_mc2.csv", xconcen, delimiter=",")
+                params.us[t] = MPC.mpc_mean(params.pfmeans[:, t]-b, horizon, A, numpy.matrix(B), b,
+                                            aline, bline, cline, params.QQ,
+                                            params.RR, ysp, usp[0], lim_u, 1000.0)
             else:
-                numpy.savetxt("nonlinmod_kf_mean_mc2.csv", xconcen, delimiter=",")
+                params.us[t] = MPC.mpc_mean(params.kfmeans[:, t], horizon, A, numpy.matrix(B), b,
+                                            aline, bline, cline, params.QQ,
+                                            params.RR, ysp, usp[0], lim_u, 1000.0)
+            if params.us[t] is None or numpy.isnan(params.us[t]):
+                return None
+        else:
+            params.us[t] = params.us[t-1]
 
-    nocount = len(mcdists[0]) - numpy.count_nonzero(mcdists[0])
-    filteredResults = numpy.zeros([2, mcN - nocount])
-    counter = 0
-    for k in range(mcN):
-        if mcdists[0, k] != 0.0:
-            filteredResults[:, counter] = mcdists[:, k]
-            counter += 1
+    for i in range(len(params.kfmeans[0])):
+        params.kfmeans[:, i] += b
+        if linear:
+            params.xs[:, i] += b
+            params.ys2[:, i] += b
 
-    if linear:
-        if pf:
-            numpy.savetxt("linmod_pf_mean_mc.csv", filteredResults, delimiter=",",
-                          fmt="%f")
-        else:
-            numpy.savetxt("linmod_kf_mean_mc.csv", filteredResults, delimiter=",",
-                          fmt="%f")
-    else:
-        if pf:
-            numpy.savetxt("nonlinmod_pf_mean_mc.csv", filteredResults, delimiter=",",
-                          fmt="%f")
-        else:
-            numpy.savetxt("nonlinmod_kf_mean_mc.csv", filteredResults, delimiter=",",
-                          fmt="%f")
+    return dict(params=params, setpoint=ysp[0] + b[0], op=linsystems[opoint].op)
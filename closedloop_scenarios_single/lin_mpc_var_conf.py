@@ -4,13 +4,24 @@
 import closedloop_scenarios_single.closedloop_params
 import src.LQR as LQR
 import src.LLDS as LLDS
-import scipy.stats
 import src.MPC as MPC
 import src.Results as Results
 import numpy
 import matplotlib.pyplot as plt
 import src.PF as PF
 import src.Auxiliary as Auxiliary
+import src.Noise as Noise
+import src.MonteCarlo as MonteCarlo
+import src.Store as Store
+import functools
+
+
+tend = 80
+
+# add state constraints
+aline = 10  # slope of constraint line ax + by + c = 0
+cline = -411  # negative of the y axis intercept
+bline = 1
 
 
 def main(nine, mcN=1, linear=True, pf=False, numerical=False):
@@ -26,7 +37,67 @@ def main(nine, mcN=1, linear=True, pf=False, numerical=False):
     else:
         return None
 
-    tend = 80
+    if mcN > 1:
+        setup = closedloop_scenarios_single.closedloop_params.Params(tend)
+        name = "{0}mod_{1}_var{2}".format("lin" if linear else "nonlin", "pf" if pf else "kf", nine)
+        store = Store.create(name, MonteCarlo.fields(setup.N, nS=0), mcN, aline=aline, bline=bline, cline=cline,
+                             h=setup.h, k_squared=k_squared, linear=linear, pf=pf)
+        results = MonteCarlo.Aggregate(mcN, setup.N, [aline, cline], setup.h, store)
+        MonteCarlo.run(functools.partial(sample, k_squared=k_squared, linear=linear, pf=pf), mcN, results.collect)
+        print("The absolute MC average error is: ", results.average_error())
+        return None
+
+    run = None
+    while run is None:  # repeat until the MPC succeeds throughout
+        run = simulate(k_squared, linear, pf, numerical)
+    params = run["params"]
+    setpoint = run["setpoint"]
+
+    # Plot the results
+    if numerical:
+        klts, kldiv, basediv, unidiv = run["klts"], run["kldiv"], run["basediv"], run["unidiv"]
+        Results.plot_kl_div(klts, kldiv, basediv, unidiv, False)
+        Results.plot_kl_div(klts, kldiv, basediv, unidiv, True)
+        print("The average divergence for the baseline is: ", 1.0 / len(klts) * sum(basediv))
+        print("The average divergence for the approximation is: ", 1.0 / len(klts) * sum(kldiv))
+        print("The average divergence for the uniform is: ", 1.0 / len(klts) * sum(unidiv))
+    elif pf:
+        Results.plot_tracking1(params.ts, params.xs, params.ys2, params.pfmeans, params.us, 2, setpoint)
+        plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-25_python.pdf", bbox_inches="tight")
+        Results.plot_ellipses2(params.ts, params.xs, params.pfmeans, params.pfcovars, [aline, cline],
+                               run["op"], True, -2.0 * numpy.log(1 - 0.9), plot_setting, "best")
+        plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-26_python.pdf", bbox_inches="tight")
+        Results.check_constraint(params.ts, params.xs, [aline, cline])
+        Results.calc_error1(params.xs, setpoint)
+        Results.calc_energy(params.us, 0.0)
+    else:
+        Results.plot_tracking1(params.ts, params.xs, params.ys2, params.kfmeans, params.us, 2, setpoint)
+        plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-19_python.pdf", bbox_inches="tight")
+        Results.plot_ellipses2(params.ts, params.xs, params.kfmeans, params.kfcovars, [aline, cline],
+                               run["op"], True, k_squared, plot_setting, "best")
+        plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-20_python.pdf", bbox_inches="tight")
+        Results.check_constraint(params.ts, params.xs, [aline, cline])
+        Results.calc_error1(params.xs, setpoint)
+        Results.calc_energy(params.us, 0.0)
+
+    plt.show()
+
+
+def sample(rng, k_squared, linear=True, pf=False):
+    """Return the arrays of one Monte Carlo run (see MonteCarlo.Aggregate) or None if the MPC failed."""
+    run = simulate(k_squared, linear, pf, rng=rng)
+    if run is None:
+        return None
+    params = run["params"]
+    means, covars = (params.pfmeans, params.pfcovars) if pf else (params.kfmeans, params.kfcovars)
+    return dict(xs=params.xs, ys=params.ys2, us=params.us, means=means, covars=covars, setpoint=run["setpoint"])
+
+
+def simulate(k_squared, linear=True, pf=False, numerical=False, rng=None):
+    """Run one closed loop simulation and return a dict with the Params (trajectories in absolute
+    variables), the setpoint, the operating point and the KL divergences (numerical only).
+    Returns None if the MPC failed.
+    rng => stream of the noise and the PF (None => the global numpy.random state)"""
     params = closedloop_scenarios_single.closedloop_params.Params(tend)  # end time of simulation
 
     # Get the linear model
@@ -47,14 +118,14 @@ def main(nine, mcN=1, linear=True, pf=False, numerical=False):
     ysp = x_off
     usp = numpy.array([usp])
 
-    # PF functions
+    # PF functions (batched over all the particles)
     def f(x, u, w):
-        return params.cstr_model.run_reactor(x, u, params.h) + w
+        return params.cstr_model.run_reactor_batch(x, u, params.h) + w
 
     def g(x):
         return params.C2 @ x  # state observation
 
-    cstr_pf = PF.Model(f, g)
+    cstr_pf = PF.Model(f, g, batch=True)
 
     nP = 200
     if numerical:
@@ -71,15 +142,11 @@ def main(nine, mcN=1, linear=True, pf=False, numerical=False):
 
     # Set up the KF
     kf_cstr = LLDS.LLDS(A, B, params.C2, params.Q, params.R2)  # set up the KF object (measuring both states)
-    state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-    meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+    state_noise_dist = Noise.Gaussian(params.Q, rng=rng)
+    meas_noise_dist = Noise.Gaussian(params.R2, rng=rng)
 
     # Setup MPC
     horizon = 150
-    # add state constraints
-    aline = 10  # slope of constraint line ax + by + c = 0
-    cline = -411  # negative of the y axis intercept
-    bline = 1
     e = cline
 
     growvar = True
@@ -88,185 +155,105 @@ def main(nine, mcN=1, linear=True, pf=False, numerical=False):
     else:
         limu = 20000
 
-    mcdists = numpy.zeros([2, mcN])
-    xconcen = numpy.zeros([params.N, mcN])
-    mcerrs = numpy.zeros(mcN)
-
-    mciter = -1
-
     particles = None
-    while mciter < mcN-1:
-        # First time step of the simulation
+    # First time step of the simulation
+    if linear:
+        params.xs[:, 0] = init_state - b  # set simulation starting point to the random initial state
+        params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
+        temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0])  # filter
+        params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
+    else:
+        params.xs[:, 0] = init_state  # set simulation starting point to the random initial state
+        params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
+        temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0]-b)  # filter
+        params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
+
+    if pf:
         if linear:
-            params.xs[:, 0] = init_state - b  # set simulation starting point to the random initial state
-            params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
-            temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0])  # filter
-            params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
+            prior_dist = Noise.Gaussian(params.init_state_covar, mean=init_state-b)  # prior distribution
         else:
-            params.xs[:, 0] = init_state  # set simulation starting point to the random initial state
-            params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
-            temp = kf_cstr.init_filter(init_state - b, params.init_state_covar, params.ys2[:, 0]-b)  # filter
-            params.kfmeans[:, 0], params.kfcovars[:, :, 0] = temp
+            prior_dist = Noise.Gaussian(params.init_state_covar, mean=init_state)  # prior distribution
+        particles = PF.init_pf(prior_dist, nP, 2, rng)  # initialise the particles
 
-        if pf:
-            if linear:
-                prior_dist = scipy.stats.multivariate_normal(mean=init_state-b,
-                                                             cov=params.init_state_covar)  # prior distribution
-            else:
-                prior_dist = scipy.stats.multivariate_normal(mean=init_state,
-                                                             cov=params.init_state_covar)  # prior distribution
-            particles = PF.init_pf(prior_dist, nP, 2)  # initialise the particles
-
-            particles = PF.init_filter(particles, params.ys2[:, 0], meas_noise_dist, cstr_pf)
-            params.pfmeans[:, 0], params.pfcovars[:, :, 0] = PF.get_stats(particles)
+        particles = PF.init_filter(particles, params.ys2[:, 0], meas_noise_dist, cstr_pf, rng=rng)
+        params.pfmeans[:, 0], params.pfcovars[:, :, 0] = PF.get_stats(particles)
 
-            if linear:
-                params.us[0] = MPC.mpc_var(params.pfmeans[:, 0], params.kfcovars[:, :, 0], horizon,
-                                           A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                           usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get controller input
-            else:
-                params.us[0] = MPC.mpc_var(params.pfmeans[:, 0]-b, params.kfcovars[:, :, 0], horizon,
-                                           A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                           usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get controller input
+        if linear:
+            params.us[0] = MPC.mpc_var(params.pfmeans[:, 0], params.kfcovars[:, :, 0], horizon,
+                                       A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
+                                       usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get controller input
         else:
-            params.us[0] = MPC.mpc_var(params.kfmeans[:, 0], params.kfcovars[:, :, 0], horizon,
+            params.us[0] = MPC.mpc_var(params.pfmeans[:, 0]-b, params.kfcovars[:, :, 0], horizon,
                                        A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                       usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get the controller input
+                                       usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get controller input
+    else:
+        params.us[0] = MPC.mpc_var(params.kfmeans[:, 0], params.kfcovars[:, :, 0], horizon,
+                                   A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
+                                   usp[0], limu, 1000.0, params.Q, k_squared, growvar)  # get the controller input
 
-        if numerical:
-            kldiv[ndivcounter] = Auxiliary.kl(particles.x, particles.w,
-                                              params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states)
-            basediv[ndivcounter] = Auxiliary.klbase(params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states, nP)
-            unidiv[ndivcounter] = Auxiliary.kluniform(params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states, nP)
-            klts[ndivcounter] = 0.0
-            ndivcounter += 1
-        status = True
-        for t in range(1, params.N):
-            if linear:
-                params.xs[:, t] = A @ params.xs[:, t-1] + B*params.us[t-1] + state_noise_dist.rvs()  # actual plant
-                params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
-                params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t - 1],
-                                                                                     params.kfcovars[:, :, t - 1],
-                                                                                     params.us[t - 1], params.ys2[:, t])
-            else:
-                params.xs[:, t] = params.cstr_model.run_reactor(params.xs[:, t - 1], params.us[t - 1], params.h, )
-                params.xs[:, t] += state_noise_dist.rvs()  # actual plant
-                params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
-                params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
-                                                                                     params.kfcovars[:, :, t-1],
-                                                                                     params.us[t-1], params.ys2[:, t]-b)
+    if numerical:
+        kldiv[ndivcounter] = Auxiliary.kl(particles.x, particles.w,
+                                          params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states, rng)
+        basediv[ndivcounter] = Auxiliary.klbase(params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states, nP, rng)
+        unidiv[ndivcounter] = Auxiliary.kluniform(params.pfmeans[:, 0], params.pfcovars[:, :, 0], temp_states, nP,
+                                                  rng)
+        klts[ndivcounter] = 0.0
+        ndivcounter += 1
+    for t in range(1, params.N):
+        if linear:
+            params.xs[:, t] = A @ params.xs[:, t-1] + B*params.us[t-1] + state_noise_dist.rvs()  # actual plant
+            params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
+            params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t - 1],
+                                                                                 params.kfcovars[:, :, t - 1],
+                                                                                 params.us[t - 1], params.ys2[:, t])
+        else:
+            params.xs[:, t] = params.cstr_model.run_reactor(params.xs[:, t - 1], params.us[t - 1], params.h, )
+            params.xs[:, t] += state_noise_dist.rvs()  # actual plant
+            params.ys2[:, t] = params.C2 @ params.xs[:, t] + meas_noise_dist.rvs()  # measure from actual plant
+            params.kfmeans[:, t], params.kfcovars[:, :, t] = kf_cstr.step_filter(params.kfmeans[:, t-1],
+                                                                                 params.kfcovars[:, :, t-1],
+                                                                                 params.us[t-1], params.ys2[:, t]-b)
+        if pf:
+            PF.pf_filter(particles, params.us[t - 1], params.ys2[:, t], state_noise_dist, meas_noise_dist, cstr_pf,
+                         rng=rng)
+            params.pfmeans[:, t], params.pfcovars[:, :, t] = PF.get_stats(particles)
+
+        if t % 10 == 0:
             if pf:
-                PF.pf_filter(particles, params.us[t - 1], params.ys2[:, t], state_noise_dist, meas_noise_dist, cstr_pf)
-                params.pfmeans[:, t], params.pfcovars[:, :, t] = PF.get_stats(particles)
-
-            if t % 10 == 0:
-                if pf:
-                    if linear:
-                        params.us[t] = MPC.mpc_var(params.pfmeans[:, t], params.pfcovars[:, :, t], horizon,
-                                                   A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                                   usp[0], limu, 1000, params.Q, k_squared, growvar)  # controller input
-                    else:
-                        params.us[t] = MPC.mpc_var(params.pfmeans[:, t]-b, params.pfcovars[:, :, t], horizon,
-                                                   A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                                   usp[0], limu, 1000, params.Q, k_squared, growvar)  # controller input
+                if linear:
+                    params.us[t] = MPC.mpc_var(params.pfmeans[:, t], params.pfcovars[:, :, t], horizon,
+                                               A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
+                                               usp[0], limu, 1000, params.Q, k_squared, growvar)  # controller input
                 else:
-                    params.us[t] = MPC.mpc_var(params.kfmeans[:, t], params.kfcovars[:, :, t], horizon,
+                    params.us[t] = MPC.mpc_var(params.pfmeans[:, t]-b, params.pfcovars[:, :, t], horizon,
                                                A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
-                                               usp[0], limu, 1000, params.Q, k_squared, growvar)  # get controller input
-
-                if params.us[t] is None or numpy.isnan(params.us[t]):
-                    status = False
-                    break
-            else:
-                params.us[t] = params.us[t-1]
-
-            if numerical and params.ts[t] in range(0, tend, 3):
-                kldiv[ndivcounter] = Auxiliary.kl(particles.x, particles.w,
-                                                  params.pfmeans[:, t], params.pfcovars[:, :, t], temp_states)
-                basediv[ndivcounter] = Auxiliary.klbase(params.pfmeans[:, t], params.pfcovars[:, :, t], temp_states, nP)
-                unidiv[ndivcounter] = Auxiliary.kluniform(params.pfmeans[:, t],
-                                                          params.pfcovars[:, :, t],
-                                                          temp_states, nP)
-                klts[ndivcounter] = params.ts[t]
-                ndivcounter += 1
-
-        if not status:
-            continue
-        else:
-            mciter += 1
-        for i in range(len(params.kfmeans[0])):
-            params.kfmeans[:, i] += b
-            if linear:
-                params.xs[:, i] += b
-                params.ys2[:, i] += b
-
-        if mcN > 1:
-            xconcen[:, mciter] = params.xs[0, :]
-            mcerrs[mciter] = Results.calc_error1(params.xs, ysp[0] + b[0])
-            mcdists = Results.get_mc_res(params.xs, params.kfcovars, [aline, cline], mcdists, mciter, params.h)
-
-        if mcN == 1:
-            # Plot the results
-            if numerical:
-                Results.plot_kl_div(klts, kldiv, basediv, unidiv, False)
-                Results.plot_kl_div(klts, kldiv, basediv, unidiv, True)
-                print("The average divergence for the baseline is: ", 1.0 / len(klts) * sum(basediv))
-                print("The average divergence for the approximation is: ", 1.0 / len(klts) * sum(kldiv))
-                print("The average divergence for the uniform is: ", 1.0 / len(klts) * sum(unidiv))
-            elif pf:
-                Results.plot_tracking1(params.ts, params.xs, params.ys2, params.pfmeans, params.us, 2, ysp[0] + b[0])
-                plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-25_python.pdf", bbox_inches="tight")
-                Results.plot_ellipses2(params.ts, params.xs, params.pfmeans, params.pfcovars, [aline, cline],
-                                       linsystems[1].op, True, -2.0 * numpy.log(1 - 0.9), plot_setting, "best")
-                plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-26_python.pdf", bbox_inches="tight")
-                Results.check_constraint(params.ts, params.xs, [aline, cline])
-                Results.calc_error1(params.xs, ysp[0] + b[0])
-                Results.calc_energy(params.us, 0.0)
+                                               usp[0], limu, 1000, params.Q, k_squared, growvar)  # controller input
             else:
-                Results.plot_tracking1(params.ts, params.xs, params.ys2, params.kfmeans, params.us, 2, ysp[0]+b[0])
-                plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-19_python.pdf", bbox_inches="tight")
-                Results.plot_ellipses2(params.ts, params.xs, params.kfmeans, params.kfcovars, [aline, cline],
-                                       linsystems[opoint].op, True, k_squared, plot_setting, "best")
-                plt.savefig("/home/ex/Documents/CSC/report/results/Figure_8-20_python.pdf", bbox_inches="tight")
-                Results.check_constraint(params.ts, params.xs, [aline, cline])
-                Results.calc_error1(params.xs, ysp[0]+b[0])
-                Results.calc_energy(params.us, 0.0)
-
-            plt.show()
-
-    if mcN != 1:
-        print("The absolute MC average error is: ", sum(abs(mcerrs)) / mcN)
-        if linear:
-            if pf:
-                numpy.savetxt("linmod_pf_var{}_mc2.csv".format(nine), xconcen, delimiter=",", fmt="%f")
-            else:
-                numpy.savetxt("linmod_kf_var{}_mc2.csv".format(nine), xconcen, delimiter=",", fmt="%f")
+                params.us[t] = MPC.mpc_var(params.kfmeans[:, t], params.kfcovars[:, :, t], horizon,
+                                           A, numpy.matrix(B), b, aline, bline, e, params.QQ, params.RR, ysp,
+                                           usp[0], limu, 1000, params.Q, k_squared, growvar)  # get controller input
+
+            if params.us[t] is None or numpy.isnan(params.us[t]):
+                return None
         else:
-            if pf:
-                numpy.savetxt("nonlinmod_pf_var{}_mc2.csv".format(nine), xconcen, delimiter=",", fmt="%f")
-            else:
-                numpy.savetxt("nonlinmod_kf_var{}_mc2.csv".format(nine), xconcen, delimiter=",", fmt="%f")
+            params.us[t] = params.us[t-1]
 
-        nocount = len(mcdists[0]) - numpy.count_nonzero(mcdists[0])
-        filteredResults = numpy.zeros([2, mcN - nocount])
-        counter = 0
-        for k in range(mcN):
-            if mcdists[0, k] != 0.0:
-                filteredResults[:, counter] = mcdists[:, k]
-                counter += 1
+        if numerical and params.ts[t] in range(0, tend, 3):
+            kldiv[ndivcounter] = Auxiliary.kl(particles.x, particles.w,
+                                              params.pfmeans[:, t], params.pfcovars[:, :, t], temp_states, rng)
+            basediv[ndivcounter] = Auxiliary.klbase(params.pfmeans[:, t], params.pfcovars[:, :, t], temp_states, nP,
+                                                    rng)
+            unidiv[ndivcounter] = Auxiliary.kluniform(params.pfmeans[:, t],
+                                                      params.pfcovars[:, :, t],
+                                                      temp_states, nP, rng)
+            klts[ndivcounter] = params.ts[t]
+            ndivcounter += 1
 
+    for i in range(len(params.kfmeans[0])):
+        params.kfmeans[:, i] += b
         if linear:
-            if pf:
-                numpy.savetxt("linmod_pf_var{}_mc.csv".format(nine), filteredResults, delimiter=",",
-                              fmt="%f")
-            else:
-                numpy.savetxt("linmod_kf_var{}_mc.csv".format(nine), filteredResults, delimiter=",",
-                              fmt="%f")
-        else:
-            if pf:
-                numpy.savetxt("nonlinmod_pf_var{}_mc.csv".format(nine), filteredResults, delimiter=",",
-                              fmt="%f")
-            else:
-                numpy.savetxt("nonlinmod_kf_var{}_mc.csv".format(nine), filteredResults, delimiter=",",
-                              fmt="%f")
+            params.xs[:, i] += b
+            params.ys2[:, i] += b
 
+    return dict(params=params, setpoint=ysp[0] + b[0], op=linsystems[opoint].op,
+                klts=klts, kldiv=kldiv, basediv=basediv, unidiv=unidiv)
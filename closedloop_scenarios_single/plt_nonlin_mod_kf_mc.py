@@ -1,8 +1,8 @@
 # Plot the Linear Model KF MC results
 import matplotlib as mpc
 import matplotlib.pyplot as plt
-import pandas
 import numpy
+import src.MonteCarlo as MonteCarlo
 import src.Auxiliary as Auxiliary
 import src.Ellipse as Ellipse
 
@@ -19,10 +19,10 @@ mpc.rc("figure", figsize=(6.0, 3))
 mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 
-mc1 = abs(pandas.read_csv("nonlinmod_kf_mean.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("nonlinmod_kf_var90.csv", header=None).as_matrix())
-mc3 = abs(pandas.read_csv("nonlinmod_kf_var99.csv", header=None).as_matrix())
-mc4 = abs(pandas.read_csv("nonlinmod_kf_var999.csv", header=None).as_matrix())
+mc1 = abs(MonteCarlo.load_violations("nonlinmod_kf_mean"))
+mc2 = abs(MonteCarlo.load_violations("nonlinmod_kf_var90"))
+mc3 = abs(MonteCarlo.load_violations("nonlinmod_kf_var99"))
+mc4 = abs(MonteCarlo.load_violations("nonlinmod_kf_var999"))
 
 mc1 = Auxiliary.remove_outliers(mc1, 3)
 mc2 = Auxiliary.remove_outliers(mc2, 3)
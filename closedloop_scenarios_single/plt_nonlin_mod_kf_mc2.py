@@ -2,7 +2,7 @@
 import matplotlib as mpc
 import matplotlib.pyplot as plt
 import numpy
-import pandas
+import src.MonteCarlo as MonteCarlo
 import src.Results as Results
 
 # mcN = 50
@@ -16,10 +16,10 @@ mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 
 
-mc1 = abs(pandas.read_csv("nonlinmod_kf_mean_mc2.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("nonlinmod_kf_var90_mc2.csv", header=None).as_matrix())
-mc3 = abs(pandas.read_csv("nonlinmod_kf_var99_mc2.csv", header=None).as_matrix())
-mc4 = abs(pandas.read_csv("nonlinmod_kf_var999_mc2.csv", header=None).as_matrix())
+mc1 = abs(MonteCarlo.load_concentrations("nonlinmod_kf_mean"))
+mc2 = abs(MonteCarlo.load_concentrations("nonlinmod_kf_var90"))
+mc3 = abs(MonteCarlo.load_concentrations("nonlinmod_kf_var99"))
+mc4 = abs(MonteCarlo.load_concentrations("nonlinmod_kf_var999"))
 
 
 rows, cols = mc1.shape  # all will have the same dimension
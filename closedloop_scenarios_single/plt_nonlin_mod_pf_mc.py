@@ -1,8 +1,8 @@
 # Plot the Linear Model KF MC results
 import matplotlib as mpc
 import matplotlib.pyplot as plt
-import pandas
 import numpy
+import src.MonteCarlo as MonteCarlo
 import src.Auxiliary as Auxiliary
 import src.Ellipse as Ellipse
 
@@ -15,10 +15,10 @@ mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 mpc.rc("figure", figsize=(6.0, 3))
 
-mc1 = abs(pandas.read_csv("nonlinmod_kf_mean.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("nonlinmod_kf_var90.csv", header=None).as_matrix())
-mc3 = abs(pandas.read_csv("nonlinmod_pf_mean.csv", header=None).as_matrix())
-mc4 = abs(pandas.read_csv("nonlinmod_pf_var90.csv", header=None).as_matrix())
+mc1 = abs(MonteCarlo.load_violations("nonlinmod_kf_mean"))
+mc2 = abs(MonteCarlo.load_violations("nonlinmod_kf_var90"))
+mc3 = abs(MonteCarlo.load_violations("nonlinmod_pf_mean"))
+mc4 = abs(MonteCarlo.load_violations("nonlinmod_pf_var90"))
 
 
 mc1 = Auxiliary.remove_outliers(mc1, 3)
@@ -2,7 +2,7 @@
 import matplotlib as mpc
 import matplotlib.pyplot as plt
 import numpy
-import pandas
+import src.MonteCarlo as MonteCarlo
 import src.Results as Results
 
 # mcN = 50
@@ -13,8 +13,8 @@ mpc.rc("font", family="serif", serif="Computer Modern", size=8)
 mpc.rc("text", usetex=True)
 mpc.rc("figure", figsize=(6.0, 3))
 
-mc1 = abs(pandas.read_csv("nonlinmod_pf_mean_mc2.csv", header=None).as_matrix())
-mc2 = abs(pandas.read_csv("nonlinmod_pf_var90_mc2.csv", header=None).as_matrix())
+mc1 = abs(MonteCarlo.load_concentrations("nonlinmod_pf_mean"))
+mc2 = abs(MonteCarlo.load_concentrations("nonlinmod_pf_var90"))
 
 
 rows, cols = mc1.shape  # all will have the same dimension
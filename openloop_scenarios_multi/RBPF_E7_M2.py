@@ -1,10 +1,10 @@
 # Implement the augmented switching dynamical system
 
 import numpy
-import scipy.stats
 import openloop.params as params
 import src.Results as Results
 import src.RBPF as RBPF
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 
 tend = 150
@@ -38,8 +38,8 @@ switchtrack = numpy.zeros([len(linsystems), params.N])
 maxtrack = numpy.zeros([len(linsystems), params.N])
 smoothedtrack = numpy.zeros([len(linsystems), params.N])
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R2, block=params.N)
 
 params.xs[:, 0] = init_state
 params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measured from actual plant
@@ -1,11 +1,11 @@
 # Inference using two nonlinear models measuring only temperature
 
 import numpy
-import scipy.stats
 import openloop.params as params
 import src.Results as Results
 import src.RBPF as RBPF
 import src.SPF as SPF
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 
 tend = 300
@@ -19,11 +19,11 @@ A = numpy.array([[0.99, 0.01],
 
 
 def fun1(x, u, w):
-    return params.cstr_model.run_reactor(x, u, params.h) + w
+    return params.cstr_model.run_reactor_batch(x, u, params.h) + w
 
 
 def fun2(x, u, w):
-    return params.cstr_model_broken.run_reactor(x, u, params.h) + w
+    return params.cstr_model_broken.run_reactor_batch(x, u, params.h) + w
 
 
 def gs(x):
@@ -34,12 +34,12 @@ F = [fun1, fun2]
 G = [gs, gs]
 numSwitches = 2
 
-ydists = numpy.array([scipy.stats.multivariate_normal(cov=params.R1), scipy.stats.multivariate_normal(cov=params.R1)])
-xdists = numpy.array([scipy.stats.multivariate_normal(cov=params.Q), scipy.stats.multivariate_normal(cov=params.Q)])
-cstr_filter = SPF.Model(F, G, A, xdists, ydists)
+ydists = numpy.array([Noise.Gaussian(params.R1), Noise.Gaussian(params.R1)])
+xdists = numpy.array([Noise.Gaussian(params.Q), Noise.Gaussian(params.Q)])
+cstr_filter = SPF.Model(F, G, A, xdists, ydists, batch=True)
 
 nP = 500
-xdist = scipy.stats.multivariate_normal(mean=init_state, cov=params.init_state_covar)
+xdist = Noise.Gaussian(params.init_state_covar, mean=init_state)
 sdist = [0.9, 0.1]
 particles = SPF.init_spf(xdist, sdist, nP, 2)
 
@@ -47,8 +47,8 @@ switchtrack = numpy.zeros([2, params.N])
 maxtrack = numpy.zeros([numSwitches, params.N])
 smoothedtrack = numpy.zeros([numSwitches, params.N])
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R1)
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)
+meas_noise_dist = Noise.Gaussian(params.R1, block=params.N)
 
 params.xs[:, 0] = init_state
 params.xsnofix[:, 0] = init_state
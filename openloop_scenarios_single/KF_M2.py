@@ -5,7 +5,7 @@ import numpy
 import openloop.params
 import src.LLDS as LLDS
 import src.Results as Results
-import scipy.stats
+import src.Noise as Noise
 
 tend = 50
 
@@ -26,8 +26,8 @@ params.xs[:, 0] = init_state
 params.linxs[:, 0] = init_state - b
 
 # Simulate plant
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)  # state distribution
-meas_noise_dist = scipy.stats.multivariate_normal(cov=lin_cstr.R)  # measurement distribution
+state_noise_dist = Noise.Gaussian(params.Q, block=params.N)  # state distribution
+meas_noise_dist = Noise.Gaussian(lin_cstr.R, block=params.N)  # measurement distribution
 params.ys2[:, 0] = params.C2 @ params.xs[:, 0] + meas_noise_dist.rvs()  # measure from actual plant
 
 # Filter setup
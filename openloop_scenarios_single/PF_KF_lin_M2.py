@@ -4,10 +4,10 @@
 import openloop.params
 import numpy
 import src.PF as PF
-import scipy.stats
 import src.Results as Results
 import matplotlib.pyplot as plt
 import src.LLDS as LLDS
+import src.Noise as Noise
 
 tend = 20
 params = openloop.params.Params(tend)
@@ -38,11 +38,11 @@ cstr_pf = PF.Model(f, g)
 nP = 500  # number of particles.
 
 # Initialise the PFs
-init_pf_dist = scipy.stats.multivariate_normal(mean=init_state-b, cov=params.init_state_covar)  # prior distribution
+init_pf_dist = Noise.Gaussian(params.init_state_covar, mean=init_state-b)  # prior distribution
 particles = PF.init_pf(init_pf_dist, nP, 2)  # initialise the particles
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)  # state distribution
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R2)  # measurement distribution
+state_noise_dist = Noise.Gaussian(params.Q)  # state distribution
+meas_noise_dist = Noise.Gaussian(params.R2)  # measurement distribution
 
 pfmeans = numpy.zeros([2, params.N])
 pfcovars = numpy.zeros([2, 2, params.N])
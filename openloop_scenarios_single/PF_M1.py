@@ -2,8 +2,8 @@
 import openloop.params
 import numpy
 import src.PF as PF
-import scipy.stats
 import src.Results as Results
+import src.Noise as Noise
 import matplotlib.pyplot as plt
 
 tend = 50
@@ -24,11 +24,11 @@ cstr_pf = PF.Model(f, g)  # PF object
 
 # Initialise the PF
 nP = 200  # number of particles.
-prior_dist = scipy.stats.multivariate_normal(mean=init_state, cov=params.init_state_covar)  # prior distribution
+prior_dist = Noise.Gaussian(params.init_state_covar, mean=init_state)  # prior distribution
 particles = PF.init_pf(prior_dist, nP, 2)  # initialise the particles
 
-state_noise_dist = scipy.stats.multivariate_normal(cov=params.Q)  # state distribution
-meas_noise_dist = scipy.stats.multivariate_normal(cov=params.R1)  # measurement distribution
+state_noise_dist = Noise.Gaussian(params.Q)  # state distribution
+meas_noise_dist = Noise.Gaussian(params.R1)  # measurement distribution
 
 # Time step 1
 params.xs[:, 0] = init_state
@@ -3,13 +3,16 @@ import scipy.stats
 import numpy
 import matplotlib as mpc
 import matplotlib.pyplot as plt
+import src.Noise as Noise
+import src.RNG as RNG
 
 
 print("Auxiliary is hardcoded for the CSTR!")
 
 
-def kl(part_states, part_weights, m, S, temp_states):
-    """Discrete Kullback-Leibler divergence test wrt a multivariate normal model."""
+def kl(part_states, part_weights, m, S, temp_states, rng=None):
+    """Discrete Kullback-Leibler divergence test wrt a multivariate normal model.
+    rng => stream of the resampled particles (see the RNG module)"""
 
     sweights = 1.0 - sum(part_weights)
     N = len(part_weights)
@@ -20,67 +23,47 @@ def kl(part_states, part_weights, m, S, temp_states):
         part_weights += (1 / N) * sweights
         print("Particle weights adjusted by ", sweights, " in Auxiliary!")
 
-    dnorm = scipy.stats.multivariate_normal(mean=m, cov=S)
-
-    for k in range(N):
-        j = numpy.random.choice(range(len(part_weights)), size=1, p=part_weights)
-        temp_states[:, k] = part_states[:, j].T[0]
-
-    estden = scipy.stats.gaussian_kde(temp_states)
-
-    kldiv = 0.0
-    for k in range(N):
-        # draw from samplesw
-        kldiv += -dnorm.logpdf(temp_states[:, k]) + estden.logpdf([temp_states[0, k], temp_states[1, k]])
-
-    return (1.0/N)*kldiv
+    dnorm = Noise.Gaussian(S, mean=m)
 
+    j = RNG.get(rng).choice(N, size=N, p=part_weights)  # resample the particles
+    temp_states[:, :N] = part_states[:, j]
 
-def klbase(m, S, temp_states, N):
+    return divergence(dnorm, temp_states[:, :N])
 
-    dnorm = scipy.stats.multivariate_normal(mean=m, cov=S)
 
-    for k in range(N):
-        temp_states[:, k] = dnorm.rvs()
-
-    estden = scipy.stats.gaussian_kde(temp_states)
+def klbase(m, S, temp_states, N, rng=None):
 
-    kldiv = 0.0
-    for k in range(N):
-        # draw from samplesw
-        kldiv += -dnorm.logpdf(temp_states[:, k]) + estden.logpdf([temp_states[0, k], temp_states[1, k]])
+    dnorm = Noise.Gaussian(S, mean=m)
+    temp_states[:, :N] = dnorm.sample(N, rng).T
 
-    return (1.0/N)*kldiv
+    return divergence(dnorm, temp_states[:, :N])
 
 
-def kluniform(m, S, temp_states, N):
+def kluniform(m, S, temp_states, N, rng=None):
 
     s11 = S[0, 0]
     s22 = S[1, 1]
 
-    dnorm = scipy.stats.multivariate_normal(mean=m, cov=S)
+    dnorm = Noise.Gaussian(S, mean=m)
 
     m1 = [m[0] - numpy.sqrt(s11)*2, m[0] + numpy.sqrt(s11)*2]
     m2 = [m[1] - numpy.sqrt(s22)*2, m[1] + numpy.sqrt(s22)*2]
 
-    dnorm1 = scipy.stats.uniform()
-    dnorm2 = scipy.stats.uniform()
+    u = RNG.get(rng).uniform(size=(2, N))
+    temp_states[0, :N] = u[0] * (max(m1) - min(m1)) + min(m1)
+    temp_states[1, :N] = u[1] * (max(m2) - min(m2)) + min(m2)
 
-    for k in range(N):
-        temp_states[0, k] = dnorm1.rvs() * (max(m1) - min(m1)) + min(m1)
-        temp_states[1, k] = dnorm2.rvs() * (max(m2) - min(m2)) + min(m2)
-
-    estden = scipy.stats.gaussian_kde(temp_states)
+    return divergence(dnorm, temp_states[:, :N])
 
-    kldiv = 0.0
-    for k in range(N):
-        # draw from samplesw
-        kldiv += -dnorm.logpdf(temp_states[:, k]) + estden.logpdf([temp_states[0, k], temp_states[1, k]])
 
-    return (1.0/N)*kldiv
+def divergence(dnorm, samples):
+    """Return the Monte Carlo estimate of KL(q || dnorm) where q is the kernel density
+    estimate of the (2, N) samples drawn from it."""
+    estden = scipy.stats.gaussian_kde(samples)
+    return numpy.mean(estden.logpdf(samples) - dnorm.logpdf(samples.T))
 
 
-def show_estimated_density(part_states, part_weights, temp_states):
+def show_estimated_density(part_states, part_weights, temp_states, rng=None):
     """Discrete Kullback-Leibler divergence test wrt a multivariate normal model."""
 
     sweights = 1.0 - sum(part_weights)
@@ -94,7 +77,7 @@ def show_estimated_density(part_states, part_weights, temp_states):
         print("Particle weights adjusted by ", sweights, " in Auxiliary!")
 
     for k in range(N):
-        j = numpy.random.choice(range(len(part_weights)), size=1, p=part_weights)
+        j = RNG.get(rng).choice(range(len(part_weights)), size=1, p=part_weights)
         temp_states[:, k] = part_states[:, j]
 
     estden = scipy.stats.gaussian_kde(temp_states)
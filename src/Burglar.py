@@ -1,15 +1,16 @@
 import numpy
-import random
 
 from . import HMM
+from . import RNG
 
 
 class House:
-    def __init__(self, n):
+    def __init__(self, n, rng=None):
         self.n = n
-        self.creaks = numpy.random.randint(0, 2, size=(n, n))
-        self.bumps = numpy.random.randint(0, 2, size=(n, n))
-        self.burglar = int(random.random()*self.n)
+        self.rng = RNG.get(rng)  # see the RNG module
+        self.creaks = (self.rng.uniform(size=(n, n)) < 0.5).astype(int)
+        self.bumps = (self.rng.uniform(size=(n, n)) < 0.5).astype(int)
+        self.burglar = int(self.rng.uniform()*self.n)
         self.burglar = 15
         self.floor = numpy.zeros([n, n])
         self.floor[self.burglar//n][self.burglar % n] = 1
@@ -71,7 +72,7 @@ class House:
         """Move the burglar"""
         moves = self.get_legal_moves(self.burglar)
         self.floor[self.burglar//self.n][self.burglar % self.n] = 0
-        self.burglar = moves[int(random.random()*len(moves))]
+        self.burglar = moves[int(self.rng.uniform()*len(moves))]
         self.floor[self.burglar//self.n][self.burglar % self.n] = 1
 
     def get_location(self):
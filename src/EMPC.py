@@ -0,0 +1,185 @@
+# Explicit MPC: the mpc_mean problem solved offline into a piecewise affine control law.
+# For fixed setpoints and limits the optimal first move of the QP is an affine function
+# u_0 = K @ x0 + k of the initial state on each critical region (the set of initial states
+# that share the same active constraints). The regions are found by solving the QP on a
+# grid of initial states. Online the grid doubles as a point location index: the regions
+# seen at the corners of the cell containing x0 are the only candidates that are checked.
+# Outside the table the online QP is solved instead.
+import numpy
+import scipy.sparse
+import scipy.sparse.linalg
+import src.MPC as MPC
+
+
+class Table:
+    """Piecewise affine control law of the mpc_mean problem over the box lower <= x0 <= upper.
+    Region r has the law u_0 = K[r] @ x0 + k[r] and is {x0: H @ x0 <= h} using the rows
+    offsets[r]:offsets[r+1] of H and h. index[c] lists the candidate regions of grid cell c."""
+    def __init__(self, problem, lower, upper, n, K, k, H, h, offsets, index, tol=1e-6):
+        self.problem = problem  # arguments of the online problem (see build)
+        self.lower = lower
+        self.upper = upper
+        self.n = n
+        self.step = (upper - lower) / (n - 1)
+        self.K = K
+        self.k = k
+        self.H = H
+        self.h = h
+        self.offsets = offsets
+        self.index = index
+        self.tol = tol
+        self.controller = None
+
+    def locate(self, x0):
+        """Return the region containing x0 (-1 if it is not in the table)."""
+        if numpy.any(x0 < self.lower) or numpy.any(x0 > self.upper):
+            return -1
+        cell = numpy.minimum(((x0 - self.lower) / self.step).astype(int), self.n - 2)
+        for r in self.index[numpy.ravel_multi_index(cell, [self.n - 1] * len(cell))]:
+            if r < 0:
+                break
+            start, end = self.offsets[r], self.offsets[r + 1]
+            if numpy.all(self.H[start:end] @ x0 <= self.h[start:end] + self.tol):
+                return r
+        return -1
+
+    def control(self, x0, solver=None):
+        """Return the control input: from the table if possible otherwise from the online QP."""
+        r = self.locate(x0)
+        if r >= 0:
+            return self.K[r] @ x0 + self.k[r]
+        p = self.problem
+        if self.controller is None:
+            self.controller = MPC.get_controller(int(p["N"]), p["A"], p["B"], p["QQ"], p["RR"], p["aline"], p["bline"])
+        return self.controller.mean(x0, p["b"], float(p["cline"]), p["ysp"], p["usp"], float(p["lim_u"]),
+                                    float(p["lim_step_u"]), p["d"], solver)
+
+    def save(self, path):
+        """Serialise the table (and the problem it solves) with numpy.savez."""
+        problem = {"problem_" + key: value for key, value in self.problem.items()}
+        numpy.savez(path, lower=self.lower, upper=self.upper, n=self.n, K=self.K, k=self.k, H=self.H, h=self.h,
+                    offsets=self.offsets, index=self.index, tol=self.tol, **problem)
+
+
+def load(path):
+    """Return the Table saved in path."""
+    with numpy.load(path) as data:
+        problem = {key[len("problem_"):]: data[key] for key in data.files if key.startswith("problem_")}
+        return Table(problem, data["lower"], data["upper"], int(data["n"]), data["K"], data["k"], data["H"],
+                     data["h"], data["offsets"], data["index"], float(data["tol"]))
+
+
+def affine_law(controller, lower_rows, upper_rows, d):
+    """Return the affine maps x0 -> (x, multipliers of the active rows) for an active set.
+    The active rows of GG are treated as equalities and the KKT system is solved for the
+    constant term and for a unit change in each entry of x0. Returns None if the active
+    constraints are linearly dependent."""
+    N, nx = controller.N, controller.nx
+    n = controller.P.shape[0]
+    active = numpy.hstack([lower_rows, upper_rows])
+    bounds = numpy.hstack([controller.limits.value, -controller.ulimits.value])[lower_rows]
+    bounds = numpy.hstack([bounds, controller.ulimits.value[upper_rows - N]])
+    Ceq = scipy.sparse.vstack([controller.AA, controller.GG[active]])
+    KKT = scipy.sparse.bmat([[controller.P, Ceq.T], [Ceq, None]], format="csc")
+    try:
+        solve = scipy.sparse.linalg.factorized(KKT)
+    except RuntimeError:
+        return None
+    rhs = numpy.zeros([KKT.shape[0], nx + 1])  # columns: x0 entries and the constant
+    rhs[n: n + nx, :nx] = -numpy.eye(nx)  # bb = [-x0, -d, ..., -d]
+    rhs[n + nx: n + (N + 1) * nx, nx] = numpy.tile(-d, N)
+    rhs[:n, nx] = -controller.q.value
+    rhs[n + (N + 1) * nx:, nx] = bounds
+    Z = numpy.column_stack([solve(rhs[:, i]) for i in range(nx + 1)])
+    if not numpy.all(numpy.isfinite(Z)):
+        return None
+    return Z[:n], Z[n + (N + 1) * nx:]
+
+
+def region(controller, lower_rows, upper_rows, X, multipliers):
+    """Return (H, h) with H @ x0 <= h for the critical region of an active set."""
+    N = controller.N
+    L = numpy.hstack([controller.limits.value, -controller.ulimits.value])
+    U = numpy.hstack([[numpy.inf] * N, controller.ulimits.value])
+    GX = controller.GG @ X
+    inactive = numpy.ones(len(L), dtype=bool)
+    inactive[lower_rows] = False
+    inactive[upper_rows] = False
+    upper = inactive & numpy.isfinite(U)
+    lower = inactive & numpy.isfinite(L)
+    nlower = len(lower_rows)
+    # inactive rows stay within their bounds and the multipliers have the right sign
+    # (negative for the active lower bounds and positive for the active upper bounds)
+    H = numpy.vstack([GX[upper, :-1], -GX[lower, :-1], multipliers[:nlower, :-1], -multipliers[nlower:, :-1]])
+    h = numpy.hstack([U[upper] - GX[upper, -1], GX[lower, -1] - L[lower],
+                      -multipliers[:nlower, -1], multipliers[nlower:, -1]])
+    return H, h
+
+
+def build(N, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, lower, upper, n=21,
+          d=numpy.zeros(2), solver=None, tol=1e-6):
+    """Return the Table of the mpc_mean problem (same arguments, except x0) for the initial
+    states in the box lower <= x0 <= upper. The QP is solved on an n point grid per state."""
+    lower = numpy.asarray(lower, dtype=float)
+    upper = numpy.asarray(upper, dtype=float)
+    controller = MPC.get_controller(N, A, B, QQ, RR, aline, bline)
+    nx, nu = controller.nx, controller.nu
+    start = (N + 1) * nx
+    mid = 0.5 * (upper + lower)
+    half = 0.5 * (upper - lower)
+
+    grid = numpy.meshgrid(*[numpy.linspace(lower[i], upper[i], n) for i in range(nx)], indexing="ij")
+    points = numpy.column_stack([g.ravel() for g in grid])
+    labels = numpy.full(len(points), -1)
+    regions = {}  # active set -> region number
+    Ks, ks, Hs, hs = [], [], [], []
+    for p, x0 in enumerate(points):
+        u0 = controller.mean(x0, b, cline, ysp, usp, lim_u, lim_step_u, d, solver)
+        if u0 is None:
+            continue
+        x = numpy.ravel(controller.x.value)
+        Gx = controller.GG @ x
+        L = numpy.hstack([controller.limits.value, -controller.ulimits.value])
+        U = numpy.hstack([[numpy.inf] * N, controller.ulimits.value])
+        lower_rows = numpy.where(numpy.isfinite(L) & (Gx - L <= tol * (1 + abs(L))))[0]
+        upper_rows = numpy.where(numpy.isfinite(U) & (U - Gx <= tol * (1 + abs(U))))[0]
+        key = (lower_rows.tobytes(), upper_rows.tobytes())
+        if key not in regions:
+            law = affine_law(controller, lower_rows, upper_rows, d)
+            if law is None:
+                continue
+            X, multipliers = law
+            K = X[start: start + nu, :-1]
+            k = X[start: start + nu, -1]
+            if abs(K @ x0 + k - u0).max() > 1e-3 * (1 + abs(u0).max()):
+                continue  # wrong active set (the solver is not accurate enough here)
+            H, h = region(controller, lower_rows, upper_rows, X, multipliers)
+            norms = numpy.linalg.norm(H, axis=1)
+            keep = norms > 0
+            H, h = H[keep] / norms[keep, None], h[keep] / norms[keep]
+            keep = H @ mid + abs(H) @ half > h  # drop the rows that hold over the whole box
+            regions[key] = len(Ks)
+            Ks.append(K)
+            ks.append(k)
+            Hs.append(H[keep])
+            hs.append(h[keep])
+        labels[p] = regions[key]
+
+    # candidate regions of each grid cell are the ones found at its corners
+    labels = labels.reshape([n] * nx)
+    corners = numpy.array(numpy.meshgrid(*[[0, 1]] * nx, indexing="ij")).reshape(nx, -1).T
+    cells = [labels[tuple(slice(c, c + n - 1) for c in corner)].ravel() for corner in corners]
+    cells = numpy.column_stack(cells)
+    candidates = [numpy.unique(c[c >= 0]) for c in cells]
+    index = numpy.full([len(candidates), max(1, max(len(c) for c in candidates))], -1)
+    for i, c in enumerate(candidates):
+        index[i, :len(c)] = c
+
+    problem = dict(N=N, A=numpy.asarray(A), B=numpy.asarray(B), QQ=numpy.asarray(QQ), RR=numpy.asarray(RR),
+                   aline=aline, bline=bline, b=numpy.asarray(b), cline=cline, ysp=numpy.asarray(ysp),
+                   usp=numpy.asarray(usp), lim_u=lim_u, lim_step_u=lim_step_u, d=numpy.asarray(d))
+    offsets = numpy.cumsum([0] + [len(h) for h in hs])
+    H = numpy.vstack(Hs) if Hs else numpy.zeros([0, nx])
+    h = numpy.hstack(hs) if hs else numpy.zeros(0)
+    return Table(problem, lower, upper, n, numpy.array(Ks).reshape(-1, nu, nx), numpy.array(ks).reshape(-1, nu),
+                 H, h, offsets, index, tol)
@@ -1,4 +1,5 @@
 import numpy
+import scipy.linalg
 
 
 class LLDS:
@@ -12,13 +13,42 @@ class LLDS:
     I assume the simplest self I will deal with has matrix A, B and float C therefore
     the slightly parametric type. Also that specific simple case has only one input.
     this is to avoid ugly notation later.
+    If steady is True the steady state Kalman gain is precomputed and used by the
+    filter once the covariance has converged to the steady state solution (within tol).
     """
-    def __init__(self, A, B, C, Q, R):
+    def __init__(self, A, B, C, Q, R, steady=False, tol=1e-6):
         self.A = A
         self.B = B
         self.C = C
         self.Q = Q  # Process Noise
         self.R = R  # Measurement Noise VARIANCE
+        self.steady = steady
+        self.tol = tol  # relative tolerance used to detect convergence to the steady state
+        self.ss_pvar = None  # steady state predicted covariance
+        self.ss_var = None  # steady state filtered covariance
+        self.ss_gain = None  # steady state Kalman gain
+        self.ss_A = None
+        self.ss_B = None
+        self.sqrt_Q = None  # Cholesky factors used by the square root filter
+        self.sqrt_R = None
+        if steady:
+            self.steady_state()
+
+    def steady_state(self):
+        """Precompute the steady state solution of the Riccati equation and the Kalman gain."""
+        C = numpy.atleast_2d(self.C)
+        R = numpy.atleast_2d(self.R)
+        rows, cols = numpy.shape(self.A)
+        self.ss_pvar = scipy.linalg.solve_discrete_are(numpy.transpose(self.A), numpy.transpose(C), self.Q, R)
+        temp = C @ self.ss_pvar @ numpy.transpose(C) + R
+        self.ss_gain = numpy.linalg.solve(temp, C @ self.ss_pvar).T  # symmetric so no inversion is necessary
+        self.ss_var = (numpy.eye(rows) - self.ss_gain @ C) @ self.ss_pvar
+        self.ss_A = (numpy.eye(rows) - self.ss_gain @ C) @ self.A  # the filter is now x(t) = ss_A x + ss_B u + K y
+        self.ss_B = (numpy.eye(rows) - self.ss_gain @ C) @ self.B
+
+    def is_steady(self, var, ss_var):
+        """Return True if var has converged to the steady state covariance ss_var."""
+        return self.steady and abs(var - ss_var).max() <= self.tol*abs(ss_var).max()
 
     def step(self, xprev, uprev):
         """Controlled, move multivariate self one time step forward."""
@@ -34,6 +64,9 @@ class LLDS:
 
     def step_filter(self, prevmean, prevvar, uprev, ynow):
         """Return the posterior over the current state given the observation and previous filter result."""
+        if self.is_steady(prevvar, self.ss_var):
+            updatedMean = self.ss_A @ prevmean + self.ss_B*uprev + self.ss_gain @ numpy.atleast_1d(ynow)
+            return updatedMean, numpy.copy(self.ss_var)
         pmean, pvar = self.step_predict(prevmean, prevvar, uprev)
         updatedMean, updatedVar = self.step_update(pmean, pvar, ynow)
         return updatedMean, updatedVar
@@ -46,6 +79,9 @@ class LLDS:
 
     def step_update(self, pmean, pvar, ymeas):
         """Return the one step ahead measurement updated mean and covar."""
+        if self.is_steady(pvar, self.ss_pvar):
+            updatedMean = pmean + self.ss_gain @ numpy.atleast_1d(ymeas - self.C @ pmean)
+            return updatedMean, numpy.copy(self.ss_var)
         temp = self.C @ pvar @ numpy.transpose(self.C)
         inverse = numpy.linalg.inv(temp + self.R)
         temp2 = pvar @ numpy.transpose(self.C)
@@ -62,6 +98,46 @@ class LLDS:
         updatedVar = (numpy.eye(rows) - kalmanGain @ self.C) @ pvar
         return updatedMean, updatedVar
 
+    def init_filter_sqrt(self, initmean, initvar, ynow):
+        """Square root version of init_filter. Returns the updated mean and the lower
+        Cholesky factor S of the updated covariance (covariance = S S')."""
+        return self.step_update_sqrt(initmean, numpy.linalg.cholesky(initvar), ynow)
+
+    def step_filter_sqrt(self, prevmean, prevsqrt, uprev, ynow):
+        """Square root version of step_filter. The covariances are propagated as their lower
+        Cholesky factors which keeps them symmetric and positive definite over long horizons."""
+        pmean, psqrt = self.step_predict_sqrt(prevmean, prevsqrt, uprev)
+        return self.step_update_sqrt(pmean, psqrt, ynow)
+
+    def step_predict_sqrt(self, xprev, sqrtprev, uprev):
+        """Return the one step ahead predicted mean and the Cholesky factor of the covariance.
+        The factor is the triangular part of the QR decomposition of [A S, sqrt(Q)]'."""
+        if self.sqrt_Q is None:
+            self.sqrt_Q = numpy.linalg.cholesky(self.Q)
+        pmean = self.A @ xprev + self.B*uprev
+        prearray = numpy.hstack([self.A @ sqrtprev, self.sqrt_Q])
+        psqrt = tria(prearray)
+        return pmean, psqrt
+
+    def step_update_sqrt(self, pmean, psqrt, ymeas):
+        """Return the measurement updated mean and Cholesky factor of the covariance.
+        Uses the array form of the square root filter: triangularising
+        [[sqrt(R), C S], [0, S]] gives [[sqrt(C P C' + R), 0], [K sqrt(C P C' + R), S_updated]]
+        so no explicit inverse is required."""
+        C = numpy.atleast_2d(self.C)
+        if self.sqrt_R is None:
+            self.sqrt_R = numpy.linalg.cholesky(numpy.atleast_2d(self.R))
+        nY, nX = C.shape
+        prearray = numpy.vstack([numpy.hstack([self.sqrt_R, C @ psqrt]),
+                                 numpy.hstack([numpy.zeros([nX, nY]), psqrt])])
+        postarray = tria(prearray)
+        ysqrt = postarray[:nY, :nY]
+        gain = postarray[nY:, :nY]  # Kalman gain times ysqrt
+        updatedSqrt = postarray[nY:, nY:]
+        innovation = numpy.atleast_1d(ymeas - C @ pmean)
+        updatedMean = pmean + gain @ scipy.linalg.solve_triangular(ysqrt, innovation, lower=True)
+        return updatedMean, updatedSqrt
+
     def smooth(self, kmeans, kcovars, us):
         """Returns the smoothed means and covariances
         Note, this is only for matrix entries!"""
@@ -85,6 +161,61 @@ class LLDS:
 
         return smoothedmeans, smoothedvars
 
+    def filter_batch(self, initmean, initvar, ys, us=None):
+        """Filter M independent runs at once.
+        ys => (M, nY, T) measurements
+        us => (M, T) or (T,) inputs where us[:, t-1] drives the state to time t as in step_filter
+        Returns the filtered means (M, nX, T) and the covariances (nX, nX, T). The covariances
+        do not depend on the measurements therefore they are shared by all the runs."""
+        M, nY, T = numpy.shape(ys)
+        nX = len(self.A)
+        C = numpy.atleast_2d(self.C)
+        R = numpy.atleast_2d(self.R)
+        if us is None:
+            us = numpy.zeros([M, T])
+        us = numpy.broadcast_to(us, (M, T))
+
+        means = numpy.zeros([M, nX, T])
+        covars = numpy.zeros([nX, nX, T])
+        pmeans = numpy.broadcast_to(initmean, (M, nX))
+        pvar = initvar
+        for t in range(T):
+            if t > 0:
+                pmeans = means[:, :, t-1] @ numpy.transpose(self.A) + numpy.outer(us[:, t-1], self.B)
+                pvar = self.Q + self.A @ covars[:, :, t-1] @ numpy.transpose(self.A)
+            if self.is_steady(pvar, self.ss_pvar):
+                kalmanGain = self.ss_gain
+                covars[:, :, t] = self.ss_var
+            else:
+                temp = C @ pvar @ numpy.transpose(C) + R
+                kalmanGain = numpy.linalg.solve(temp, C @ pvar).T
+                covars[:, :, t] = (numpy.eye(nX) - kalmanGain @ C) @ pvar
+            means[:, :, t] = pmeans + (ys[:, :, t] - pmeans @ numpy.transpose(C)) @ numpy.transpose(kalmanGain)
+
+        return means, covars
+
+    def smooth_batch(self, kmeans, kcovars, us=None):
+        """Returns the smoothed means (M, nX, T) and covariances (nX, nX, T) of M independent runs
+        given the output of filter_batch. us[:, t] drives the state from time t to t+1."""
+        M, nX, T = numpy.shape(kmeans)
+        if us is None:
+            us = numpy.zeros([M, T])
+        us = numpy.broadcast_to(us, (M, T))
+
+        smoothedmeans = numpy.zeros([M, nX, T])
+        smoothedvars = numpy.zeros([nX, nX, T])
+        smoothedmeans[:, :, -1] = kmeans[:, :, -1]
+        smoothedvars[:, :, -1] = kcovars[:, :, -1]
+
+        for t in range(T-2, -1, -1):
+            Pt = self.A @ kcovars[:, :, t] @ numpy.transpose(self.A) + self.Q
+            Jt = numpy.linalg.solve(Pt, self.A @ kcovars[:, :, t]).T  # Pt is symmetric
+            temp = smoothedmeans[:, :, t+1] - kmeans[:, :, t] @ numpy.transpose(self.A) - numpy.outer(us[:, t], self.B)
+            smoothedmeans[:, :, t] = kmeans[:, :, t] + temp @ numpy.transpose(Jt)
+            smoothedvars[:, :, t] = kcovars[:, :, t] + Jt @ (smoothedvars[:, :, t+1] - Pt) @ numpy.transpose(Jt)
+
+        return smoothedmeans, smoothedvars
+
     def predict_visible(self, kmean, kcovar, us):
         """Predict the visible states n steps into the future given the controller action.
         Note: us[t] predicts xs[t+1]"""
@@ -123,4 +254,11 @@ class LLDS:
         return predicted_means, predicted_covars
 
 
-
+def tria(prearray):
+    """Return the lower triangular L with L L' = prearray prearray' (using a QR decomposition)."""
+    rows, cols = prearray.shape
+    r = scipy.linalg.qr(numpy.transpose(prearray), mode="r")[0]
+    L = numpy.transpose(r[:rows, :])[:, :rows]
+    signs = numpy.sign(numpy.diag(L))
+    signs[signs == 0] = 1.0
+    return L*signs  # positive diagonal
@@ -1,6 +1,8 @@
 #  LQR Controller
-import numpy
 import collections
+import numpy
+import scipy.linalg
+import src.MPC as MPC
 
 
 class Controller:
@@ -10,35 +12,126 @@ class Controller:
         self.u_off = u_off
 
 
+class ControllerBank:
+    """LQR controllers (gains and offsets) for a bank of linear systems stored as stacked arrays.
+    The control action of switch k is u_off[k] - K[k] @ (x - b[k] - x_off[k]) and the bank
+    returns the weighted average over the switches in one call: either using the given
+    weights (e.g. the switch probabilities of the filter) or inverse distance weights of
+    the state to the operating points."""
+    def __init__(self, linsystems, QQ, RR, C, H, setpoint):
+        N = len(linsystems)
+        H = numpy.matrix(H)
+        nx = len(linsystems[0].op)
+        nu = numpy.matrix(linsystems[0].B).shape[0]
+        self.ops = numpy.zeros([N, nx])
+        self.b = numpy.zeros([N, nx])
+        self.K = numpy.zeros([N, nu, nx])
+        self.x_off = numpy.zeros([N, nx])
+        self.u_off = numpy.zeros([N, nu])
+        P = None
+        for k, linsystem in enumerate(linsystems):
+            ysp = numpy.matrix(setpoint - H @ linsystem.b)  # set point is set here
+            self.x_off[k], self.u_off[k] = offset(linsystem.A, linsystem.B, C, H, ysp)
+            P = dare(linsystem.A, numpy.matrix(linsystem.B), QQ, RR, P0=P)  # warm start from the last one
+            self.K[k] = gain(linsystem.A, linsystem.B, RR, P)
+            self.ops[k] = linsystem.op
+            self.b[k] = linsystem.b
+        # u_k = c[k] - K[k] @ x
+        self.c = self.u_off + numpy.einsum("kij,kj->ki", self.K, self.b + self.x_off)
+        self.scale = numpy.ptp(self.ops, axis=0)  # to measure distances between operating points
+        self.scale[self.scale == 0] = 1.0
+
+    def weights(self, x, power=2):
+        """Return the inverse distance weights of the state x to the operating points."""
+        dist = numpy.sum(((self.ops - x) / self.scale)**2, axis=1)**(0.5 * power)
+        if numpy.any(dist == 0):
+            return (dist == 0) / numpy.sum(dist == 0)
+        w = 1.0 / dist
+        return w / numpy.sum(w)
+
+    def control(self, x, w=None):
+        """Return the weighted control action at the state x (weights from the switch
+        probabilities w or the inverse distance to the operating points if w is None)."""
+        w = self.weights(x) if w is None else numpy.asarray(w) / numpy.sum(w)
+        return w @ self.c - numpy.einsum("k,kij,j->i", w, self.K, x)
+
+
 def lqr(A, B, Q, R):
     """Returns the infinite horizon LQR solution.
     Don't confuse the weighting matrices Q and R with
     the noise covariance matrices!"""
     P = dare(A, B, Q, R)
-    F = numpy.linalg.inv(R+B @ P @ B.T) @ B @ P @ A
-    return F
+    return gain(A, B, R, P)
 
 
-def dare(A, B, Q, R):
-    """Solves the discrete algebraic ricatti equation (dare)"""
-    nr, nc = A.shape
-    P = numpy.eye(nr)
-    counter = 0
-    while True:
-        counter += 1
-        if isinstance(B @ P @ B.T + R, collections.Iterable):
-            inverse = numpy.linalg.inv(B @ P @ B.T + R)
-        else:
-            inverse = numpy.matrix(1 / (B @ P @ B.T + R))
-        Pnow = Q + A.T @ P @ A - A.T @ P @ B.T @ inverse @ B @ P @ A
-        if numpy.linalg.norm(Pnow-P, ord=numpy.inf) < 1E-06:
-            P = Pnow
-            return P
-        else:
-            P = Pnow
+def gain(A, B, R, P):
+    """Returns the LQR gain of the dare solution P (B is inputs x states)."""
+    B = numpy.atleast_2d(numpy.asarray(B))
+    R = numpy.atleast_2d(R)
+    F = numpy.linalg.solve(R + B @ P @ B.T, B @ P @ A)
+    return F
+
 
-        if counter > 1000000:
-            raise ValueError("DARE did not converge...")
+solutions = collections.OrderedDict()  # dare solutions keyed by (A, B, Q, R), bounded by MPC.cache_size
+
+
+def dare(A, B, Q, R, P0=None, tol=1e-12, maxiter=100):
+    """Solves the discrete algebraic ricatti equation (dare)
+        P = Q + A.T @ P @ A - A.T @ P @ B.T @ inv(R + B @ P @ B.T) @ B @ P @ A
+    Note that B is (inputs x states). The solutions are cached. If P0 (e.g. the solution of a
+    nearby system) gives a stabilising gain it is refined with Newton-Kleinman iterations,
+    otherwise the structure-preserving doubling algorithm is used. Both converge quadratically."""
+    arrays = [numpy.atleast_2d(numpy.asarray(z, dtype=float)) for z in (A, B, Q, R)]
+    key = tuple((z.shape, z.tobytes()) for z in arrays)
+    P = MPC.lookup(solutions, key)
+    if P is not None:
+        return P.copy()
+    A, B, Q, R = arrays
+
+    P = None
+    if P0 is not None:
+        P = newton_kleinman(A, B, Q, R, numpy.asarray(P0), tol, maxiter)
+    if P is None:
+        P = doubling(A, B, Q, R, tol, maxiter)
+    MPC.remember(solutions, key, P)
+    return P.copy()
+
+
+def doubling(A, B, Q, R, tol=1e-12, maxiter=100):
+    """Structure-preserving doubling algorithm for the dare (B is inputs x states).
+    See "A structure-preserving doubling algorithm for discrete-time algebraic Riccati
+    equations" by Chu et al (2004)."""
+    nx = A.shape[0]
+    Ak = A
+    Gk = B.T @ numpy.linalg.solve(R, B)
+    Hk = Q
+    for i in range(maxiter):
+        W = numpy.eye(nx) + Gk @ Hk
+        V1 = numpy.linalg.solve(W, Ak)
+        V2 = numpy.linalg.solve(W, Gk)
+        Hnow = Hk + Ak.T @ Hk @ V1
+        Gk = Gk + Ak @ V2 @ Ak.T
+        Ak = Ak @ V1
+        if numpy.linalg.norm(Hnow - Hk, ord=numpy.inf) <= tol * max(1.0, numpy.linalg.norm(Hnow, ord=numpy.inf)):
+            return 0.5 * (Hnow + Hnow.T)
+        Hk = Hnow
+    raise ValueError("DARE did not converge...")
+
+
+def newton_kleinman(A, B, Q, R, P0, tol=1e-12, maxiter=100):
+    """Newton-Kleinman iterations for the dare started from the gain of P0 (B is inputs x states).
+    Returns None if the gain of P0 is not stabilising."""
+    P = P0
+    for i in range(maxiter):
+        K = numpy.linalg.solve(R + B @ P @ B.T, B @ P @ A)
+        Ac = A - B.T @ K
+        if max(abs(numpy.linalg.eigvals(Ac))) >= 1.0:
+            return None
+        Pnow = scipy.linalg.solve_discrete_lyapunov(Ac.T, Q + K.T @ R @ K)
+        if numpy.linalg.norm(Pnow - P, ord=numpy.inf) <= tol * max(1.0, numpy.linalg.norm(Pnow, ord=numpy.inf)):
+            return 0.5 * (Pnow + Pnow.T)
+        P = Pnow
+    return None
 
 
 def inv(x):
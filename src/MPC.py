@@ -1,198 +1,334 @@
 
+import collections
 import numpy
+import scipy.linalg
 import scipy.sparse
+import scipy.sparse.linalg
 import cvxpy
+import warnings
+
+solver = "MOSEK"  # default QP solver (any solver known to cvxpy)
+# Tried in order if the solver is not installed or fails (e.g. no licence). The interior point
+# solvers come first: the CSTR problems are badly scaled and the first order solvers (OSQP, SCS)
+# often stop at their iteration limit.
+fallbacks = ["MOSEK", "CLARABEL", "ECOS", "OSQP", "SCS"]
+installed = None  # cvxpy.installed_solvers() (looked up on first use)
+failed = set()  # solvers that cannot be used (not installed, no licence) are skipped from then on
+
+
+class Controller:
+    """MPC problem structure for a fixed linear model, horizon and set of weights.
+    The decision vector is [mu_0, ..., mu_N, u_0, ..., u_(N-1)] and the QP is
+        min 0.5 x.T @ P @ x + q.T @ x  s.t.  AA @ x == bb, L <= GG @ x <= U
+    P, AA and GG only depend on the model and are built once. The cvxpy problems are
+    also built once with q, bb, L and U as parameters so repeated calls skip the
+    canonicalisation and only re-solve (warm started).
+    Without a constraint line (aline = bline = None) only the unconstrained problem is useful."""
+    def __init__(self, N, A, B, QQ, RR, aline=None, bline=None):
+        B = B.T
+        nx, nu = B.shape
+        QQ = numpy.asarray(QQ)  # numpy.matrix weights do not mix with scipy.sparse.block_diag
+        RR = numpy.atleast_2d(numpy.asarray(RR))
+        QN = QQ
+        if aline is None:
+            d_T = numpy.matrix(numpy.zeros(nx))
+        else:
+            d_T = numpy.matrix(numpy.hstack([aline, bline]))
+        self.N = N
+        self.A = A
+        self.nx = nx
+        self.nu = nu
+        self.QQ = QQ
+        self.QN = QN
+        self.RR = RR
+        self.d_T = numpy.array(d_T)[0]
+
+        self.P = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N), QQ), QN,
+                                          scipy.sparse.kron(scipy.sparse.eye(N), RR)]).tocsc()
+
+        # Handling of mu_(k+1) = A @ mu_k + B @ u_k
+        temp1 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1), -numpy.eye(nx))])
+        temp2 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1, k=-1), A)])
+        AA = temp1 + temp2
+
+        temp1 = scipy.sparse.vstack([numpy.zeros([nx, N * nu]), scipy.sparse.kron(scipy.sparse.eye(N), B)])
+        self.AA = scipy.sparse.hstack([AA, temp1]).tocsc()
+
+        # Handling of d.T mu_k > k sqrt(d.T @ Sigma_k @ d) - e
+        temp1 = scipy.sparse.hstack([numpy.zeros([N, nx]), scipy.sparse.kron(scipy.sparse.eye(N), d_T)])
+        temp2 = numpy.zeros([N, N * nu])
+        temp3 = scipy.sparse.hstack([temp1, temp2])
+        GG = temp3
+
+        # Handling of -limstep <= u <= limstepu
+        temp1 = numpy.zeros([N - 1, (N + 1) * nx])
+        temp2 = numpy.zeros([N - 1, nu])
+        temp2[0][:nu] = 1
+        temp3 = scipy.sparse.kron(scipy.sparse.eye(N - 1), -numpy.eye(nu))
+        temp3 += scipy.sparse.kron(scipy.sparse.eye(N - 1, k=-1), numpy.eye(nu))
+        temp4 = scipy.sparse.hstack([temp1, temp2, temp3])
+        GG = scipy.sparse.vstack([GG, temp4])
+
+        # Handling of -limu <= u <= limu
+        temp1 = numpy.zeros([N, (N + 1) * nx])
+        temp2 = scipy.sparse.kron(scipy.sparse.eye(N), numpy.eye(nu))
+        temp3 = scipy.sparse.hstack([temp1, temp2])
+        self.GG = scipy.sparse.vstack([GG, temp3]).tocsc()
+
+        # Parametrised problems (the limits on the input rows are symmetric: L = -U)
+        n = self.P.shape[0]
+        self.x = cvxpy.Variable(n)
+        self.q = cvxpy.Parameter(n)
+        self.bb = cvxpy.Parameter(self.AA.shape[0])
+        self.limits = cvxpy.Parameter(N)
+        self.ulimits = cvxpy.Parameter(self.GG.shape[0] - N, nonneg=True)
+        objective = cvxpy.Minimize(0.5 * cvxpy.quad_form(self.x, cvxpy.psd_wrap(self.P)) + self.q @ self.x)
+        Gline = self.GG[:N]
+        Gu = self.GG[N:]
+        constraints = [Gline @ self.x >= self.limits, Gu @ self.x <= self.ulimits, Gu @ self.x >= -self.ulimits,
+                       self.AA @ self.x == self.bb]
+        self.prob = cvxpy.Problem(objective, constraints)
+        self.lqr_prob = cvxpy.Problem(objective, [self.AA @ self.x == self.bb])
+        self.gains = None  # closed form solution of the unconstrained problem (see lqr_gains)
+
+    def linear_term(self, ysp, usp):
+        """Return q for the given setpoints."""
+        N = self.N
+        return numpy.hstack([numpy.kron(numpy.ones(N), -self.QQ @ ysp), -self.QN @ ysp,
+                             numpy.kron(numpy.ones(N), -self.RR @ usp)])
+
+    def input_limits(self, lim_u, lim_step_u):
+        """Return the (symmetric) limits on the input rows of GG."""
+        N = self.N
+        return numpy.hstack([[lim_step_u] * (N - 1), [lim_u] * N])
+
+    def solve(self, ysp, usp, bb, limits, lim_u, lim_step_u, solver=None):
+        """Solve the constrained QP and return the first control move (None if it fails)."""
+        self.q.value = numpy.ravel(self.linear_term(ysp, usp))
+        self.bb.value = bb
+        self.limits.value = limits
+        self.ulimits.value = self.input_limits(lim_u, lim_step_u)
+        prob = self.prob
+        status = self.run(prob, solver)
+        if status != "optimal":
+            print(status)
+            print(prob.is_qp())
+            return None
+        return self.first_move()
+
+    def run(self, prob, solver=None):
+        """Solve prob with the first solver that works and return the status.
+        Solvers that support it are warm started from the previous solution. If a solver
+        stops early (e.g. at its iteration limit) or fails on this problem the next one is
+        tried. Only solvers that cannot be used at all are skipped on later calls."""
+        status = "no solver"
+        for name in get_solvers(solver):
+            try:
+                prob.solve(solver=name, warm_start=True)
+            except Exception as err:
+                warnings.warn("MPC solver {} failed ({}), trying the next one...".format(name, err))
+                if unavailable(err):
+                    failed.add(name)
+                continue
+            status = prob.status
+            if status in (cvxpy.OPTIMAL, cvxpy.INFEASIBLE, cvxpy.UNBOUNDED):
+                break
+        return status
+
+    def first_move(self):
+        """Return u_0 from the current solution."""
+        n = self.P.shape[0]
+        res = numpy.array(self.x.value).reshape((n,))
+        start = (self.N + 1) * self.nx
+        return res[start: start + self.nu]
+
+    def mean(self, x0, b, cline, ysp, usp, lim_u, lim_step_u, d=numpy.zeros(2), solver=None):
+        """Return the control input with the line constraint on the mean only."""
+        e = int(cline + self.d_T @ b)
+        limits = [-e] * self.N
+
+        bb = numpy.hstack([-x0, numpy.tile(-d, self.N)])
+        return self.solve(ysp, usp, bb, limits, lim_u, lim_step_u, solver)
+
+    def var(self, x0, cov0, b, cline, ysp, usp, lim_u, lim_step_u, Q, k, growvar=True, solver=None):
+        """Return the control input with the line constraint tightened by the predicted variance."""
+        A = self.A
+        e = cline + self.d_T @ b
 
-
-def mpc_mean(x0, N, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, d=numpy.zeros(2)):
+        if growvar:
+            G, v = variance_terms(A, Q, self.d_T, self.N)
+            rsquared = numpy.einsum("ki,ij,kj->k", G, cov0, G) + v
+        else:
+            sigmas = Q + A @ cov0 @ A.T
+            rsquared = numpy.full(self.N, self.d_T @ sigmas @ self.d_T)
+        limits = - e + numpy.sqrt(k * rsquared)
+
+        bb = numpy.hstack([-x0, numpy.zeros(self.N * self.nx)])
+        return self.solve(ysp, usp, bb, limits, lim_u, lim_step_u, solver)
+
+    def lqr_gains(self):
+        """Return Kx, Ky and Ku such that the first move of the unconstrained problem is
+        u_0 = Kx @ x0 + Ky @ ysp + Ku @ usp.
+        The solution only depends linearly on (x0, ysp, usp) through the right hand side of the
+        KKT system [[P, AA.T], [AA, 0]] [x, lambda] = [-q, bb], so the KKT matrix is factorised
+        once and solved for a unit right hand side per entry of x0, ysp and usp."""
+        if self.gains is None:
+            N, nx, nu = self.N, self.nx, self.nu
+            n = self.P.shape[0]
+            KKT = scipy.sparse.bmat([[self.P, self.AA.T], [self.AA, None]], format="csc")
+            solve = scipy.sparse.linalg.factorized(KKT)
+            rhs = numpy.zeros([KKT.shape[0], 2 * nx + nu])
+            rhs[n: n + nx, :nx] = -numpy.eye(nx)  # bb = [-x0, 0]
+            for i in range(nx):
+                ei = numpy.zeros(nx)
+                ei[i] = 1.0
+                rhs[:n, nx + i] = -self.linear_term(ei, numpy.zeros(nu))
+            for i in range(nu):
+                ei = numpy.zeros(nu)
+                ei[i] = 1.0
+                rhs[:n, 2 * nx + i] = -numpy.ravel(self.linear_term(numpy.zeros(nx), ei))
+            start = (N + 1) * nx
+            K = numpy.column_stack([solve(rhs[:, i]) for i in range(rhs.shape[1])])[start: start + nu]
+            self.gains = K[:, :nx], K[:, nx: 2 * nx], K[:, 2 * nx:]
+        return self.gains
+
+    def lqr(self, x0, ysp, usp):
+        """Return the control input of the unconstrained problem (using the precomputed gains)."""
+        Kx, Ky, Ku = self.lqr_gains()
+        return Kx @ x0 + Ky @ numpy.ravel(ysp) + Ku @ numpy.ravel(usp)
+
+    def lqr_qp(self, x0, ysp, usp, solver=None):
+        """Return the control input of the unconstrained problem by solving the QP."""
+        self.q.value = numpy.ravel(self.linear_term(ysp, usp))
+        self.bb.value = numpy.hstack([-x0, numpy.zeros(self.N * self.nx)])
+        prob = self.lqr_prob
+        status = self.run(prob, solver)
+        if not status.startswith("optimal"):
+            print(status)
+            print(prob.is_qp())
+            return None
+        return self.first_move()
+
+
+def set_solver(name):
+    """Set the default QP solver used by all the controllers."""
+    global solver
+    solver = name
+
+
+def get_solvers(name=None):
+    """Return the solvers to try in order: name (or the default solver) and then the
+    installed fallbacks. Solvers that could not be used before are skipped, except an
+    explicitly requested one which is always tried first."""
+    global installed
+    if installed is None:
+        installed = cvxpy.installed_solvers()
+    solvers = []
+    if name is not None:
+        if name in installed:
+            solvers.append(name)
+        else:
+            warnings.warn("MPC solver {} is not installed, using the fallbacks...".format(name))
+    for s in [solver] + fallbacks:
+        if s in installed and s not in failed and s not in solvers:
+            solvers.append(s)
+    return solvers
+
+
+def unavailable(err):
+    """Return True if the solver error means the solver cannot be used at all (it is not
+    installed or has no licence) rather than a numerical failure on one problem."""
+    if isinstance(err, ImportError):
+        return True
+    message = str(err).lower()
+    return "not installed" in message or "licen" in message
+
+
+cache_size = 32  # entries kept per cache, the least recently used ones are dropped first
+controllers = collections.OrderedDict()  # problem structures keyed by (N, A, B, QQ, RR, aline, bline)
+variances = collections.OrderedDict()  # variance_terms keyed by (A, Q, d, N)
+
+
+def lookup(cache, key):
+    """Return the entry of key in cache (None if it is missing) and mark it as recently used."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def remember(cache, key, value):
+    """Add the entry to cache and drop the least recently used entries beyond cache_size."""
+    cache[key] = value
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+    return value
+
+
+def variance_terms(A, Q, d, N, tol=1e-10):
+    """Return G and v such that the variance of d.T @ mu_k along the horizon is
+        d.T @ Sigma_k @ d = G[k] @ cov0 @ G[k] + v[k]  (k = 0, ..., N-1)
+    for Sigma_0 = Q + A @ cov0 @ A.T and Sigma_(k+1) = Q + A @ Sigma_k @ A.T. That is
+    G[k] = (A.T)^(k+1) @ d and v[k] = sum_(j<=k) d.T @ A^j @ Q @ (A.T)^j @ d. Only cov0 changes
+    between the calls so the terms are cached. If A is stable the tail is filled in with the
+    steady state variance (from the discrete Lyapunov equation) once G has decayed."""
+    arrays = [numpy.asarray(z, dtype=float) for z in (A, Q, d)]
+    key = (N,) + tuple((z.shape, z.tobytes()) for z in arrays)
+    terms = lookup(variances, key)
+    if terms is not None:
+        return terms
+    A, Q, d = arrays
+    nx = len(d)
+    G = numpy.zeros([N, nx])
+    v = numpy.zeros(N)
+    stable = max(abs(numpy.linalg.eigvals(A))) < 1.0
+    if stable:
+        vinf = d @ scipy.linalg.solve_discrete_lyapunov(A, Q) @ d
+    g = d
+    total = 0.0
+    for i in range(N):
+        total += g @ Q @ g
+        g = A.T @ g
+        if stable and max(abs(g)) < tol * max(abs(d)):
+            v[i:] = vinf  # the rest of the terms are negligible
+            break
+        G[i] = g
+        v[i] = total
+    return remember(variances, key, (G, v))
+
+
+def get_controller(N, A, B, QQ, RR, aline=None, bline=None):
+    """Return the cached Controller for the model, horizon and weights (built on first use).
+    Sweeps over many models keep at most cache_size controllers alive."""
+    arrays = [numpy.asarray(z, dtype=float) for z in (A, B, QQ, RR, aline, bline) if z is not None]
+    key = (N,) + tuple((z.shape, z.tobytes()) for z in arrays)
+    controller = lookup(controllers, key)
+    if controller is None:
+        controller = remember(controllers, key, Controller(N, A, B, QQ, RR, aline, bline))
+    return controller
+
+
+def mpc_mean(x0, N, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, d=numpy.zeros(2),
+             solver=None):
     """return the MPC control input using a linear system"""
-    B = B.T
-    nx, nu = B.shape
-    QN = QQ
-    d_T = numpy.matrix(numpy.hstack([aline, bline]))
-
-    P = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N), QQ), QN,
-                                 scipy.sparse.kron(scipy.sparse.eye(N), RR)])
-
-    q = numpy.hstack([numpy.kron(numpy.ones(N), -QQ @ ysp), -QN @ ysp,
-                      numpy.kron(numpy.ones(N), -RR @ usp)])
-
-    # Handling of mu_(k+1) = A @ mu_k + B @ u_k
-    temp1 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1), -numpy.eye(nx))])
-    temp2 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1, k=-1), A)])
-    AA = temp1 + temp2
-
-    temp1 = scipy.sparse.vstack([numpy.zeros([nx, N * nu]), scipy.sparse.kron(scipy.sparse.eye(N), B)])
-    AA = scipy.sparse.hstack([AA, temp1])
-
-    # Handling of d.T mu_k > k sqrt(d.T @ Sigma_k @ d) - e
-    temp1 = scipy.sparse.hstack([numpy.zeros([N, nx]), scipy.sparse.kron(scipy.sparse.eye(N), d_T)])
-    temp2 = numpy.zeros([N, N * nu])
-    temp3 = scipy.sparse.hstack([temp1, temp2])
-    GG = temp3
-
-    # Handling of -limstep <= u <= limstepu
-    temp1 = numpy.zeros([N - 1, (N + 1) * nx])
-    temp2 = numpy.zeros([N - 1, nu])
-    temp2[0][:nu] = 1
-    temp3 = scipy.sparse.kron(scipy.sparse.eye(N - 1), -numpy.eye(nu))
-    temp3 += scipy.sparse.kron(scipy.sparse.eye(N - 1, k=-1), numpy.eye(nu))
-    temp4 = scipy.sparse.hstack([temp1, temp2, temp3])
-    GG = scipy.sparse.vstack([GG, temp4])
-
-    # Handling of -limu <= u <= limu
-    temp1 = numpy.zeros([N, (N + 1) * nx])
-    temp2 = scipy.sparse.kron(scipy.sparse.eye(N), numpy.eye(nu))
-    temp3 = scipy.sparse.hstack([temp1, temp2])
-    GG = scipy.sparse.vstack([GG, temp3])
-
-    e = int(cline + d_T @ b)
-    limits = [-e] * N
-
-    bb = numpy.hstack([-x0, numpy.tile(-d, N)])
-    L = numpy.hstack([limits, [-lim_step_u] * (N - 1), [-lim_u] * N])
-    U = numpy.hstack([[numpy.inf] * N, [lim_step_u] * (N - 1), [lim_u] * N])
-
-    n = q.shape[0]
-    x = cvxpy.Variable(n)
-    P = cvxpy.Constant(P)
-    objective = cvxpy.Minimize(0.5 * cvxpy.quad_form(x, P) + q * x)
-    constraints = [GG * x <= U, GG * x >= L, AA * x == bb]
-
-    prob = cvxpy.Problem(objective, constraints)
-    try:
-        prob.solve(solver='MOSEK')
-    except:
-        return None
-    if prob.status != "optimal":
-        print(prob.status)
-        print(prob.is_qp())
-        return None
-    res = numpy.array(x.value).reshape((n,))
-
-    # check_constraints(GG, L, U, res, b)
-    return res[(N + 1) * nx: (N + 1) * nx + nu]
+    controller = get_controller(N, A, B, QQ, RR, aline, bline)
+    return controller.mean(x0, b, cline, ysp, usp, lim_u, lim_step_u, d, solver)
 
 
 def mpc_var(x0, cov0, N, A, B, b, aline, bline, cline, QQ, RR,
-            ysp, usp, lim_u, lim_step_u, Q, k, growvar=True):
+            ysp, usp, lim_u, lim_step_u, Q, k, growvar=True, solver=None):
     """return the MPC control input using a linear system"""
+    controller = get_controller(N, A, B, QQ, RR, aline, bline)
+    return controller.var(x0, cov0, b, cline, ysp, usp, lim_u, lim_step_u, Q, k, growvar, solver)
 
-    B = B.T
-    nx, nu = B.shape
-    QN = QQ
-    d_T = numpy.matrix(numpy.hstack([aline, bline]))
-
-    P = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N), QQ), QN,
-                                 scipy.sparse.kron(scipy.sparse.eye(N), RR)])
-
-    q = numpy.hstack([numpy.kron(numpy.ones(N), -QQ @ ysp), -QN @ ysp,
-                      numpy.kron(numpy.ones(N), -RR @ usp)])
-
-    # Handling of mu_(k+1) = A @ mu_k + B @ u_k
-    temp1 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N+1), -numpy.eye(nx))])
-    temp2 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N+1, k=-1), A)])
-    AA = temp1 + temp2
-
-    temp1 = scipy.sparse.vstack([numpy.zeros([nx, N*nu]), scipy.sparse.kron(scipy.sparse.eye(N), B)])
-    AA = scipy.sparse.hstack([AA, temp1])
-
-    # Handling of d.T mu_k > k sqrt(d.T @ Sigma_k @ d) - e
-    temp1 = scipy.sparse.hstack([numpy.zeros([N, nx]), scipy.sparse.kron(scipy.sparse.eye(N), d_T)])
-    temp2 = numpy.zeros([N, N*nu])
-    temp3 = scipy.sparse.hstack([temp1, temp2])
-    GG = temp3
-
-    # Handling of -limstep <= u <= limstepu
-    temp1 = numpy.zeros([N-1, (N + 1) * nx])
-    temp2 = numpy.zeros([N-1, nu])
-    temp2[0][:nu] = 1
-    temp3 = scipy.sparse.kron(scipy.sparse.eye(N-1), -numpy.eye(nu))
-    temp3 += scipy.sparse.kron(scipy.sparse.eye(N-1, k=-1), numpy.eye(nu))
-    temp4 = scipy.sparse.hstack([temp1, temp2, temp3])
-    GG = scipy.sparse.vstack([GG, temp4])
-
-    # Handling of -limu <= u <= limu
-    temp1 = numpy.zeros([N, (N+1)*nx])
-    temp2 = scipy.sparse.kron(scipy.sparse.eye(N), numpy.eye(nu))
-    temp3 = scipy.sparse.hstack([temp1, temp2])
-    GG = scipy.sparse.vstack([GG, temp3])
-
-    e = cline + d_T @ b
-
-    sigmas = Q + A @ cov0 @ A.T
-    limits = numpy.zeros(N)
-    for i in range(N):
-        rsquared = d_T @ sigmas @ d_T.T
-        r = - e + numpy.sqrt(k * rsquared)
-        if growvar:
-            sigmas = Q + A @ sigmas @ A.T
-        limits[i] = r
-
-    bb = numpy.hstack([-x0, numpy.zeros(N * nx)])
-    L = numpy.hstack([limits, [-lim_step_u] * (N - 1), [-lim_u] * N])
-    U = numpy.hstack([[numpy.inf] * N, [lim_step_u] * (N - 1), [lim_u] * N])
-
-    n = q.shape[0]
-    x = cvxpy.Variable(n)
-    P = cvxpy.Constant(P)
-    objective = cvxpy.Minimize(0.5 * cvxpy.quad_form(x, P) + q * x)
-    constraints = [GG * x <= U, GG * x >= L, AA * x == bb]
-
-    prob = cvxpy.Problem(objective, constraints)
-
-    try:
-        prob.solve(solver='MOSEK')
-    except:
-        return None
-    if prob.status != "optimal":
-        print(prob.status)
-        print(prob.is_qp())
-        return None
-    res = numpy.array(x.value).reshape((n,))
-
-    # check_constraints(GG, L, U, res, b)
-    return res[(N+1)*nx: (N+1)*nx+nu]
-
-
-def mpc_lqr(x0, N, A, B, QQ, RR, ysp, usp):
-    """return the MPC control input using a linear system"""
-
-    B = B.T
-    nx, nu = B.shape
-    QN = QQ
-
-    P = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N), QQ), QN,
-                                 scipy.sparse.kron(scipy.sparse.eye(N), RR)])
-
-    q = numpy.hstack([numpy.kron(numpy.ones(N), -QQ @ ysp), -QN @ ysp,
-                      numpy.kron(numpy.ones(N), -RR @ usp)])
-
-    # Handling of mu_(k+1) = A @ mu_k + B @ u_k
-    temp1 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1), -numpy.eye(nx))])
-    temp2 = scipy.sparse.block_diag([scipy.sparse.kron(scipy.sparse.eye(N + 1, k=-1), A)])
-    AA = temp1 + temp2
-
-    temp1 = scipy.sparse.vstack([numpy.zeros([nx, N * nu]), scipy.sparse.kron(scipy.sparse.eye(N), B)])
-    AA = scipy.sparse.hstack([AA, temp1])
-
-    bb = numpy.hstack([-x0, numpy.zeros(N * nx)])
-
-    n = max(q.shape)
-    x = cvxpy.Variable(n)
-    P = cvxpy.Constant(P)
-    objective = cvxpy.Minimize(0.5 * cvxpy.quad_form(x, P) + q * x)
-    constraints = [AA * x == bb]
-
-    prob = cvxpy.Problem(objective, constraints)
-    prob.solve(solver='MOSEK')
-    if not prob.status.startswith("optimal"):
-        print(prob.status)
-        print(prob.is_qp())
-        return None
-    res = numpy.array(x.value).reshape((n,))
 
-    return res[(N + 1) * nx: (N + 1) * nx + nu]
+def mpc_lqr(x0, N, A, B, QQ, RR, ysp, usp, solver=None):
+    """return the MPC control input using a linear system.
+    The unconstrained problem is solved in closed form unless a QP solver is specified."""
+    controller = get_controller(N, A, B, QQ, RR)
+    if solver is None:
+        return controller.lqr(x0, ysp, usp)
+    return controller.lqr_qp(x0, ysp, usp, solver)
 
 
 def check_constraints(GG, L, U, x):
@@ -0,0 +1,137 @@
+# Monte Carlo runner: independent closed-loop runs spread over a process pool.
+# Iteration i draws its random numbers from its own stream, seeded by the i'th child of
+# a SeedSequence, so the results do not depend on the number of processes or on the
+# order in which the runs finish. A failed run is retried (a bounded number of times)
+# with a child of its own seed sequence. The results are passed to collect as they come
+# in so nothing but the aggregates has to be kept.
+import concurrent.futures
+import numpy
+import os
+import pathlib
+import random
+import src.Results as Results
+import src.RNG as RNG
+import src.Store as Store
+import warnings
+
+
+class Aggregate:
+    """Streamed aggregation of the closed-loop runs (see collect). Run k fills column k:
+    dists => (2, mcN) constraint violation area and time (Results.get_mc_res)
+    xconcen => (N, mcN) concentration trajectories
+    errs => (mcN,) average concentration error (Results.calc_error1)
+    If a Store is given the whole run is written to it as well."""
+    def __init__(self, mcN, N, line, h, store=None):
+        self.line = line
+        self.h = h
+        self.dists = numpy.zeros([2, mcN])
+        self.xconcen = numpy.zeros([N, mcN])
+        self.errs = numpy.zeros(mcN)
+        self.done = numpy.zeros(mcN, dtype=bool)
+        self.store = store
+
+    def collect(self, k, result):
+        """Add run k where result is the dict of the arrays of the run. It must contain the
+        plant states xs, the filter covariances covars and the setpoint."""
+        xs = result["xs"]
+        self.errs[k] = Results.calc_error1(xs, result["setpoint"])
+        Results.get_mc_res(xs, result["covars"], self.line, self.dists, k, self.h)
+        self.xconcen[:, k] = xs[0, :]
+        self.done[k] = True
+        if self.store is not None:
+            self.store.write(k, dists=self.dists[:, k], err=self.errs[k], **result)
+
+    def average_error(self):
+        """Return the average absolute concentration error of the completed runs."""
+        return numpy.mean(abs(self.errs[self.done]))
+
+    def violations(self):
+        """Return the columns of dists of the completed runs that violated the constraint."""
+        return self.dists[:, self.done & (self.dists[0] != 0.0)]
+
+
+def fields(N, nX=2, nY=2, nS=2):
+    """Return the Store layout of the closed-loop runs written by Aggregate: plant states,
+    measurements, inputs, filter means and covariances, switch tracks (nS = 0 => none)
+    and the summaries."""
+    layout = {"xs": [nX, N], "ys": [nY, N], "us": [N], "means": [nX, N], "covars": [nX, nX, N],
+              "switches": [nS, N], "setpoint": [], "dists": [2], "err": []}
+    if nS == 0:
+        del layout["switches"]
+    return layout
+
+
+def load_violations(name):
+    """Return the (2, n) constraint violation area and time of the runs in the store name that
+    violated the constraint. Falls back to the CSV dump name.csv of the older scripts."""
+    if pathlib.Path(name).is_dir():
+        dists = Store.load(name).completed("dists").T
+        return dists[:, dists[0] != 0.0]
+    return numpy.loadtxt(name + ".csv", delimiter=",", ndmin=2)
+
+
+def load_concentrations(name):
+    """Return the (N, n) concentrations of the completed runs in the store name (only the
+    concentrations are read from disk). Falls back to the CSV dump name_mc2.csv."""
+    if pathlib.Path(name).is_dir():
+        store = Store.load(name)
+        return store["xs"][numpy.flatnonzero(store.done), 0, :].T
+    return numpy.loadtxt(name + "_mc2.csv", delimiter=",", ndmin=2)
+
+
+def run(fun, mcN, collect, seed=None, processes=None, retries=5):
+    """Run fun(rng) mcN times and pass each result to collect(k, result) (in the calling
+    process) as soon as run k finishes. fun must be picklable (defined at module level)
+    and return None (or raise) if the run failed; it is then retried with a new stream
+    at most retries times. rng is an RNG.RNG, and the legacy numpy.random and random
+    module states are seeded from the same stream. processes=1 runs
+    everything in the calling process. Returns the boolean array of completed runs."""
+    root = numpy.random.SeedSequence(seed)
+    seeds = root.spawn(mcN)
+    attempts = numpy.zeros(mcN, dtype=int)
+    done = numpy.zeros(mcN, dtype=bool)
+
+    if processes == 1:
+        for k in range(mcN):
+            seq = seeds[k]
+            while True:
+                result = attempt(fun, seq)
+                if result is not None:
+                    collect(k, result)
+                    done[k] = True
+                    break
+                if attempts[k] == retries:
+                    warnings.warn("Monte Carlo run {0} failed {1} times".format(k, retries + 1))
+                    break
+                attempts[k] += 1
+                seq = seq.spawn(1)[0]
+        return done
+
+    with concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count()) as pool:
+        pending = {pool.submit(attempt, fun, seeds[k]): (k, seeds[k]) for k in range(mcN)}
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                k, seq = pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    collect(k, result)
+                    done[k] = True
+                elif attempts[k] < retries:
+                    attempts[k] += 1
+                    seq = seq.spawn(1)[0]
+                    pending[pool.submit(attempt, fun, seq)] = (k, seq)
+                else:
+                    warnings.warn("Monte Carlo run {0} failed {1} times".format(k, retries + 1))
+    return done
+
+
+def attempt(fun, seq):
+    """Return fun(rng) with all the random streams seeded from seq (None if it raised)."""
+    numpy.random.seed(seq.generate_state(4))  # forked workers would otherwise share the parent state
+    random.seed(int(seq.generate_state(1, numpy.uint64)[0]))
+    try:
+        return fun(RNG.RNG(seq))
+    except Exception as e:
+        warnings.warn("Monte Carlo run failed: {0!r}".format(e))
+        return None
@@ -0,0 +1,95 @@
+# Gaussian noise drawn in blocks. A frozen scipy distribution validates its arguments
+# on every rvs() call, which dominates the cost of drawing one noise vector per time step
+# (or per particle). Gaussian draws a large block of standard normals once, scales it
+# with the Cholesky factor of the covariance and then hands out consecutive rows.
+# The same factor (and its log determinant) is kept for the log density so Gaussian
+# also replaces the scipy distributions the filters weight their particles with.
+import numpy
+import src.RNG as RNG
+
+
+class Gaussian:
+    def __init__(self, cov, mean=None, rng=None, block=1000):
+        """cov => covariance matrix (or variance)
+        mean => mean vector (None => zero mean)
+        rng => stream the blocks are drawn from (see the RNG module)
+        block => number of samples drawn at a time"""
+        self.cov = numpy.atleast_2d(numpy.asarray(cov, dtype=float))
+        self.dim = len(self.cov)
+        self.mean = numpy.zeros(self.dim) if mean is None else numpy.asarray(mean, dtype=float)
+        self.rng = rng
+        self.block = block
+        try:
+            self.L = numpy.linalg.cholesky(self.cov)
+            self.Linv = numpy.linalg.inv(self.L)
+            self.logdet = 2.0*numpy.sum(numpy.log(numpy.diag(self.L)))
+        except numpy.linalg.LinAlgError:  # semi-definite covariance (no density)
+            vals, vecs = numpy.linalg.eigh(self.cov)
+            self.L = vecs * numpy.sqrt(numpy.maximum(vals, 0.0))
+            self.Linv = None
+            self.logdet = None
+        self.buffer = numpy.zeros([0, self.dim])
+        self.pos = 0
+
+    def sample(self, n, rng=None):
+        """Return n fresh samples (n, dim) drawn from rng."""
+        return self.mean + RNG.get(rng).standard_normal((n, self.dim)) @ self.L.T
+
+    def draw(self, n):
+        """Return the next n samples (n, dim) of the stream. The result is a view of the
+        block so it must not be written to."""
+        if self.pos + n > len(self.buffer):
+            self.buffer = self.sample(max(self.block, n), self.rng)
+            self.pos = 0
+        rows = self.buffer[self.pos: self.pos + n]
+        self.pos += n
+        return rows
+
+    def rvs(self, size=None, random_state=None):
+        """Same as the rvs of scipy.stats.multivariate_normal (the output is squeezed).
+        Samples come from the pre-drawn blocks unless another random_state is given."""
+        n = 1 if size is None else int(numpy.prod(size))
+        if random_state is None or random_state is self.rng:
+            x = self.draw(n)
+        else:
+            x = self.sample(n, random_state)
+        if size is not None:
+            x = numpy.reshape(x, numpy.append(size, self.dim))
+        x = numpy.squeeze(x)
+        if x.ndim == 0:
+            return float(x)
+        return x
+
+    def logpdf(self, x):
+        """Same as the logpdf of scipy.stats.multivariate_normal: x is a single point or
+        a batch with one point per row (the last axis)."""
+        x = numpy.asarray(x, dtype=float)
+        if self.dim == 1 and (x.ndim == 0 or x.shape[-1] != 1):
+            x = x[..., None]
+        z = (x - self.mean) @ self.Linv.T
+        logp = -0.5*numpy.sum(z**2, axis=-1) - 0.5*self.logdet - 0.5*self.dim*numpy.log(2*numpy.pi)
+        if logp.ndim == 0:
+            return float(logp)
+        return logp
+
+    def pdf(self, x):
+        return numpy.exp(self.logpdf(x))
+
+
+class Stacked:
+    """Zero mean Gaussian densities with stacked (n, dim, dim) covariances, e.g. the predicted
+    measurement covariances of the RBPF particles. All the covariances are factorised together."""
+    def __init__(self, covs):
+        self.L = numpy.linalg.cholesky(covs)
+        self.Linv = numpy.linalg.inv(self.L)
+        self.logdet = 2.0*numpy.sum(numpy.log(numpy.diagonal(self.L, axis1=1, axis2=2)), axis=1)
+        self.dim = covs.shape[-1]
+
+    def logpdf(self, x, index=None):
+        """Return the log density of the rows of x (n, dim) where row k uses covariance
+        index[k] (k if index is None)."""
+        Linv, logdet = self.Linv, self.logdet
+        if index is not None:
+            Linv, logdet = Linv[index], logdet[index]
+        z = Linv @ x[:, :, None]
+        return -0.5*numpy.sum(z[:, :, 0]**2, axis=1) - 0.5*logdet - 0.5*self.dim*numpy.log(2*numpy.pi)
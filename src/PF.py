@@ -2,15 +2,15 @@
 # non-Gaussian Bayesian state estimation" by Gorden et al (1993).
 
 import numpy
-import warnings
-import math
-import copy
+import src.Weights as Weights
+import src.Resampling as Resampling
 
 
 class Model:
-    def __init__(self, f, g):
+    def __init__(self, f, g, batch=False):
         self.f = f  # state transition model
         self.g = g  # state observation model
+        self.batch = batch  # f and g accept (nX, nP) particle and noise matrices
 
 
 class Particles:
@@ -18,69 +18,63 @@ class Particles:
     def __init__(self, x, w):
         self.x = x  # collection of particles
         self.w = w  # collection of particle weights
+        with numpy.errstate(divide="ignore"):
+            self.logw = numpy.log(w)  # collection of particle log weights
 
 
-def init_pf(dist, nP, xN):
+def init_pf(dist, nP, xN, rng=None):
     """Initialise the particle filter.
-    dist => a distribution from the package scipy.stats
+    dist => prior distribution (Noise.Gaussian or one from the package scipy.stats)
     nX => number of states per particle.
+    rng => RNG.RNG stream (None => the global numpy.random state)
     Return an array of nP particles."""
 
     particles = Particles(numpy.zeros([xN, nP]), numpy.zeros(nP))
     for p in range(nP):
-        draw_x = dist.rvs()  # draw from the proposed prior
+        draw_x = dist.rvs(random_state=rng)  # draw from the proposed prior
         particles.x[:, p] = draw_x
         particles.w[p] = 1/nP  # uniform initial weight
+    particles.logw = Weights.log_uniform(nP)
 
     return particles
 
 
-def init_filter(particles, y, measure_dist, model):
+def init_filter(particles, y, measure_dist, model, resampler=None, rng=None):
     """Performs only the update step."""
     nX, N = particles.x.shape
 
-    for p in range(N):
-        particles.w[p] *= measure_dist.pdf(y - model.g(particles.x[:, p]))  # weight of each particle
-
-    if abs(max(particles.w)) < 1e-8:
-        warnings.warn("The particles all have very small weight...")
+    if model.batch:
+        particles.logw += measure_dist.logpdf(residuals(y, model.g(particles.x)))
+    else:
+        for p in range(N):
+            particles.logw[p] += measure_dist.logpdf(y - model.g(particles.x[:, p]))  # weight of each particle
 
-    particles.w = particles.w / sum(particles.w)
-    for w in particles.w:
-        if math.isnan(w):
-            raise ValueError("Particles have become degenerate!")
+    particles.logw, particles.w = Weights.normalise(particles.logw)
 
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
     return particles
 
 
-def roughen(particles):
+def roughen(particles, resampler=None, rng=None):
     """Roughening the samples to promote diversity"""
-    xN, N = particles.x.shape
-    sig = numpy.zeros(xN)
-
-    K = 0.2  # parameter...
-
-    for k in range(xN):
-        sig[k] = K*(max(particles.x[k, :]) - min(particles.x[k, :]))*N**(-1/xN)
-
-    sigma = numpy.diag(sig**2)
-    for p in range(N):
-        jitter = numpy.random.multivariate_normal(numpy.zeros([len(sigma)]), sigma)
-        particles.x[:, p] = particles.x[:, p] + jitter
+    if resampler is None:
+        resampler = Resampling.default
+    resampler.roughen(particles.x, rng)
     return particles
 
 
-def resample(particles):
+def resample(particles, resampler=None, rng=None):
+    """Resample the particles using the scheme of resampler (see the Resampling module)."""
+    if resampler is None:
+        resampler = Resampling.default
     N = len(particles.w)
-    rs = numpy.random.choice(range(N), size=N, p=particles.w)  # draw N samples from weighted Categorical
-    copy_particles = copy.copy(particles.x)
-    for p in range(N):  # resample
-        particles.x[:, p] = copy_particles[:, rs[p]]
-        particles.w[p] = 1/N
+    rs = resampler.indices(particles.w, rng)
+    resampler.gather(particles.x, rs)
+    particles.w = numpy.full(N, 1/N)
+    particles.logw = Weights.log_uniform(N)
 
-    particles = roughen(particles)
+    particles = roughen(particles, resampler, rng)
     return particles
 
 
@@ -94,28 +88,29 @@ def number_effective_particles(particles):
     return 1/num_eff
 
 
-def pf_filter(particles, u, y, plantdist, measuredist, model):
+def pf_filter(particles, u, y, plantdist, measuredist, model, resampler=None, rng=None):
     """Performs the state prediction step.
     plantnoise => distribution from whence the noise cometh
-    measuredist => distribution from whence the plant uncertainty cometh"""
+    measuredist => distribution from whence the plant uncertainty cometh
+    resampler => Resampling.Resampler used when the particles degenerate
+    rng => stream of the noise and resampling draws (see the RNG module)"""
 
     nX, N = particles.x.shape
 
-    for p in range(N):
-        noise = plantdist.rvs()
-        particles.x[:, p] = model.f(particles.x[:, p], u, noise)  # predict
-        particles.w[p] *= measuredist.pdf(y - model.g(particles.x[:, p]))  # weight of each particle
-
-    if abs(max(particles.w)) < 1e-8:
-        warnings.warn("The particles all have very small weight...")
+    if model.batch:
+        noise = draw_noise(plantdist, nX, N, rng)
+        particles.x[:, :] = model.f(particles.x, u, noise)  # predict
+        particles.logw += measuredist.logpdf(residuals(y, model.g(particles.x)))  # weight of each particle
+    else:
+        for p in range(N):
+            noise = plantdist.rvs(random_state=rng)
+            particles.x[:, p] = model.f(particles.x[:, p], u, noise)  # predict
+            particles.logw[p] += measuredist.logpdf(y - model.g(particles.x[:, p]))  # weight of each particle
 
-    particles.w = particles.w / sum(particles.w)
-    for w in particles.w:
-        if math.isnan(w):
-            raise ValueError("Particles have become degenerate!")
+    particles.logw, particles.w = Weights.normalise(particles.logw)
 
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
     return particles
 
 
@@ -126,11 +121,28 @@ def get_stats(particles):
     return mean, cov
 
 
-def predict(parts, u, plantdist, model):
+def predict(parts, u, plantdist, model, rng=None):
     """Project the particles one step forward.
     NOTE: this overwrites parts therefore use a dummy variable!"""
 
     nX, nP = parts.shape
-    for p in range(nP):
-        noise = plantdist.rvs()
-        parts[:, p] = model.f(parts[:, p], u, noise)  # predict
+    if model.batch:
+        parts[:, :] = model.f(parts, u, draw_noise(plantdist, nX, nP, rng))  # predict
+    else:
+        for p in range(nP):
+            noise = plantdist.rvs(random_state=rng)
+            parts[:, p] = model.f(parts[:, p], u, noise)  # predict
+
+
+def draw_noise(dist, nX, nP, rng=None):
+    """Return an (nX, nP) block of noise drawn from dist in a single call."""
+    return numpy.reshape(dist.rvs(size=nP, random_state=rng), (nP, nX)).T
+
+
+def residuals(y, ypred):
+    """Return the measurement residuals of a batch of predictions ypred.
+    ypred is either (nY, nP) or (nP,) for scalar measurements. The residuals are
+    returned one row per particle which is the layout expected by logpdf."""
+    if numpy.ndim(ypred) == 1:
+        return y - ypred
+    return (numpy.reshape(y, (-1, 1)) - ypred).T
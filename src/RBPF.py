@@ -1,20 +1,23 @@
 # Rao Blackwellised Particle Filter
 # WARNING: this is made specifically for the system I am investigating
 import numpy
-import scipy.stats
-import copy
+import src.Noise as Noise
 import src.SPF as SPF
-import collections
+import src.Weights as Weights
+import src.Resampling as Resampling
 
 print("RBPF is hardcoded for the CSTR!")
 
 
 class Particles:
-    def __init__(self, mus, sigmas, ss, ws):
+    def __init__(self, mus, sigmas, ss, ws, sid=None):
         self.mus = mus  # mean
-        self.sigmas = sigmas  # covarience
+        self.sigmas = sigmas  # covarience (a table of the unique covariances if sid is not None)
         self.ss = ss  # switches
         self.ws = ws  # weights
+        self.sid = sid  # index of each particle's covariance in sigmas (collapsed mode only)
+        with numpy.errstate(divide="ignore"):
+            self.logws = numpy.log(ws)  # log weights
 
 
 class Model:
@@ -38,127 +41,184 @@ def setup_rbpf(linsystems, C, Q, R):
     return models, A
     
 
-def init_rbpf(sdist, mu_init, sigma_init, xN, nP):
-    """Initialise the particle filter."""
-
-    particles = Particles(numpy.zeros([xN, nP]), numpy.zeros([xN, xN, nP]),
-                          numpy.zeros(nP, dtype=numpy.int64), numpy.zeros(nP))
-    for p in range(nP):
-        sdraw = numpy.random.choice(range(len(sdist)), p=sdist)
-        particles.mus[:, p] = mu_init  # normal mu
-        particles.sigmas[:, :, p] = sigma_init
-        particles.ss[p] = sdraw
-        particles.ws[p] = 1/nP  # uniform initial weight
+def init_rbpf(sdist, mu_init, sigma_init, xN, nP, collapse=False, rng=None):
+    """Initialise the particle filter.
+    collapse => share the covariances between particles with the same switch history.
+    rng => stream of the switch draws (see the RNG module)
+    The covariances only depend on the switch sequence and not on the measurements,
+    therefore particles.sigmas only stores the unique covariances and particles.sid
+    indexes into it."""
+
+    if collapse:
+        particles = Particles(numpy.zeros([xN, nP]), numpy.zeros([xN, xN, 1]),
+                              numpy.zeros(nP, dtype=numpy.int64), numpy.zeros(nP), numpy.zeros(nP, dtype=numpy.int64))
+        particles.sigmas[:, :, 0] = sigma_init
+    else:
+        particles = Particles(numpy.zeros([xN, nP]), numpy.zeros([xN, xN, nP]),
+                              numpy.zeros(nP, dtype=numpy.int64), numpy.zeros(nP))
+        particles.sigmas[:, :, :] = sigma_init[:, :, None]
+    particles.mus[:, :] = numpy.reshape(mu_init, (-1, 1))  # normal mu
+    particles.ss[:] = SPF.draw_categorical(numpy.reshape(sdist, (-1, 1)), particles.ss, rng)
+    particles.ws[:] = 1/nP  # uniform initial weight
+    particles.logws = Weights.log_uniform(nP)
     return particles
 
 
-def init_filter(particles, u, y, models):
+def init_filter(particles, u, y, models, resampler=None, rng=None):
 
     nX, N = particles.mus.shape
     nS = len(models)
-    for p in range(N):
-        for s in range(nS):
-            if particles.ss[p] == s:
-                particles.mus[:, p] = particles.mus[:, p] - models[particles.ss[p]].b  # adjust mu for specific switch
-                mu = models[s].C @ (models[s].A @ particles.mus[:, p] + models[s].B*u)
-                temp = (models[s].A @ particles.sigmas[:, :, p] @ models[s].A.T + models[s].Q)
-                sigma = models[s].C @ temp @ models[s].C.T + models[s].R
-
-                d = scipy.stats.multivariate_normal(mean=mu, cov=sigma)
-
-                if not isinstance(y, collections.Iterable):
-                    particles.ws[p] = particles.ws[p]*d.pdf([y-models[s].b[1]])  # HARDCODED for this system!!!
-                else:
-                    particles.ws[p] = particles.ws[p]*d.pdf(numpy.subtract(y, models[s].b))  # weight of each particle
-            # println("Switch: ", s, " Predicts: ", round(mu + models[s].b, 4), "Observed: ", round(y,4),
-            # " Weight: ", round(particles.ws[p], 5))
-                particles.mus[:, p] = particles.mus[:, p] + models[particles.ss[p]].b  # fix mu for specific switch
-    particles.ws /= sum(particles.ws)
+    updatedVars, gains, density, pair = covariance_step(particles, models)
+    for s, ind in SPF.group_switches(particles.ss, nS):
+        mus = particles.mus[:, ind] - numpy.reshape(models[s].b, (-1, 1))  # adjust mu for specific switch
+        p = pair[ind]
+        loglik, _ = mean_step(mus, u, y, models[s], gains[p], density, p)
+        particles.logws[ind] += loglik
+
+    particles.logws, particles.ws = Weights.normalise(particles.logws)
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
 
     return particles
 
 
-def rbpf_filter(particles, u, y, models, A):
+def rbpf_filter(particles, u, y, models, A, resampler=None, rng=None):
 
     nX, N = particles.mus.shape
     nS = len(models)
 
-    # This can be made more compact but at the cost of clarity
     # first draw switch sample
-    for p in range(N):
-        for s in range(nS):
-            if particles.ss[p] == s:
-                particles.ss[p] = numpy.random.choice(range(len(A[:, s])), size=1, p=A[:, s])
+    particles.ss[:] = SPF.draw_categorical(A, particles.ss, rng)
 
-    # apply KF and weight
-    for p in range(N):
-        for s in range(nS):
-            if particles.ss[p] == s:
-                mu = models[s].C @ (models[s].A @ (particles.mus[:, p] - models[s].b) + models[s].B*u)
-                temp = (models[s].A @ particles.sigmas[:, :, p] @ models[s].A.T + models[s].Q)
-                sigma = models[s].C @ temp @ models[s].C.T + models[s].R
-                d = scipy.stats.multivariate_normal(mean=mu, cov=sigma)
-                if not isinstance(y, collections.Iterable):
-                    particles.ws[p] = particles.ws[p]*d.pdf([y-models[s].b[1]])  # HARDCODED for this system!!!
-                else:
-                    particles.ws[p] = particles.ws[p]*d.pdf(numpy.subtract(y, models[s].b))  # weight of each particle
-
-                if numpy.isnan(particles.ws[p]):
-                    print("Particle weight issue...")
-                    particles.ws[p] = 0.0
-
-                # println("Switch: ", s, " Predicts: ", round(mu + models[s].b, 4), "Observed: ", round(y,4),
-                # " Weight: ", round(particles.ws[p], 5))
-
-                pmean = models[s].A @ (particles.mus[:, p] - models[s].b) + models[s].B*u
-                pvar = models[s].Q + models[s].A @ particles.sigmas[:, :, p] @ models[s].A.T
-                kalmanGain = pvar @ models[s].C.T @ numpy.linalg.inv(models[s].C @ pvar @ models[s].C.T + models[s].R)
-                ypred = models[s].C @ pmean  # predicted measurement
-                if not isinstance(y, collections.Iterable):
-                    updatedMean = pmean + kalmanGain @ (y - models[s].b[1] - ypred)  # adjust for state space
-                else:
-                    updatedMean = pmean + kalmanGain @ (numpy.subtract(y, models[s].b) - ypred)  # adjust state space
-
-                rows, cols = pvar.shape
-                updatedVar = (numpy.eye(rows) - kalmanGain @ models[s].C) @ pvar
-
-                particles.sigmas[:, :, p] = updatedVar
-                particles.mus[:, p] = updatedMean + models[s].b  # fix
-
-    # particles.ws = particles.ws .+ abs(minimum(particles.ws)) #no negative number issue
-    if max(particles.ws) < (1.0/(N**2)):
-        print("The particles all have very small weight...")
-
-    if sum(particles.ws) == 0.0:
-        raise ValueError("Zero cumulative weight...")
-
-    particles.ws /= sum(particles.ws)
-
-    for w in particles.ws:
-        if numpy.isnan(w):
-            raise ValueError("Particles have become degenerate! (after normalisation)")
+    # apply KF and weight: first the covariances and then the means of each switch
+    updatedVars, gains, density, pair = covariance_step(particles, models)
+    for s, ind in SPF.group_switches(particles.ss, nS):
+        b = numpy.reshape(models[s].b, (-1, 1))
+        mus = particles.mus[:, ind] - b  # adjust mu for specific switch
+        p = pair[ind]
+        loglik, updatedMeans = mean_step(mus, u, y, models[s], gains[p], density, p)
+
+        particles.logws[ind] += loglik
+        particles.mus[:, ind] = updatedMeans + b  # fix
+
+    particles.sigmas = numpy.ascontiguousarray(numpy.moveaxis(updatedVars, 0, -1))
+    if particles.sid is not None:
+        particles.sid = pair
+
+    particles.logws, particles.ws = Weights.normalise(particles.logws)  # nan weights are set to zero
 
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
 
     return particles
 
 
-def resample(particles):
+def covariance_step(particles, models):
+    """Return the updated covariances, Kalman gains and the densities (Noise.Stacked) of the
+    predicted measurements, stacked along the first axis. Also returns the index of each
+    particle into these stacks. In the collapsed mode only the unique (parent covariance,
+    switch) pairs are computed."""
+    nS = len(models)
+    if particles.sid is None:
+        N = len(particles.ss)
+        parents = numpy.arange(N)
+        switches = particles.ss
+        pair = parents
+    else:
+        keys, pair = numpy.unique(particles.sid*nS + particles.ss, return_inverse=True)
+        parents = keys // nS
+        switches = keys % nS
+        pair = numpy.reshape(pair, -1)
+
+    nY, nX = numpy.atleast_2d(models[0].C).shape  # all the switches measure the same states
+    U = len(switches)
+    pvars = numpy.zeros([U, nX, nX])
+    CPs = numpy.zeros([U, nY, nX])
+    ysigmas = numpy.zeros([U, nY, nY])
+    for s, ind in SPF.group_switches(switches, nS):
+        sigmas = numpy.moveaxis(particles.sigmas[:, :, parents[ind]], -1, 0)
+        pvars[ind], CPs[ind], ysigmas[ind] = predict_covariance(sigmas, models[s])
+    updatedVars, gains, density = update_covariance(pvars, CPs, ysigmas)
+    return updatedVars, gains, density, pair
+
+
+def predict_covariance(sigmas, model):
+    """Kalman filter covariance predict step for stacked (n, nX, nX) covariances.
+    Returns the predicted covariances P, C P and the predicted measurement covariances."""
+    C = numpy.atleast_2d(model.C)
+    R = numpy.atleast_2d(model.R)
+
+    pvars = model.A @ sigmas @ model.A.T + model.Q
+    CP = C @ pvars  # (n, nY, nX)
+    ysigmas = CP @ C.T + R
+    return pvars, CP, ysigmas
+
+
+def update_covariance(pvars, CP, ysigmas):
+    """Kalman filter covariance update step for stacked covariances (see predict_covariance).
+    Returns the updated covariances, the Kalman gains and the measurement densities."""
+    density = Noise.Stacked(ysigmas)
+    Linv = density.Linv
+    kalmanGains = numpy.swapaxes(numpy.swapaxes(Linv, 1, 2) @ (Linv @ CP), 1, 2)  # P C' inv(C P C' + R)
+    updatedVars = pvars - kalmanGains @ CP
+    updatedVars = 0.5*(updatedVars + numpy.swapaxes(updatedVars, 1, 2))  # round off grows on the unstable switches
+    return updatedVars, kalmanGains, density
+
+
+def kalman_covariance(sigmas, model):
+    """Kalman filter covariance predict and update step for stacked (n, nX, nX) covariances.
+    Returns the updated covariances, the Kalman gains and the densities of the predicted measurements."""
+    return update_covariance(*predict_covariance(sigmas, model))
+
+
+def mean_step(mus, u, y, model, kalmanGains, density, index=None):
+    """Kalman filter mean predict and update step for (nX, n) means in the deviation variables of the
+    switch, given the per particle gains from kalman_covariance and the measurement densities
+    (particle k uses density index[k]). Returns the log likelihood of y and the updated means."""
+    C = numpy.atleast_2d(model.C)
+
+    if numpy.ndim(y) == 0:
+        ydev = numpy.array([y - model.b[1]])  # HARDCODED for this system!!!
+    else:
+        ydev = numpy.subtract(y, model.b)  # adjust for state space
+
+    pmeans = model.A @ mus + numpy.reshape(model.B*u, (-1, 1))
+    residuals = (numpy.reshape(ydev, (-1, 1)) - C @ pmeans).T  # (n, nY)
+
+    loglik = density.logpdf(residuals, index)
+    updatedMeans = pmeans + (kalmanGains @ residuals[:, :, None])[:, :, 0].T
+    return loglik, updatedMeans
+
+
+def kalman_step(mus, sigmas, u, y, model):
+    """Kalman filter predict and update step for a batch of particles in the same switch.
+    mus => (nX, n) means in the deviation variables of the switch
+    sigmas => (n, nX, nX) stacked covariances
+    Returns the log likelihood of y, the updated means (nX, n) and the updated covariances (n, nX, nX)."""
+    updatedVars, kalmanGains, density = kalman_covariance(sigmas, model)
+    loglik, updatedMeans = mean_step(mus, u, y, model, kalmanGains, density)
+    return loglik, updatedMeans, updatedVars
+
+
+def resample(particles, resampler=None, rng=None):
+    """Resample the particles using the scheme of resampler (see the Resampling module)."""
+    if resampler is None:
+        resampler = Resampling.default
     N = len(particles.ws)
-    sample = numpy.random.choice(range(len(particles.ws)), size=N, p=particles.ws)
-    copyparticles_mus = copy.copy(particles.mus)
-    copyparticles_sigmas = copy.copy(particles.sigmas)
-    copyparticles_ss = copy.copy(particles.ss)
-    for p in range(N):  # resample
-        particles.mus[:, p] = copyparticles_mus[:, sample[p]]
-        particles.sigmas[:, :, p] = copyparticles_sigmas[:, :, sample[p]]
-        particles.ss[p] = copyparticles_ss[sample[p]]
-        particles.ws[p] = 1/N
-
-    particles = roughen(particles)
+    sample = resampler.indices(particles.ws, rng)
+    resampler.gather(particles.mus, sample)
+    resampler.gather(particles.ss, sample)
+    if particles.sid is None:
+        resampler.gather(particles.sigmas, sample)
+    else:  # only keep the covariances which survived
+        resampler.gather(particles.sid, sample)
+        used, particles.sid = numpy.unique(particles.sid, return_inverse=True)
+        particles.sid = numpy.reshape(particles.sid, -1)
+        particles.sigmas = particles.sigmas[:, :, used]
+    particles.ws = numpy.full(N, 1/N)
+    particles.logws = Weights.log_uniform(N)
+
+    particles = roughen(particles, resampler, rng)
     return particles
 
 
@@ -172,62 +232,34 @@ def number_effective_particles(particles):
     return 1/numeff
 
 
-def roughen(particles):
+def roughen(particles, resampler=None, rng=None):
     """Roughening the samples to promote diversity"""
-    xN, N = particles.mus.shape
-    sig = numpy.zeros(xN)
-
-    K = 0.2  # parameter...
-    flag = True
-    for k in range(xN):
-        D = max(particles.mus[k, :]) - min(particles.mus[k, :])
-        if D == 0.0:
-            print("Particle distance very small! Roughening could cause problems...")
-            flag = False
-            break
-        sig[k] = K*D*N**(-1./xN)
-
-    if flag:
-        sigma = numpy.diag(sig**2)
-        jitter = scipy.stats.multivariate_normal(cov=sigma)
-        for p in range(N):
-            particles.mus[:, p] = particles.mus[:, p] + jitter.rvs()
-
+    if resampler is None:
+        resampler = Resampling.default
+    resampler.roughen(particles.mus, rng)
     return particles
 
 
 def get_ave_stats(particles):
-    nX, nP = particles.mus.shape
-    ave = numpy.zeros(nX)
-    avesigma = numpy.zeros([nX, nX])
-    for p in range(nP):
-        ave = ave + particles.ws[p]*particles.mus[:, p]
-        avesigma = avesigma + particles.ws[p] * particles.sigmas[:, :, p]
-
+    ave = particles.mus @ particles.ws
+    if particles.sid is None:
+        avesigma = particles.sigmas @ particles.ws
+    else:
+        avesigma = particles.sigmas @ numpy.bincount(particles.sid, weights=particles.ws,
+                                                     minlength=particles.sigmas.shape[2])
     return ave, avesigma
 
 
 def get_ml_stats(particles):
-    nX, nP = particles.mus.shape
-    mlmu = numpy.zeros(nX)
-    mlsigma = numpy.zeros([nX, nX])
-    prevmaxweight = 0.0
-    for p in range(nP):
-        if particles.ws[p] > prevmaxweight:
-            mlmu = particles.mus[:, p]
-            mlsigma = particles.sigmas[:, :, p]
-            prevmaxweight = particles.ws[p]
-
-    return mlmu, mlsigma
+    p = numpy.argmax(particles.ws)
+    if particles.sid is None:
+        return particles.mus[:, p], particles.sigmas[:, :, p]
+    return particles.mus[:, p], particles.sigmas[:, :, particles.sid[p]]
 
 
 def get_max_track(particles, numSwitches):
     maxtrack = numpy.zeros(numSwitches)
-    numParticles = len(particles.ws)
-    totals = numpy.zeros(numSwitches)
-    for p in range(numParticles):
-        totals[particles.ss[p]] += particles.ws[p]
-
+    totals = numpy.bincount(particles.ss, weights=particles.ws, minlength=numSwitches)
     maxtrack[numpy.argmax(totals)] = 1.0
     return maxtrack
 
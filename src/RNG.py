@@ -0,0 +1,34 @@
+# Random number streams. An RNG is a numpy.random.Generator which keeps its SeedSequence
+# so that independent child streams can be spawned (e.g. one per Monte Carlo run or per
+# worker) and a run can be repeated exactly from its seed. The stochastic functions take
+# an optional rng argument; None draws from the global numpy.random state as before.
+import numpy
+
+
+class RNG(numpy.random.Generator):
+    def __init__(self, seed=None):
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        self.seq = seed
+        super().__init__(numpy.random.PCG64(seed))
+
+    def spawn(self, n):
+        """Return n independent child streams."""
+        return [RNG(seq) for seq in self.seq.spawn(n)]
+
+    def __reduce__(self):
+        return restore, (self.seq, self.bit_generator.state)
+
+
+def restore(seq, state):
+    """Return the RNG of seq in the given bit generator state (used by pickle)."""
+    rng = RNG(seq)
+    rng.bit_generator.state = state
+    return rng
+
+
+def get(rng=None):
+    """Return the source of the random numbers: rng or the global numpy.random state."""
+    if rng is None:
+        return numpy.random
+    return rng
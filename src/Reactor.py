@@ -1,7 +1,20 @@
+import hashlib
 import numpy
-import random
+import os
+import pathlib
 import scipy.optimize
-import typing
+import src.RNG as RNG
+
+# Directory of the linearised model banks (see Reactor.linearise_batch). The cache is off (None)
+# unless a directory is set, e.g. with set_cache_dir.
+cache_dir = None
+cache_version = 1  # part of the cache keys: bump it whenever the linearisation changes
+
+
+def set_cache_dir(path):
+    """Cache the linearised model banks in path (None switches the cache off)."""
+    global cache_dir
+    cache_dir = None if path is None else pathlib.Path(path)
 
 
 class LinearReactor:
@@ -25,7 +38,8 @@ class Reactor:
         self.rho = rho
         self.F = F
         self.operatingpoints = None
-        
+        self.workspace = None  # preallocated buffers for run_reactor_batch
+
     def run_reactor(self, xprev, u, h):
         """Use Runga-Kutta method to solve for the next time step using the full"""
         k1 = self.reactor_ode(xprev, u)
@@ -44,6 +58,59 @@ class Reactor:
         xnow[1] += u/(self.rho*self.Cp*self.V)
         return xnow
         
+    def run_reactor_batch(self, xprev, u, h, out=None):
+        """Vectorised version of run_reactor which advances a (2, N) block of states
+        one time step. u is either a scalar or has one entry per column. The
+        intermediate stages are stored in buffers which are reused between calls. The
+        buffers are sized for the largest block seen so far and smaller blocks (e.g. the
+        switch groups of the SPF) use the leading columns."""
+        nX, N = xprev.shape
+        if self.workspace is None or self.workspace[0].shape[1] != nX or self.workspace[0].shape[2] < N:
+            self.workspace = (numpy.zeros([4, nX, N]), numpy.zeros([nX, N]), numpy.zeros(N))
+        k, xtemp, rate = self.workspace
+        k, xtemp, rate = k[:, :, :N], xtemp[:, :N], rate[:N]
+
+        self.reactor_ode_batch(xprev, u, k[0], rate)
+        numpy.multiply(k[0], 0.5*h, out=xtemp)
+        xtemp += xprev
+        self.reactor_ode_batch(xtemp, u, k[1], rate)
+        numpy.multiply(k[1], 0.5*h, out=xtemp)
+        xtemp += xprev
+        self.reactor_ode_batch(xtemp, u, k[2], rate)
+        numpy.multiply(k[2], h, out=xtemp)
+        xtemp += xprev
+        self.reactor_ode_batch(xtemp, u, k[3], rate)
+
+        if out is None:
+            out = numpy.zeros([nX, N])
+        numpy.add(k[1], k[2], out=out)
+        out *= 2.0
+        out += k[0]
+        out += k[3]
+        out *= h/6.0
+        out += xprev
+        return out
+
+    def reactor_ode_batch(self, xprev, u, xnow, rate):
+        """Evaluate the ODE defs describing the reactor for a (2, N) block of states.
+        The result is written into xnow and rate is a length N scratch buffer."""
+        numpy.multiply(xprev[1], self.R, out=rate)
+        numpy.divide(-self.E, rate, out=rate)
+        numpy.exp(rate, out=rate)
+        rate *= self.k0
+        rate *= xprev[0]  # reaction rate
+
+        numpy.subtract(self.CA0, xprev[0], out=xnow[0])
+        xnow[0] *= self.F/self.V
+        xnow[0] -= rate
+
+        numpy.subtract(self.TA0, xprev[1], out=xnow[1])
+        xnow[1] *= self.F/self.V
+        rate *= self.dH/(self.rho*self.Cp)
+        xnow[1] -= rate
+        xnow[1] += numpy.divide(u, self.rho*self.Cp*self.V)
+        return xnow
+
     def reactor_func(self, xprev, u):
         """Evaluate the ODE defs describing the reactor. In the format required by NLsolve!
         xnow :: Array{Float64, 1} = zeros(2)"""
@@ -83,23 +150,66 @@ class Reactor:
         """Returns the linearised coefficients of the Runge Kutta method
         given a linearisation point.
         To solve use x(k+1) =  Ax(k) + Bu(k)"""
-        B11 = 0.0
-        B21 = 1.0/(self.rho*self.V*self.Cp)
-        B = [B11, B21]
-        A = self.jacobian(linpoint)
-        F0 = self.reactor_ode(linpoint, 0.0)  # u = 0 because Bs account for the control term
-        D = A @ linpoint
-        # now we have x' = Ax + Bu + F0 - D = F(x)
-        # now write ito deviation variables!
-        newb = numpy.linalg.inv(A) @ (D-F0)
-        # now we have xp' = Axp + Bu where x = xp + newb
-
-        n = len(A)
-        # Uses the bilinear transform aka the Tustin transform... google it...
-        newA = (numpy.identity(n) + 0.5*h*A) @ numpy.linalg.inv(numpy.identity(n) - 0.5*h*A)
-        newB = numpy.linalg.inv(A) @ (newA-numpy.identity(n)) @ B
-
-        return newA, newB, newb
+        A, B, b = self.linearise_batch(numpy.reshape(linpoint, [2, 1]), h, cache=False)
+        return A[0], B[0], b[0]
+
+    def jacobian_batch(self, xs):
+        """Returns the (N, 2, 2) Jacobians evaluated at the columns of the (2, N) states xs"""
+        rate = self.k0*numpy.exp(-self.E/(self.R*xs[1]))
+        drate = rate*self.E/(self.R*xs[1]**2)  # derivative of the rate constant w.r.t. T
+        c = self.dH/(self.rho*self.Cp)
+        J = numpy.zeros([xs.shape[1], 2, 2])
+        J[:, 0, 0] = -self.F/self.V - rate
+        J[:, 0, 1] = -xs[0]*drate
+        J[:, 1, 0] = -c*rate
+        J[:, 1, 1] = -self.F/self.V - c*drate*xs[0]
+        return J
+
+    def linearise_batch(self, ops, h, cache=True):
+        """Returns the stacked (N, 2, 2) A, (N, 2) B and (N, 2) b of the linearised models
+        at the columns of the (2, N) operating points ops (see linearise).
+        If cache is True and cache_dir is set the result is stored in and loaded from cache_dir."""
+        path = None
+        if cache and cache_dir is not None:
+            path = pathlib.Path(cache_dir) / (self.cache_key(ops, h) + ".npz")
+            if path.is_file():
+                with numpy.load(path) as data:
+                    return data["A"], data["B"], data["b"]
+
+        N = ops.shape[1]
+        J = self.jacobian_batch(ops)
+        F0 = self.reactor_ode_batch(ops, 0.0, numpy.zeros([2, N]), numpy.zeros(N))  # u = 0 because B accounts for the control term
+        D = numpy.einsum("kij,jk->ki", J, ops)
+        # x' = Jx + Bu + F0 - D so in deviation variables xp' = Jxp + Bu where x = xp + b
+        b = numpy.linalg.solve(J, (D - F0.T)[:, :, None])[:, :, 0]
+
+        # Tustin transform: (I - hJ/2) and (I + hJ/2) commute so A = inv(I - hJ/2) @ (I + hJ/2)
+        I = numpy.identity(2)
+        A = numpy.linalg.solve(I - 0.5*h*J, I + 0.5*h*J)
+        Bc = numpy.array([0.0, 1.0/(self.rho*self.V*self.Cp)])
+        B = numpy.linalg.solve(J, ((A - I) @ Bc)[:, :, None])[:, :, 0]
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name("{0}.{1}.tmp".format(path.stem, os.getpid()))
+            with open(tmp, "wb") as f:
+                numpy.savez(f, A=A, B=B, b=b)
+            os.replace(tmp, path)  # atomic so concurrent runs never read a partial file
+        return A, B, b
+
+    def cache_key(self, ops, h):
+        """Returns the hash of the cache version, the reactor parameters, h and the operating points."""
+        parameters = numpy.array([cache_version, self.V, self.R, self.CA0, self.TA0, self.dH, self.k0, self.E,
+                                  self.Cp, self.rho, self.F, h], dtype=float)
+        digest = hashlib.sha1(parameters.tobytes())
+        digest.update(numpy.ascontiguousarray(ops, dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def linear_systems(self, ops, h):
+        """Returns the list of LinearReactors at the columns of ops"""
+        A, B, b = self.linearise_batch(ops, h)
+        linsystems = [LinearReactor(ops[:, k], A[k], B[k], b[k]) for k in range(ops.shape[1])]
+        return linsystems
 
     def discretise(self, nX, nY, xspace, yspace):
         """Discrete the state space into nX*nY regions."""
@@ -121,17 +231,16 @@ class Reactor:
         self.operatingpoints = operatingpoints
         return operatingpoints
 
-    def discretise_randomly(self, npoints, xspace, yspace):
+    def discretise_randomly(self, npoints, xspace, yspace, rng=None):
         """Perform the same action as discretise() except pick points to
-        discretise around at random."""
+        discretise around at random (drawn from rng, see the RNG module)."""
         operatingpoints = numpy.zeros([2, npoints+3])
         if npoints == 0:
             k = 0
         else:
             k = 1
         for k in range(npoints):
-            nx = random.random()
-            ny = random.random()
+            nx, ny = RNG.get(rng).uniform(size=2)
             xnow = xspace[1] + nx*(xspace[2] - xspace[1])
             ynow = yspace[1] + ny*(yspace[2] - yspace[1])
             operatingpoints[:, k] = [xnow, ynow]
@@ -145,34 +254,18 @@ class Reactor:
     def get_linear_systems(self, nX, nY, xspace, yspace, h):
         """Returns an array of linearised systems"""
 
-        N = nX*nY + 3  # add the three nominal operating points
-        linsystems = [None]*N  # type: typing.List[LinearReactor]
-        ops = self.discretise(nX, nY, xspace, yspace)
-        for k in range(N):
-            op = ops[:, k]
-            A, B, b = self.linearise(op, h)
-            linsystems[k] = LinearReactor(op, A, B, b)
-            
-        return linsystems
+        ops = self.discretise(nX, nY, xspace, yspace)  # includes the three nominal operating points
+        return self.linear_systems(ops, h)
 
-    def get_linear_systems_randomly(self, npoints, xspace, yspace, h):
+    def get_linear_systems_randomly(self, npoints, xspace, yspace, h, rng=None):
         """Returns an array of linearised systems"""
 
-        N = npoints + 3  # add the three nominal operating points
-        linsystems = [None]*N  # type: typing.List[LinearReactor]
-        ops = self.discretise_randomly(npoints, xspace, yspace)
-        for k in range(N):
-            op = ops[:, k]
-            A, B, b = self.linearise(op, h)
-            linsystems[k] = LinearReactor(op, A, B, b)
-
-        return linsystems
+        ops = self.discretise_randomly(npoints, xspace, yspace, rng)  # includes the three nominal operating points
+        return self.linear_systems(ops, h)
 
     def get_nominal_linear_systems(self, h):
         """Returns an array of linearised systems"""
 
-        linsystems = [None]*3  # type: typing.List[LinearReactor]
-
         # Get the steady state points
         xguess1 = [0.073, 493.0]
         xguess2 = [0.21, 467.0]
@@ -190,9 +283,4 @@ class Reactor:
         ops[:, 1] = xx2res
         ops[:, 2] = xx3res
 
-        for k in range(3):
-            op = ops[:, k]
-            A, B, b = self.linearise(op, h)
-            linsystems[k] = LinearReactor(op, A, B, b)
-
-        return linsystems
+        return self.linear_systems(ops, h)
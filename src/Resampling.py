@@ -0,0 +1,111 @@
+# Resampling schemes shared by the particle filters.
+# All the schemes search the cumulative sum of the weights with a vector of
+# ordered uniform draws. See "Comparison of resampling schemes for particle
+# filtering" by Douc et al (2005) for a comparison of their variance.
+import numpy
+import src.RNG as RNG
+
+
+def search(w, u):
+    """Return the indices of the ordered uniform draws u in the cumulative weights."""
+    cumw = numpy.cumsum(w)
+    cumw[-1] = 1.0  # guard against round off
+    return numpy.searchsorted(cumw, u, side="right")
+
+
+def multinomial(w, rng=None):
+    """Draw N independent samples from the weighted Categorical distribution."""
+    N = len(w)
+    u = numpy.sort(RNG.get(rng).uniform(size=N))
+    return search(w, u)
+
+
+def stratified(w, rng=None):
+    """Draw one sample from each of the N equally sized strata of [0, 1)."""
+    N = len(w)
+    u = (numpy.arange(N) + RNG.get(rng).uniform(size=N))/N
+    return search(w, u)
+
+
+def systematic(w, rng=None):
+    """Draw a single uniform offset shared by all N strata of [0, 1)."""
+    N = len(w)
+    u = (numpy.arange(N) + RNG.get(rng).uniform())/N
+    return search(w, u)
+
+
+def residual(w, rng=None):
+    """Keep floor(N*w) copies of each particle and draw the rest multinomially."""
+    N = len(w)
+    counts = numpy.floor(N*w).astype(numpy.int64)
+    kept = numpy.repeat(numpy.arange(N), counts)
+    R = N - len(kept)  # number of particles still to draw
+    if R == 0:
+        return kept
+    wres = N*w - counts
+    wres /= numpy.sum(wres)
+    u = numpy.sort(RNG.get(rng).uniform(size=R))
+    return numpy.hstack([kept, search(wres, u)])
+
+
+def roughen(x, K=0.2, rng=None):
+    """Roughen the (nX, N) samples in place to promote diversity. Each state is
+    jittered with standard deviation K*E*N^(-1/nX) where E is the spread of the
+    samples in that state, as in Gordon et al (1993)."""
+    nX, N = x.shape
+    sig = K*(numpy.max(x, axis=1) - numpy.min(x, axis=1))*N**(-1/nX)
+    x += sig[:, None]*RNG.get(rng).standard_normal((nX, N))
+    return x
+
+
+def shrink(x, delta=0.98, rng=None):
+    """Jitter the (nX, N) samples in place with the kernel shrinkage of Liu and West (2001).
+    The samples are shrunk towards their mean before jittering so that the
+    variance of the population is preserved. delta is the discount factor."""
+    nX, N = x.shape
+    a = (3*delta - 1)/(2*delta)  # shrinkage
+    mean = numpy.mean(x, axis=1)
+    sig = numpy.sqrt((1 - a**2)*numpy.var(x, axis=1))
+    x *= a
+    x += ((1 - a)*mean)[:, None]
+    x += sig[:, None]*RNG.get(rng).standard_normal((nX, N))
+    return x
+
+
+schemes = {"multinomial": multinomial,
+           "stratified": stratified,
+           "systematic": systematic,
+           "residual": residual}
+
+
+class Resampler:
+    def __init__(self, scheme="multinomial", K=0.2, delta=None):
+        if scheme not in schemes:
+            raise ValueError("Unknown resampling scheme: {0}".format(scheme))
+        self.scheme = scheme
+        self.K = K  # roughening parameter
+        self.delta = delta  # Liu-West discount factor, None => standard roughening
+        self.buffers = {}  # preallocated gather buffers keyed by shape and type
+
+    def indices(self, w, rng=None):
+        """Return the indices of the resampled particles."""
+        return schemes[self.scheme](w, rng)
+
+    def gather(self, arr, ind):
+        """Overwrite arr with its columns (last axis) selected by ind."""
+        key = (arr.shape, arr.dtype)
+        if key not in self.buffers:
+            self.buffers[key] = numpy.empty_like(arr)
+        buffer = self.buffers[key]
+        numpy.take(arr, ind, axis=-1, out=buffer)  # raises on an out of range index
+        arr[...] = buffer
+        return arr
+
+    def roughen(self, x, rng=None):
+        """Jitter the (nX, N) samples in place."""
+        if self.delta is None:
+            return roughen(x, self.K, rng)
+        return shrink(x, self.delta, rng)
+
+
+default = Resampler()  # used by the filters when no resampler is specified
@@ -1,9 +1,9 @@
 # switching particle filter
 import numpy
-import copy
-import scipy.stats
-import typing
-import collections
+import src.PF as PF
+import src.Weights as Weights
+import src.Resampling as Resampling
+import src.RNG as RNG
 
 
 class Particles:
@@ -11,106 +11,123 @@ class Particles:
         self.x = x  # states
         self.s = s  # switches
         self.w = w  # weights
-        
+        with numpy.errstate(divide="ignore"):
+            self.logw = numpy.log(w)  # log weights
+
 
 class Model:
-    def __init__(self, F, G, A, xdists, ydists):
+    def __init__(self, F, G, A, xdists, ydists, batch=False):
         self.F = F  # transition
         self.G = G  # emission
         self.A = A  # HMM model, columns sum to 1
         self.xdists = xdists
         self.ydists = ydists
+        self.batch = batch  # F and G accept (nX, n) particle and noise matrices (see PF.Model)
 
 
-def init_spf(xdist, sdist, nP, xN):
+def init_spf(xdist, sdist, nP, xN, rng=None):
     """Initialise the particle filter.
     xdist => state prior (a distribution from the package Distributions)
     sdist => switch prior distribution
     nP => number of particles
     nX => number of states per particle
+    rng => RNG.RNG stream (None => the global numpy.random state)
     Return an array of nP particles"""
 
     particles = Particles(numpy.zeros([xN, nP]), numpy.zeros(nP, dtype=numpy.int64), numpy.zeros(nP))
-    for p in range(nP):
-        xdraw = xdist.rvs()
-        sdraw = numpy.random.choice(range(len(sdist)), p=sdist)
-        particles.x[:, p] = xdraw
-        particles.s[p] = sdraw
-        particles.w[p] = 1/nP  # uniform initial weight
+    particles.x[:, :] = PF.draw_noise(xdist, xN, nP, rng)
+    particles.s[:] = draw_categorical(numpy.reshape(sdist, (-1, 1)), numpy.zeros(nP, dtype=numpy.int64), rng)
+    particles.w[:] = 1/nP  # uniform initial weight
+    particles.logw = Weights.log_uniform(nP)
 
     return particles
 
 
-def init_filter(particles, y, model):
+def init_filter(particles, y, model, resampler=None, rng=None):
 
     nX, N = particles.x.shape
     nS, _ = model.A.shape
 
-    for p in range(N):
-        for s in range(nS):
-            if particles.s[p] == s:
-                if not isinstance(y, collections.Iterable):
-                    particles.w[p] = particles.w[p]*model.ydists[s].pdf(y - model.G[s](particles.x[:, p]))
-                else:
-                    temp = numpy.subtract(y, model.G[s](particles.x[:, p]))
-                    particles.w[p] = particles.w[p] * model.ydists[s].pdf(temp)
+    for s, ind in group_switches(particles.s, nS):
+        particles.logw[ind] += log_likelihood(particles.x[:, ind], y, model, s)
 
-    # particles.w = particles.w .+ abs(minimum(particles.w)) #no negative number issue
-    particles.w /= sum(particles.w)
+    particles.logw, particles.w = Weights.normalise(particles.logw)
 
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
     return particles
 
 
-def spf_filter(particles, u, y, model):
+def spf_filter(particles, u, y, model, resampler=None, rng=None):
     nX, N = particles.x.shape
     nS, _ = model.A.shape
 
-    # This can be made more compact but at the cost of clarity
     # first draw switch sample
-    for p in range(N):
-        for s in range(nS):
-            if particles.s[p] == s:
-                particles.s[p] = numpy.random.choice(range(len(model.A[:, s])), size=1, p=model.A[:, s])
-                # rand(Categorical(model.A[:,s]))
-    # Now draw (predict) state sample
-    for p in range(N):
-        for s in range(nS):
-            if particles.s[p] == s:
-                noise = model.xdists[s].rvs()
-                particles.x[:, p] = model.F[s](particles.x[:, p], u, noise)  # predict
-                particles.w[p] = particles.w[p]*model.ydists[s].pdf(y - model.G[s](particles.x[:, p]))
-
-                if numpy.isnan(particles.w[p]):
-                    print("Particle weight issue...")
-                    particles.w[p] = 0
-
-    # particles.w = particles.w .+ abs(minimum(particles.w)) #no negative number issue
-    if max(particles.w) < 1/(N**2):
-        print("The particles all have very small weight...")
-    particles.w /= sum(particles.w)
-    for w in particles.w:
-        if numpy.isnan(w):
-            raise ValueError("Particles have become degenerate!")
+    particles.s[:] = draw_categorical(model.A, particles.s, rng)
+
+    # Now draw (predict) state sample for all the particles in each switch together
+    for s, ind in group_switches(particles.s, nS):
+        noise = PF.draw_noise(model.xdists[s], nX, len(ind), rng)
+        if model.batch:
+            particles.x[:, ind] = model.F[s](particles.x[:, ind], u, noise)  # predict
+        else:
+            for k, p in enumerate(ind):
+                particles.x[:, p] = model.F[s](particles.x[:, p], u, noise[:, k])  # predict
+        particles.logw[ind] += log_likelihood(particles.x[:, ind], y, model, s)
+
+    particles.logw, particles.w = Weights.normalise(particles.logw)  # nan weights are set to zero
 
     if number_effective_particles(particles) < N/2:
-        particles = resample(particles)
+        particles = resample(particles, resampler, rng)
         
     return particles
+
+
+def draw_categorical(A, s, rng=None):
+    """Draw the next switch of every particle by inverting the cumulative columns of A.
+    Column j of A is the distribution of the next switch given the current switch j."""
+    nS = len(A)
+    cumA = numpy.cumsum(A, axis=0)
+    u = RNG.get(rng).uniform(size=len(s))
+    snext = numpy.sum(u > cumA[:, s], axis=0)
+    return numpy.minimum(snext, nS-1)  # guard against round off
+
+
+def group_switches(s, nS):
+    """Return (switch, indices) pairs of the particles in each switch that is occupied."""
+    order = numpy.argsort(s, kind="mergesort")
+    bounds = numpy.cumsum(numpy.bincount(s, minlength=nS))
+    groups = []
+    start = 0
+    for k in range(nS):
+        if bounds[k] > start:
+            groups.append((k, order[start:bounds[k]]))
+        start = bounds[k]
+    return groups
+
+
+def log_likelihood(x, y, model, s):
+    """Return the log likelihood of y for each column of x given switch s."""
+    if model.batch:
+        return model.ydists[s].logpdf(PF.residuals(y, model.G[s](x)))
+    nX, n = x.shape
+    loglik = numpy.zeros(n)
+    for p in range(n):
+        loglik[p] = model.ydists[s].logpdf(numpy.subtract(y, model.G[s](x[:, p])))
+    return loglik
     
     
-def resample(particles):
+def resample(particles, resampler=None, rng=None):
+    """Resample the particles using the scheme of resampler (see the Resampling module)."""
+    if resampler is None:
+        resampler = Resampling.default
     N = len(particles.w)
-    # sample = rand(Categorical(particles.w), N)  # draw N samples from weighted Categorical
-    sample = numpy.random.choice(range(N), size=N, p=particles.w)
-    copyparticles_x = copy.copy(particles.x)
-    copyparticles_s = copy.copy(particles.s)
-    for p in range(N):  # resample
-        particles.x[:, p] = copyparticles_x[:, sample[p]]
-        particles.s[p] = copyparticles_s[sample[p]]
-        particles.w[p] = 1/N
-    particles = roughen(particles)
+    sample = resampler.indices(particles.w, rng)
+    resampler.gather(particles.x, sample)
+    resampler.gather(particles.s, sample)
+    particles.w = numpy.full(N, 1/N)
+    particles.logw = Weights.log_uniform(N)
+    particles = roughen(particles, resampler, rng)
     return particles
 
 
@@ -124,24 +141,11 @@ def number_effective_particles(particles):
     return 1/numeff
 
 
-def roughen(particles):
+def roughen(particles, resampler=None, rng=None):
     """Roughening the samples to promote diversity"""
-    xN, N = particles.x.shape
-    sig = numpy.zeros(xN)
-
-    K = 0.2  # parameter...
-
-    for k in range(xN):
-        D = max(particles.x[k, :]) - min(particles.x[k, :])
-        if D == 0:
-            print("Particle distance very small! Roughening could cause problems...")
-        sig[k] = K*D*N**(-1/xN)
-
-    sigma = numpy.diag(sig**2)
-    jitter = scipy.stats.multivariate_normal(cov=sigma)
-    for p in range(N):
-        particles.x[:, p] = particles.x[:, p] + jitter.rvs()
-    
+    if resampler is None:
+        resampler = Resampling.default
+    resampler.roughen(particles.x, rng)
     return particles
 
 
@@ -177,7 +181,7 @@ def calc_a(linsystems):
 def get_f(linsystems):
     """Return transmission function matrices"""
     N = len(linsystems)
-    F = [None]*N  # type: typing.List[(typing.Any, typing.Any)->typing.Any]
+    F = [None]*N
     for k in range(N):
         def f(x, u, w):
             return linsystems[k].A @ x + linsystems[k].B*u + w
@@ -189,7 +193,7 @@ def get_f(linsystems):
 def get_g(linsystems, C):
     """Return emission function matrices"""
     N = len(linsystems)
-    G = [None]*N  # type: typing.List[typing.Any->typing.Any]
+    G = [None]*N
     for k in range(N):
         def g(x):
             return C @ x
@@ -207,12 +211,7 @@ def get_dists(linsystems, dist):
 
 def get_max_track(particles, numSwitches):
     maxtrack = numpy.zeros(numSwitches)
-    numParticles = len(particles.w)
-    totals = numpy.zeros(numSwitches)
-
-    for p in range(numParticles):
-        totals[particles.s[p]] += particles.w[p]
+    totals = numpy.bincount(particles.s, weights=particles.w, minlength=numSwitches)
 
     maxtrack[numpy.argmax(totals)] = 1.0
     return maxtrack
-
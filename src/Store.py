@@ -0,0 +1,85 @@
+# Columnar store of simulation results. A store is a directory with one .npy file per
+# field holding the field of every run (runs x field shape), a done.npy mask of the
+# completed runs and meta.json with the layout and any metadata of the experiment.
+# The .npy files are memory mapped so runs can be written as they finish (in any
+# order) and read back lazily: only the slices that are used are loaded from disk.
+import json
+import numpy
+import numpy.lib.format
+import pathlib
+
+
+class Store:
+    def __init__(self, path, mode="r"):
+        """Open the store in path for reading (mode="r") or writing (mode="r+")."""
+        self.path = pathlib.Path(path)
+        self.mode = mode
+        with open(self.path / "meta.json") as f:
+            meta = json.load(f)
+        self.runs = meta["runs"]
+        self.layout = meta["fields"]  # name => {"shape": [...], "dtype": ...}
+        self.metadata = meta["metadata"]
+        self.arrays = {}  # memory maps opened on first use
+        self.done = numpy.load(self.path / "done.npy", mmap_mode=mode)
+
+    def __getitem__(self, name):
+        """Return the (runs, ...) memory map of a field."""
+        if name not in self.arrays:
+            if name not in self.layout:
+                raise KeyError("Unknown field: {0}".format(name))
+            self.arrays[name] = numpy.load(self.path / (name + ".npy"), mmap_mode=self.mode)
+        return self.arrays[name]
+
+    def fields(self):
+        return list(self.layout)
+
+    def completed(self, name):
+        """Return the field of the completed runs (loaded into memory)."""
+        return numpy.asarray(self[name][numpy.asarray(self.done)])
+
+    def write(self, k, **arrays):
+        """Write the fields of run k. The run is marked as completed once its data is flushed."""
+        for name, value in arrays.items():
+            self[name][k] = value
+            self[name].flush()
+        self.done[k] = True
+        self.done.flush()
+
+    def append(self, **arrays):
+        """Write the fields to the first run that is not completed and return its index."""
+        free = numpy.flatnonzero(~numpy.asarray(self.done))
+        if len(free) == 0:
+            raise IndexError("The store in {0} is full ({1} runs)".format(self.path, self.runs))
+        self.write(free[0], **arrays)
+        return free[0]
+
+
+def create(path, fields, runs, overwrite=False, **metadata):
+    """Create an empty store in path for runs runs and return it opened for writing.
+    fields => {name: shape of one run} (float64) or {name: (shape, dtype)}
+    overwrite => replace an existing store in path (otherwise FileExistsError is raised so
+    the completed runs of an earlier experiment are never wiped by accident)
+    metadata => JSON serialisable description of the experiment"""
+    path = pathlib.Path(path)
+    if (path / "meta.json").exists() and not overwrite:
+        raise FileExistsError("A store already exists in {0} (use overwrite=True to replace it)".format(path))
+    path.mkdir(parents=True, exist_ok=True)
+    layout = {}
+    for name, spec in fields.items():
+        if len(spec) == 2 and isinstance(spec[0], (list, tuple)):
+            shape, dtype = spec
+        else:
+            shape, dtype = spec, "float64"
+        layout[name] = {"shape": list(shape), "dtype": numpy.dtype(dtype).str}
+        array = numpy.lib.format.open_memmap(path / (name + ".npy"), mode="w+", dtype=dtype,
+                                             shape=(runs,) + tuple(shape))
+        del array  # flushes the zeros to disk
+    numpy.save(path / "done.npy", numpy.zeros(runs, dtype=bool))
+    with open(path / "meta.json", "w") as f:
+        json.dump({"runs": runs, "fields": layout, "metadata": metadata}, f, indent=2)
+    return Store(path, "r+")
+
+
+def load(path):
+    """Open the store in path for reading."""
+    return Store(path, "r")
@@ -0,0 +1,22 @@
+# Particle weight handling shared by the particle filters.
+# The weights are carried in the log domain so that long runs and large
+# measurement residuals do not underflow to zero.
+import numpy
+import scipy.special
+
+
+def log_uniform(N):
+    """Return N uniform log weights."""
+    return numpy.full(N, -numpy.log(N))
+
+
+def normalise(logw):
+    """Normalise the log weights using log-sum-exp.
+    Returns the normalised log weights and the (linear) weights.
+    Raises ValueError if every particle has zero (or nan) likelihood."""
+    logw = numpy.where(numpy.isnan(logw), -numpy.inf, logw)  # a nan likelihood is treated as zero
+    total = scipy.special.logsumexp(logw)
+    if not numpy.isfinite(total):
+        raise ValueError("Particles have become degenerate!")
+    logw -= total
+    return logw, numpy.exp(logw)
@@ -0,0 +1,47 @@
+# Explicit MPC tests: the table should reproduce the online mpc_mean solution.
+
+import src.EMPC as EMPC
+import src.MPC as MPC
+import src.RNG as RNG
+import test.MPC_test as MPC_test
+import numpy
+import tempfile
+import os
+
+horizon = 20
+lower = numpy.array([-0.4, -5.0])
+upper = numpy.array([0.4, 80.0])
+args = (MPC_test.A, MPC_test.B, MPC_test.b, MPC_test.aline, MPC_test.bline, MPC_test.cline, MPC_test.QQ,
+        MPC_test.RR, MPC_test.ysp, MPC_test.usp, MPC_test.lim_u, MPC_test.lim_step_u)
+table = EMPC.build(horizon, *args, lower, upper, n=11)
+
+
+def test_table():
+    assert len(table.K) > 0
+    hits = 0
+    for x0 in lower + (upper - lower) * RNG.RNG(8).uniform(size=[50, 2]):
+        u = table.control(x0)
+        uqp = MPC.mpc_mean(x0, horizon, *args)
+        if uqp is None:
+            continue
+        assert abs(u - uqp).max() < 1e-3 * (1 + abs(uqp).max())
+        hits += table.locate(x0) >= 0
+    assert hits > 0
+
+
+def test_save_load():
+    x0 = numpy.array([0.01, 3.0])
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "table.npz")
+        table.save(path)
+        loaded = EMPC.load(path)
+    assert loaded.locate(x0) == table.locate(x0)
+    assert abs(loaded.control(x0) - table.control(x0)).max() < 1e-8
+    x0 = upper + 1.0  # outside the table: solved online
+    assert loaded.locate(x0) == -1
+    assert abs(loaded.control(x0) - MPC.mpc_mean(x0, horizon, *args)).max() < 1e-6
+
+
+if __name__ == '__main__':
+    test_table()
+    test_save_load()
@@ -14,6 +14,7 @@
 # demoLDSTracking.m
 
 import src.LLDS as LLDS
+import src.RNG as RNG
 import numpy
 import pandas
 import pathlib
@@ -35,6 +36,7 @@ sigmaR = 50.0  # standard deviation of measurement noise
 Q = sigmaQ**2*numpy.eye(6)  # process noise covariance
 R = sigmaR**2*numpy.eye(2)  # measurement noise covariance
 model = LLDS.LLDS(A, B, C, Q, R)
+model_steady = LLDS.LLDS(A, B, C, Q, R, steady=True)
 
 
 # Specify initial conditions
@@ -91,6 +93,76 @@ def test_smooth():
     assert (abs(smoothedcovar_own - smoothedcovar)).max() < tol
 
 
+def test_filter_steady():
+    ucontrol = numpy.zeros(1)  # no control so this is really only a dummy variable.
+    filtermeans_own = numpy.zeros([6, T])
+    filtercovar_own = numpy.zeros([6, 6, T])
+    temp = model_steady.init_filter(init_mean, init_covar, visiblestates[:, 0])
+    filtermeans_own[:, 0], filtercovar_own[:, :, 0] = temp
+    for t in range(1, T):
+        temp = model_steady.step_filter(filtermeans_own[:, t-1], filtercovar_own[:, :, t-1], ucontrol,
+                                        visiblestates[:, t])
+        filtermeans_own[:, t], filtercovar_own[:, :, t] = temp
+
+    assert (abs(filtermeans_own - filtermeans)).max() < tol
+
+    assert (abs(filtercovar_own - filtercovar)).max() < tol
+
+
+def test_steady_convergence():
+    """The steady state filter should take over from the full recursion on a stable system."""
+    A2 = numpy.array([[0.9, 0.1], [0.0, 0.8]])
+    B2 = numpy.array([0.0, 1.0])
+    C2 = numpy.eye(2)
+    Q2 = numpy.diag([1e-4, 1e-2])
+    R2 = numpy.diag([1e-2, 1.0])
+    full = LLDS.LLDS(A2, B2, C2, Q2, R2)
+    steady = LLDS.LLDS(A2, B2, C2, Q2, R2, steady=True)
+    ys = RNG.RNG(4).normal(size=[2, 200])
+    mean, covar = full.init_filter(numpy.zeros(2), numpy.eye(2), ys[:, 0])
+    smean, scovar = steady.init_filter(numpy.zeros(2), numpy.eye(2), ys[:, 0])
+    for t in range(1, 200):
+        mean, covar = full.step_filter(mean, covar, 1.0, ys[:, t])
+        smean, scovar = steady.step_filter(smean, scovar, 1.0, ys[:, t])
+
+    assert steady.is_steady(scovar, steady.ss_var)
+    assert abs(mean - smean).max() < 1e-4
+    assert abs(covar - scovar).max() < 1e-6
+
+
+def test_filter_smooth_batch():
+    M = 3  # the same measurements for every run
+    ys = numpy.broadcast_to(visiblestates, (M, 2, T))
+    batchmeans, batchcovar = model.filter_batch(init_mean, init_covar, ys)
+    for m in range(M):
+        assert (abs(batchmeans[m] - filtermeans)).max() < tol
+    assert (abs(batchcovar - filtercovar)).max() < tol
+
+    smoothbatchmeans, smoothbatchcovar = model.smooth_batch(batchmeans, batchcovar)
+    for m in range(M):
+        assert (abs(smoothbatchmeans[m] - smoothedmeans)).max() < tol
+    assert (abs(smoothbatchcovar - smoothedcovar)).max() < tol
+
+
+def test_filter_sqrt():
+    ucontrol = numpy.zeros(1)  # no control so this is really only a dummy variable.
+    filtermeans_own = numpy.zeros([6, T])
+    filtercovar_own = numpy.zeros([6, 6, T])
+    mean, sqrt = model.init_filter_sqrt(init_mean, init_covar, visiblestates[:, 0])
+    filtermeans_own[:, 0], filtercovar_own[:, :, 0] = mean, sqrt @ sqrt.T
+    for t in range(1, T):
+        mean, sqrt = model.step_filter_sqrt(mean, sqrt, ucontrol, visiblestates[:, t])
+        filtermeans_own[:, t], filtercovar_own[:, :, t] = mean, sqrt @ sqrt.T
+
+    assert (abs(filtermeans_own - filtermeans)).max() < tol
+
+    assert (abs(filtercovar_own - filtercovar)).max() < tol
+
+
 if __name__ == '__main__':
     test_filter()
     test_smooth()
+    test_filter_steady()
+    test_steady_convergence()
+    test_filter_smooth_batch()
+    test_filter_sqrt()
@@ -0,0 +1,71 @@
+# LQR tests: compare the DARE solution to scipy's on the CSTR linearisations.
+
+import src.LQR as LQR
+import src.MPC as MPC
+import src.Reactor as Reactor
+import numpy
+import scipy.linalg
+
+cstr = Reactor.Reactor()
+linsystems = cstr.get_nominal_linear_systems(0.1)
+QQ = numpy.zeros([2, 2])
+QQ[0, 0] = 10000.0
+RR = numpy.array([1e-5])
+
+
+def test_dare():
+    for linsystem in linsystems:
+        B = numpy.matrix(linsystem.B)  # inputs x states
+        P = LQR.dare(linsystem.A, B, QQ, RR)
+        Ps = scipy.linalg.solve_discrete_are(linsystem.A, numpy.asarray(B).T, QQ, numpy.atleast_2d(RR))
+        assert abs(P - Ps).max() < 1e-8 * abs(Ps).max()
+
+
+def test_dare_warm_start():
+    linsystem = linsystems[1]
+    B = numpy.matrix(linsystem.B)
+    P = LQR.dare(linsystem.A, B, QQ, RR)
+    A2 = linsystem.A * 1.001  # a nearby system
+    P2 = LQR.dare(A2, B, QQ, RR, P0=P)
+    Ps = scipy.linalg.solve_discrete_are(A2, numpy.asarray(B).T, QQ, numpy.atleast_2d(RR))
+    assert abs(P2 - Ps).max() < 1e-8 * abs(Ps).max()
+
+
+def test_dare_cache_bound():
+    size = MPC.cache_size
+    MPC.cache_size = 3
+    try:
+        B = numpy.matrix(linsystems[1].B)
+        first = LQR.dare(linsystems[1].A, B, QQ, RR)
+        for k in range(10):
+            LQR.dare(linsystems[1].A * (1.0 - 1e-4 * (k + 1)), B, QQ, RR)  # a sweep over new systems
+            assert len(LQR.solutions) <= 3
+        assert numpy.array_equal(LQR.dare(linsystems[1].A, B, QQ, RR), first)  # evicted and solved again
+    finally:
+        MPC.cache_size = size
+
+
+def test_controller_bank():
+    H = numpy.matrix([1.0, 0.0])
+    setpoint = linsystems[1].op[0]
+    bank = LQR.ControllerBank(linsystems, QQ, RR, numpy.eye(2), H, setpoint)
+    x = numpy.array([0.5, 420.0])
+    us = numpy.zeros(len(linsystems))
+    for k, linsystem in enumerate(linsystems):
+        x_off, u_off = LQR.offset(linsystem.A, linsystem.B, numpy.eye(2), H, numpy.matrix(setpoint - linsystem.b[0]))
+        K = LQR.lqr(linsystem.A, numpy.matrix(linsystem.B), QQ, RR)
+        us[k] = (u_off - K @ (x - linsystem.b - x_off))[0]
+        w = numpy.zeros(len(linsystems))
+        w[k] = 1.0
+        assert abs(bank.control(x, w) - us[k]).max() < 1e-6 * abs(us[k])
+
+    w = numpy.array([0.2, 0.5, 0.3])
+    assert abs(bank.control(x, w) - w @ us).max() < 1e-6 * abs(us).max()
+    assert abs(bank.control(linsystems[2].op) - bank.control(linsystems[2].op, [0, 0, 1])).max() < 1e-8
+
+
+if __name__ == '__main__':
+    test_dare()
+    test_dare_warm_start()
+    test_dare_cache_bound()
+    test_controller_bank()
@@ -0,0 +1,139 @@
+# MPC tests: solve the controller problems for the CSTR linearised about its
+# unstable operating point.
+
+import src.MPC as MPC
+import src.LQR as LQR
+import src.Reactor as Reactor
+import numpy
+import cvxpy
+
+cstr = Reactor.Reactor()
+h = 0.1  # time discretisation
+linsystem = cstr.get_nominal_linear_systems(h)[1]
+A = linsystem.A
+B = numpy.matrix(linsystem.B)
+b = linsystem.b
+
+QQ = numpy.zeros([2, 2])
+QQ[0, 0] = 10000.0
+RR = numpy.array([1e-5])
+Q = numpy.diag([1e-6, 0.1])  # plant noise
+horizon = 150
+aline = 10.  # constraint line ax + by + c = 0
+bline = 1.0
+cline = -410.0
+lim_u = 15000.0
+lim_step_u = 1000.0
+
+x_off, usp = LQR.offset(A, B, numpy.eye(2), numpy.matrix([1, 0]), numpy.matrix([linsystem.op[0] - b[0]]))
+ysp = x_off
+usp = numpy.array(usp)
+x0 = numpy.array([0.02, -3.0])
+cov0 = numpy.diag([1e-4, 1.0])
+
+
+def test_controller_cache():
+    c1 = MPC.get_controller(horizon, A, B, QQ, RR, aline, bline)
+    c2 = MPC.get_controller(horizon, A.copy(), B.copy(), QQ, RR, aline, bline)
+    assert c1 is c2
+    assert MPC.get_controller(horizon, A, B, QQ, RR) is not c1
+
+
+def test_controller_cache_bound():
+    size = MPC.cache_size
+    MPC.cache_size = 3
+    try:
+        first = MPC.get_controller(5, A, B, QQ, RR)
+        for n in range(6, 12):
+            MPC.get_controller(n, A, B, QQ, RR)
+            assert MPC.get_controller(5, A, B, QQ, RR) is first  # recently used entries stay
+            assert len(MPC.controllers) <= 3
+        MPC.get_controller(12, A, B, QQ, RR)
+        MPC.get_controller(13, A, B, QQ, RR)
+        MPC.get_controller(14, A, B, QQ, RR)
+        assert MPC.get_controller(5, A, B, QQ, RR) is not first  # evicted and rebuilt
+    finally:
+        MPC.cache_size = size
+
+
+def test_solver_fallback():
+    u = MPC.mpc_var(x0, cov0, horizon, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, Q, 4.6052)
+    ufall = MPC.mpc_var(x0, cov0, horizon, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, Q,
+                        4.6052, solver="NOT_A_SOLVER")
+    assert u is not None
+    assert abs(u - ufall).max() < 1e-3 * (1 + abs(u).max())
+    assert abs(u).max() <= lim_u + 1e-6
+
+
+def test_solver_recovery():
+    controller = MPC.get_controller(horizon, A, B, QQ, RR, aline, bline)
+    solve = controller.prob.solve
+    name = MPC.get_solvers()[0]
+    errors = ["Solver '{}' failed. Try another solver.", None, "Solver '{}': no license found."]
+    calls = []
+
+    def flaky(solver=None, **kwargs):  # name fails numerically, recovers and then loses its licence
+        calls.append(solver)
+        if solver == name and errors:
+            error = errors.pop(0)
+            if error is not None:
+                raise cvxpy.error.SolverError(error.format(solver))
+        return solve(solver=solver, **kwargs)
+
+    controller.prob.solve = flaky
+    args = (x0, cov0, horizon, A, B, b, aline, bline, cline, QQ, RR, ysp, usp, lim_u, lim_step_u, Q, 4.6052)
+    try:
+        MPC.mpc_var(*args)
+        assert calls[0] == name and len(calls) > 1  # the fallbacks were tried
+        assert name not in MPC.failed
+        del calls[:]
+        u = MPC.mpc_var(*args)  # the solver is tried again after a numerical failure
+        assert u is not None and calls == [name]
+        MPC.mpc_var(*args)
+        assert name in MPC.failed  # no licence: skipped from now on
+        del calls[:]
+        MPC.mpc_var(*args)
+        assert name not in calls
+        del calls[:]
+        ufixed = MPC.mpc_var(*args, solver=name)  # unless it is requested explicitly
+        assert calls[0] == name
+        assert abs(u - ufixed).max() < 1e-3 * (1 + abs(u).max())
+    finally:
+        del controller.prob.solve
+        MPC.failed.discard(name)
+
+
+def test_lqr_closed_form():
+    for x in [x0, numpy.array([-0.05, 10.0])]:
+        u = MPC.mpc_lqr(x, horizon, A, B, QQ, RR, ysp, usp)
+        uqp = MPC.mpc_lqr(x, horizon, A, B, QQ, RR, ysp, usp, solver=MPC.solver)
+        assert abs(u - uqp).max() < 1e-3 * (1 + abs(u).max())
+
+
+def test_variance_terms():
+    d = numpy.array([aline, bline])
+    for As in [A, cstr.get_nominal_linear_systems(h)[0].A]:  # unstable and stable operating points
+        G, v = MPC.variance_terms(As, Q, d, horizon)
+        sigmas = Q + As @ cov0 @ As.T
+        for i in range(horizon):
+            rsquared = d @ sigmas @ d
+            assert abs(G[i] @ cov0 @ G[i] + v[i] - rsquared) < 1e-8 * rsquared
+            sigmas = Q + As @ sigmas @ As.T
+
+    size = MPC.cache_size
+    MPC.cache_size = 2
+    try:
+        for n in range(5, 10):  # a sweep over the horizon keeps at most cache_size entries
+            MPC.variance_terms(A, Q, d, n)
+            assert len(MPC.variances) <= 2
+    finally:
+        MPC.cache_size = size
+
+
+if __name__ == '__main__':
+    test_controller_cache()
+    test_controller_cache_bound()
+    test_solver_fallback()
+    test_solver_recovery()
+    test_lqr_closed_form()
+    test_variance_terms()
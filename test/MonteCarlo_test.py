@@ -0,0 +1,74 @@
+# Monte Carlo runner tests: the runs must not depend on the number of processes and
+# failed runs are retried a bounded number of times.
+
+import src.MonteCarlo as MonteCarlo
+import src.Store as Store
+import numpy
+import tempfile
+import warnings
+
+mcN = 6
+
+
+def draw(rng):
+    """A run which fails (returns None) about half of the time."""
+    x = rng.normal(size=3) + numpy.random.uniform()  # both streams are seeded per run
+    if x[0] < 0.5:
+        return None
+    return x
+
+
+def fail(rng):
+    raise RuntimeError("always fails")
+
+
+def test_run():
+    results = {}
+    for processes in [1, 2]:
+        res = numpy.zeros([mcN, 3])
+
+        def collect(k, x):
+            res[k] = x
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            done = MonteCarlo.run(draw, mcN, collect, seed=42, processes=processes, retries=20)
+        assert numpy.all(done)
+        assert numpy.all(res[:, 0] >= 0.5)
+        results[processes] = res
+    assert numpy.array_equal(results[1], results[2])
+    assert len(numpy.unique(results[1][:, 1])) == mcN  # independent streams
+
+
+def test_retries():
+    calls = []
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        done = MonteCarlo.run(fail, 2, lambda k, x: calls.append(k), seed=0, processes=1, retries=3)
+    assert not numpy.any(done) and calls == []
+    assert sum("failed 4 times" in str(m.message) for m in w) == 2
+
+
+def test_store():
+    N = 20
+    line = [10.0, -410.0]
+    xs = numpy.zeros([3, 2, N])
+    xs[:, 0, :] = [[0.5], [0.4], [0.6]]
+    xs[:, 1, :] = 420.0
+    xs[1, 1, 5:] = 350.0  # run 1 violates the constraint
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Store.create(tmp, MonteCarlo.fields(N, nS=0), 3, h=0.1)
+        results = MonteCarlo.Aggregate(3, N, line, 0.1, store)
+        for k in [2, 1]:  # run 0 failed
+            results.collect(k, dict(xs=xs[k], covars=numpy.tile(numpy.eye(2)[:, :, None], N), setpoint=0.5))
+        del store
+        assert "switches" not in MonteCarlo.fields(N, nS=0)
+        assert numpy.array_equal(MonteCarlo.load_concentrations(tmp), xs[1:, 0, :].T)
+        assert numpy.array_equal(MonteCarlo.load_violations(tmp), results.violations())
+        assert MonteCarlo.load_violations(tmp).shape == (2, 1)
+
+
+if __name__ == '__main__':
+    test_run()
+    test_retries()
+    test_store()
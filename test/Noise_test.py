@@ -0,0 +1,69 @@
+# Noise tests: the pre-drawn blocks have the right statistics and the samples and
+# log densities have the same shapes and values as the scipy distributions they replace.
+
+import src.Noise as Noise
+import src.RNG as RNG
+import numpy
+import scipy.stats
+
+Q = numpy.array([[2.0, 0.5],
+                 [0.5, 1.0]])
+
+
+def test_statistics():
+    noise = Noise.Gaussian(Q, mean=[1.0, -1.0], rng=RNG.RNG(0), block=1000)
+    x = numpy.vstack([noise.rvs() for _ in range(5000)] + [noise.rvs(size=15000)])
+    assert abs(numpy.mean(x, axis=0) - [1.0, -1.0]).max() < 0.05
+    assert abs(numpy.cov(x.T) - Q).max() < 0.1
+    semi = Noise.Gaussian(numpy.diag([1.0, 0.0]), rng=RNG.RNG(0))  # semi-definite covariance
+    assert numpy.all(semi.rvs(size=10)[:, 1] == 0.0)
+
+
+def test_stream():
+    """The blocks come from rng in order and another random_state bypasses them."""
+    noise = Noise.Gaussian(Q, rng=RNG.RNG(1), block=7)
+    x = numpy.vstack([noise.rvs(size=3) for _ in range(5)])
+    L = numpy.linalg.cholesky(Q)
+    rng = RNG.RNG(1)
+    expected = numpy.vstack([rng.standard_normal((7, 2)) for _ in range(3)]) @ L.T
+    assert numpy.allclose(x[:6], expected[:6])  # the third call starts a new block
+    assert numpy.allclose(x[6:9], expected[7:10])
+    y = noise.rvs(size=4, random_state=RNG.RNG(2))
+    assert numpy.allclose(y, RNG.RNG(2).standard_normal((4, 2)) @ L.T)
+
+
+def test_shapes():
+    for cov in [Q, numpy.eye(1)*10.0, 10.0]:
+        noise = Noise.Gaussian(cov)
+        dist = scipy.stats.multivariate_normal(cov=cov)
+        for size in [None, 1, 5, (3, 4)]:
+            assert numpy.shape(noise.rvs(size=size)) == numpy.shape(dist.rvs(size=size))
+
+
+def test_logpdf():
+    x = numpy.random.standard_normal((50, 2))
+    for cov, mean in [(Q, [1.0, -1.0]), (numpy.eye(1)*10.0, None), (10.0, None)]:
+        density = Noise.Gaussian(cov, mean=mean)
+        dist = scipy.stats.multivariate_normal(mean=mean, cov=cov)
+        points = x if density.dim == 2 else x[:, 0]
+        assert numpy.allclose(density.logpdf(points), dist.logpdf(points))
+        assert numpy.isclose(density.logpdf(points[0]), dist.logpdf(points[0]))
+
+
+def test_stacked():
+    covs = numpy.array([Q, 2.0*Q, numpy.diag([1e-3, 10.0])])
+    index = numpy.array([2, 0, 0, 1, 2])
+    x = numpy.random.standard_normal((len(index), 2))
+    density = Noise.Stacked(covs)
+    expected = [scipy.stats.multivariate_normal(cov=covs[i]).logpdf(x[k]) for k, i in enumerate(index)]
+    assert numpy.allclose(density.logpdf(x, index), expected)
+    assert numpy.allclose(density.logpdf(x[:3]), [scipy.stats.multivariate_normal(cov=c).logpdf(x[k])
+                                                  for k, c in enumerate(covs)])
+
+
+if __name__ == '__main__':
+    test_statistics()
+    test_stream()
+    test_shapes()
+    test_logpdf()
+    test_stacked()
@@ -1,9 +1,11 @@
 # Test the Particle Filter.
 
 import src.PF as PF
+import src.RNG as RNG
 import src.Reactor as Reactor
 import pandas
 import numpy
+import scipy.special
 import scipy.stats
 import pathlib
 
@@ -52,6 +54,13 @@ def g(x):
 
 cstr_pf = PF.Model(f, g)
 
+
+def f_batch(x, u, w):
+    return A @ x + numpy.reshape(B * u + b, (-1, 1)) + w
+
+
+cstr_pf_batch = PF.Model(f_batch, g, batch=True)  # g already works on a matrix of particles
+
 # Initialise the PF
 nP = 50  # number of particles.
 init_state_mean = init_state  # initial state mean
@@ -88,5 +97,58 @@ def test_filter():
     assert (abs(fmeans-kfmeans)).max() < tol
 
 
+def run_seeded(model, T=200):
+    """Run the PF on seeded measurements with a seeded RNG and return the particles of every step."""
+    rng = RNG.RNG(7)
+    noise = numpy.random.RandomState(3)
+    particles = PF.init_pf(init_dist, nP, 2, rng)
+    particles = PF.init_filter(particles, init_state, meas_dist, model, rng=rng)
+    x = init_state.copy()
+    history = []
+    for t in range(T):
+        x = cstr_model.run_reactor(x, 0.0, h)
+        y = C @ x + noise.multivariate_normal(numpy.zeros(2), meas_covar)
+        particles = PF.pf_filter(particles, 0.0, y, state_dist, meas_dist, model, rng=rng)
+        history.append((particles.x.copy(), particles.w.copy()))
+    return history
+
+
+def test_filter_batch():
+    single = run_seeded(cstr_pf)
+    batched = run_seeded(cstr_pf_batch)
+    resampled = 0
+    for (x, w), (xb, wb) in zip(single, batched):
+        assert numpy.array_equal(x, xb)  # the same draws in the same order
+        assert numpy.array_equal(w, wb)
+        resampled += numpy.all(w == w[0])
+    assert resampled > 0  # the comparison went through a resample
+
+
+def test_extreme_residuals():
+    particles = PF.init_pf(init_dist, nP, 2)
+    particles.x[0] = init_state[0]  # the weights only differ through the temperature => no resample
+    y = init_state + [1.4, 0.0]  # every particle is ~1e4 log units from the measurement
+    logliks = meas_dist.logpdf(y - particles.x.T)
+    assert (logliks < -9e3).all() and (numpy.exp(logliks) == 0.0).all()  # the linear likelihoods underflow
+    particles = PF.init_filter(particles, y, meas_dist, cstr_pf_batch)
+    assert numpy.isfinite(particles.logw).all()
+    assert abs(particles.w.sum() - 1.0) < 1e-12
+    assert numpy.allclose(particles.logw, logliks - scipy.special.logsumexp(logliks), rtol=0.0, atol=1e-9)
+
+
+def test_degenerate():
+    particles = PF.init_pf(init_dist, nP, 2)
+    lost = PF.Model(f, lambda x: numpy.full(2, numpy.nan))  # zero likelihood for every particle
+    try:
+        PF.init_filter(particles, init_state, meas_dist, lost)
+    except ValueError:
+        pass
+    else:
+        assert False, "a step where every particle has zero likelihood must raise"
+
+
 if __name__ == '__main__':
     test_filter()
+    test_filter_batch()
+    test_extreme_residuals()
+    test_degenerate()
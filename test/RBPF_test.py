@@ -0,0 +1,86 @@
+# RBPF tests: the batched Kalman recursion matches the per particle recursion.
+
+import src.RBPF as RBPF
+import src.Reactor as Reactor
+import src.RNG as RNG
+import numpy
+
+h = 0.1  # time discretisation
+linsystems = Reactor.Reactor().get_linear_systems(2, 2, numpy.array([0.0, 1.0]), numpy.array([250, 550]), h)
+C = numpy.eye(2)
+Q = numpy.diag([1e-6, 0.1])  # plant noise
+R = numpy.diag([1e-3, 10.0])  # measurement noise
+models, _ = RBPF.setup_rbpf(linsystems, C, Q, R)
+init_state_covar = numpy.diag([1e-3, 4.0])
+init_state = numpy.array([0.5, 400])
+switches = numpy.array([[0.90, 0.05, 0.05],
+                        [0.05, 0.90, 0.05],
+                        [0.05, 0.05, 0.90]])  # switch transition matrix (columns sum to 1)
+nP = 100
+T = 40
+
+
+def reference_covariance(sigma, model):
+    """Per particle covariance predict and update step."""
+    pvar = model.Q + model.A @ sigma @ model.A.T
+    kalmanGain = pvar @ model.C.T @ numpy.linalg.inv(model.C @ pvar @ model.C.T + model.R)
+    return (numpy.eye(2) - kalmanGain @ model.C) @ pvar
+
+
+def test_covariance_unstable():
+    model = models[3]
+    assert abs(numpy.linalg.eigvals(model.A)).max() > 1.3  # unstable switch
+    sigmas = numpy.array([init_state_covar * s for s in [0.5, 1.0, 2.0]])
+    refs = sigmas.copy()
+    for t in range(300):  # long enough for the asymmetry to blow up without the fix
+        sigmas, _, _ = RBPF.kalman_covariance(sigmas, model)
+        for k in range(len(refs)):
+            refs[k] = reference_covariance(refs[k], model)
+
+        assert numpy.array_equal(sigmas, numpy.swapaxes(sigmas, 1, 2))
+        assert abs(sigmas - refs).max() < 1e-8 * abs(refs).max()
+    assert numpy.linalg.eigvalsh(sigmas).min() > 0.0
+
+
+def measurements():
+    """Measurements of the first linear model (stable) with its noise."""
+    rng = numpy.random.RandomState(11)
+    x = init_state.copy()
+    ys = numpy.zeros([2, T])
+    for t in range(T):
+        x = linsystems[0].A @ (x - linsystems[0].b) + linsystems[0].b + rng.multivariate_normal(numpy.zeros(2), Q)
+        ys[:, t] = C @ x + rng.multivariate_normal(numpy.zeros(2), R)
+    return ys
+
+
+def run_filter(collapse, ys):
+    """Run the RBPF over ys and return the particles of every step."""
+    rng = RNG.RNG(5)
+    sub = models[:3]
+    particles = RBPF.init_rbpf(numpy.ones(3)/3, init_state, init_state_covar, 2, nP, collapse, rng)
+    particles = RBPF.init_filter(particles, 0.0, ys[:, 0], sub, rng=rng)
+    history = []
+    for t in range(1, T):
+        particles = RBPF.rbpf_filter(particles, 0.0, ys[:, t], sub, switches, rng=rng)
+        sigmas = particles.sigmas if particles.sid is None else particles.sigmas[:, :, particles.sid]
+        history.append((particles.mus.copy(), particles.ws.copy(), sigmas.copy(), particles.sigmas.shape[2]))
+    return history
+
+
+def test_collapse():
+    ys = measurements()
+    full = run_filter(False, ys)
+    collapsed = run_filter(True, ys)
+    resampled = 0
+    for (mus, ws, sigmas, _), (cmus, cws, csigmas, unique) in zip(full, collapsed):
+        assert abs(cmus - mus).max() <= 1e-8 * abs(mus).max()
+        assert abs(cws - ws).max() < 1e-10
+        assert abs(csigmas - sigmas).max() <= 1e-8 * abs(sigmas).max()
+        assert unique <= nP
+        resampled += numpy.all(ws == ws[0])
+    assert resampled > 0  # the comparison went through a resample
+
+
+if __name__ == '__main__':
+    test_covariance_unstable()
+    test_collapse()
@@ -0,0 +1,58 @@
+# RNG tests: the streams are reproducible, the children are independent and the
+# filters give bit-exact reruns given the same stream.
+
+import src.RNG as RNG
+import src.SPF as SPF
+import numpy
+import pickle
+import scipy.stats
+
+nP = 200
+A = numpy.array([[0.9, 0.2],
+                 [0.1, 0.8]])  # switch transition matrix
+xdist = scipy.stats.multivariate_normal(mean=[1.0, 2.0], cov=numpy.eye(2))
+ydist = scipy.stats.multivariate_normal(cov=0.5*numpy.eye(2))
+
+
+def f(x, u, w):
+    return 0.9*x + u + w
+
+
+def g(x):
+    return x
+
+
+model = SPF.Model([f, f], [g, g], A, [xdist, xdist], [ydist, ydist], batch=True)
+
+
+def run_filter(rng):
+    particles = SPF.init_spf(xdist, [0.5, 0.5], nP, 2, rng)
+    for t in range(20):
+        SPF.spf_filter(particles, 0.1, numpy.array([1.0, 2.0]), model, rng=rng)
+    return particles
+
+
+def test_spawn():
+    rng = RNG.RNG(7)
+    children = rng.spawn(3)
+    draws = [c.uniform(size=5) for c in children]
+    assert not numpy.allclose(draws[0], draws[1])
+    again = RNG.RNG(7).spawn(3)
+    assert numpy.array_equal(again[2].uniform(size=5), draws[2])
+    copy = pickle.loads(pickle.dumps(children[0]))  # keeps its position in the stream
+    assert isinstance(copy, RNG.RNG)
+    assert numpy.array_equal(copy.uniform(size=5), children[0].uniform(size=5))
+    assert RNG.get(None) is numpy.random
+
+
+def test_filter_rerun():
+    p1 = run_filter(RNG.RNG(3))
+    p2 = run_filter(RNG.RNG(3))
+    p3 = run_filter(RNG.RNG(4))
+    assert numpy.array_equal(p1.x, p2.x) and numpy.array_equal(p1.s, p2.s)
+    assert not numpy.array_equal(p1.x, p3.x)
+
+
+if __name__ == '__main__':
+    test_spawn()
+    test_filter_rerun()
@@ -5,6 +5,7 @@ import src.Reactor as Reactor
 import pandas
 import numpy
 import pathlib
+import tempfile
 
 state_solutions_path = pathlib.Path("state_solutions.csv")
 if state_solutions_path.is_file():
@@ -33,5 +34,68 @@ def test_simulation():
     assert abs(state_solutions - xs.T).max() < tol
 
 
+def test_simulation_batch():
+    nB = 5  # number of states integrated together
+    xbatch = numpy.zeros([2, nB])
+    xbatch[0, :] = numpy.linspace(0.1, 0.9, nB)
+    xbatch[1, :] = numpy.linspace(320, 480, nB)
+    us = numpy.linspace(-100, 100, nB)  # different input per column
+    xsingle = numpy.copy(xbatch)
+    for t in range(100):
+        xbatch = cstr.run_reactor_batch(xbatch, us, h)
+        for p in range(nB):
+            xsingle[:, p] = cstr.run_reactor(xsingle[:, p], us[p], h)
+
+    assert abs(xbatch - xsingle).max() < 1e-8
+
+    workspace = cstr.workspace
+    for n in [3, 1, 4]:  # smaller blocks reuse the buffers
+        xpart = cstr.run_reactor_batch(xbatch[:, :n], us[:n], h)
+        assert cstr.workspace is workspace
+        for p in range(n):
+            assert abs(xpart[:, p] - cstr.run_reactor(xbatch[:, p], us[p], h)).max() < 1e-8
+
+
+def test_linearise_batch():
+    ops = cstr.discretise(4, 5, [0.0, 1.0], [300.0, 600.0])
+    As, Bs, bs = cstr.linearise_batch(ops, h, cache=False)
+    for k in range(ops.shape[1]):
+        A = cstr.jacobian(ops[:, k])
+        n = numpy.identity(2)
+        Ad = (n + 0.5*h*A) @ numpy.linalg.inv(n - 0.5*h*A)
+        F0 = cstr.reactor_ode(ops[:, k], 0.0)
+        assert abs(cstr.jacobian_batch(ops)[k] - A).max() < 1e-8 * abs(A).max()
+        assert abs(As[k] - Ad).max() < 1e-10
+        assert abs(bs[k] - numpy.linalg.inv(A) @ (A @ ops[:, k] - F0)).max() < 1e-8
+        assert abs(Bs[k] - numpy.linalg.inv(A) @ (Ad - n) @ [0.0, 1.0/(cstr.rho*cstr.V*cstr.Cp)]).max() < 1e-12
+
+
+def test_linearise_cache():
+    ops = cstr.discretise(3, 3, [0.0, 1.0], [300.0, 600.0])
+    assert Reactor.cache_dir is None  # off unless asked for
+    version = Reactor.cache_version
+    with tempfile.TemporaryDirectory() as tmp:
+        Reactor.set_cache_dir(tmp)
+        try:
+            linsystems = cstr.linear_systems(ops, h)
+            assert len(list(Reactor.cache_dir.glob("*.npz"))) == 1
+            cached = cstr.linear_systems(ops, h)
+            other = Reactor.Reactor(V=0.2).linear_systems(ops, h)  # different parameters => new entry
+            assert len(list(Reactor.cache_dir.glob("*.npz"))) == 2
+            Reactor.cache_version += 1  # changed linearisation => stale entries are not used
+            cstr.linear_systems(ops, h)
+            assert len(list(Reactor.cache_dir.glob("*.npz"))) == 3
+        finally:
+            Reactor.set_cache_dir(None)
+            Reactor.cache_version = version
+    for k in range(len(linsystems)):
+        assert numpy.array_equal(linsystems[k].A, cached[k].A)
+        assert numpy.array_equal(linsystems[k].b, cached[k].b)
+    assert not numpy.allclose(other[0].A, cached[0].A)
+
+
 if __name__ == '__main__':
     test_simulation()
+    test_simulation_batch()
+    test_linearise_batch()
+    test_linearise_cache()
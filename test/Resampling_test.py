@@ -0,0 +1,57 @@
+# Tests for the resampling schemes shared by the particle filters.
+
+import src.Resampling as Resampling
+import numpy
+
+N = 1000
+w = numpy.random.uniform(size=N)**4  # skewed weights
+w /= numpy.sum(w)
+
+
+def test_schemes():
+    for scheme in Resampling.schemes:
+        ind = Resampling.Resampler(scheme).indices(w)
+        assert len(ind) == N
+        assert ind.min() >= 0 and ind.max() < N
+
+
+def test_low_variance():
+    """Systematic and residual resampling keep at least floor(N*w) copies of each particle."""
+    for scheme in ["systematic", "residual"]:
+        counts = numpy.bincount(Resampling.Resampler(scheme).indices(w), minlength=N)
+        assert numpy.all(counts >= numpy.floor(N*w))
+    counts = numpy.bincount(Resampling.systematic(w), minlength=N)
+    assert numpy.all(counts <= numpy.ceil(N*w))
+
+
+def test_gather():
+    resampler = Resampling.Resampler()
+    x = numpy.vstack([numpy.arange(N), -numpy.arange(N)]).astype(float)
+    ind = resampler.indices(w)
+    expected = x[:, ind]
+    resampler.gather(x, ind)
+    assert numpy.array_equal(x, expected)
+
+    ind[-1] = N  # off by one
+    try:
+        resampler.gather(x, ind)
+        assert False
+    except IndexError:
+        pass
+    assert numpy.array_equal(x, expected)  # left untouched
+
+
+def test_shrink():
+    """Liu-West shrinkage preserves the mean and variance of the population."""
+    x = numpy.vstack([numpy.random.normal(0.5, 0.01, size=N), numpy.random.normal(400, 5.0, size=N)])
+    mean, var = numpy.mean(x, axis=1), numpy.var(x, axis=1)
+    Resampling.Resampler(delta=0.95).roughen(x)
+    assert numpy.all(abs(numpy.mean(x, axis=1) - mean) < 0.2*numpy.sqrt(var))
+    assert numpy.all(abs(numpy.var(x, axis=1)/var - 1) < 0.2)
+
+
+if __name__ == '__main__':
+    test_schemes()
+    test_low_variance()
+    test_gather()
+    test_shrink()
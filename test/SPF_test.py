@@ -0,0 +1,62 @@
+# SPF tests: the grouped batch dispatch gives the same particles as the per particle path.
+
+import src.SPF as SPF
+import src.RNG as RNG
+import numpy
+import scipy.stats
+
+nP = 300
+nS = 3
+A = numpy.array([[0.80, 0.10, 0.10],
+                 [0.10, 0.80, 0.10],
+                 [0.10, 0.10, 0.80]])  # switch transition matrix
+As = [numpy.array([[0.9, 0.1], [0.0, 0.8]]),
+      numpy.array([[1.0, 0.0], [0.2, 0.7]]),
+      numpy.array([[0.5, -0.1], [0.1, 0.95]])]
+Bs = [numpy.array([1.0, 0.0]), numpy.array([0.0, 1.0]), numpy.array([0.5, 0.5])]
+C = numpy.array([[1.0, 0.5], [0.0, 1.0]])
+xdist = scipy.stats.multivariate_normal(mean=[1.0, 2.0], cov=numpy.eye(2))
+wdists = [scipy.stats.multivariate_normal(cov=s*numpy.eye(2)) for s in [0.1, 0.2, 0.3]]
+ydists = [scipy.stats.multivariate_normal(cov=s*numpy.eye(2)) for s in [0.5, 1.0, 0.7]]
+ys = numpy.array([[1.0, 2.0], [1.5, 2.2], [1.2, 2.9], [0.7, 3.1], [1.1, 2.5], [1.4, 2.0]])
+
+
+def make_model(batch):
+    F, G = [], []
+    for s in range(nS):
+        def f(x, u, w, s=s):
+            if batch:
+                return As[s] @ x + numpy.reshape(Bs[s]*u, (-1, 1)) + w
+            return As[s] @ x + Bs[s]*u + w
+
+        def g(x):
+            return C @ x
+
+        F.append(f)
+        G.append(g)
+    return SPF.Model(F, G, A, wdists, ydists, batch=batch)
+
+
+def run_filter(model):
+    rng = RNG.RNG(9)
+    particles = SPF.init_spf(xdist, numpy.ones(nS)/nS, nP, 2, rng)
+    particles = SPF.init_filter(particles, ys[0], model, rng=rng)
+    history = []
+    for y in ys[1:]:
+        particles = SPF.spf_filter(particles, 0.1, y, model, rng=rng)
+        history.append((particles.x.copy(), particles.s.copy(), particles.w.copy()))
+    return history
+
+
+def test_batch_dispatch():
+    batched = run_filter(make_model(True))
+    single = run_filter(make_model(False))
+    for (x, s, w), (xb, sb, wb) in zip(single, batched):
+        assert len(SPF.group_switches(s, nS)) == nS  # every switch is occupied
+        assert numpy.array_equal(s, sb)
+        assert numpy.allclose(x, xb, rtol=1e-12, atol=1e-12)
+        assert numpy.allclose(w, wb, rtol=1e-10, atol=1e-14)
+
+
+if __name__ == '__main__':
+    test_batch_dispatch()
@@ -0,0 +1,62 @@
+# Result store tests: runs written out of order are read back losslessly.
+
+import src.Store as Store
+import numpy
+import tempfile
+
+N = 50
+fields = {"xs": [2, N], "us": [N], "switch": ([N], "int64"), "err": []}
+
+
+def test_write_load():
+    xs = numpy.random.standard_normal((3, 2, N))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Store.create(tmp, fields, 3, h=0.1, name="test")
+        store.write(2, xs=xs[2], us=numpy.ones(N), switch=numpy.arange(N), err=1.5)
+        store.write(0, xs=xs[0], us=numpy.zeros(N), switch=numpy.arange(N), err=0.5)
+        del store
+
+        store = Store.load(tmp)
+        assert store.metadata == {"h": 0.1, "name": "test"}
+        assert numpy.array_equal(store.done, [True, False, True])
+        assert isinstance(store["xs"], numpy.memmap)
+        assert numpy.array_equal(store.completed("xs"), xs[[0, 2]])  # bit-exact
+        assert numpy.array_equal(store.completed("err"), [0.5, 1.5])
+        assert store["switch"].dtype == numpy.int64
+        del store
+
+
+def test_append():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Store.create(tmp, {"err": []}, 2)
+        assert store.append(err=1.0) == 0
+        assert store.append(err=2.0) == 1
+        try:
+            store.append(err=3.0)
+            assert False
+        except IndexError:
+            pass
+        assert numpy.array_equal(Store.load(tmp).completed("err"), [1.0, 2.0])
+        del store
+
+
+def test_overwrite():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Store.create(tmp, {"err": []}, 2)
+        store.write(1, err=4.0)
+        del store
+        try:
+            Store.create(tmp, {"err": []}, 2)  # would wipe the completed run
+            assert False
+        except FileExistsError:
+            pass
+        assert numpy.array_equal(Store.load(tmp).completed("err"), [4.0])
+        store = Store.create(tmp, {"err": []}, 3, overwrite=True)
+        assert store.runs == 3 and not numpy.any(store.done)
+        del store
+
+
+if __name__ == '__main__':
+    test_write_load()
+    test_append()
+    test_overwrite()
@@ -1,10 +1,23 @@
+import test.EMPC_test as EMPC_test
 import test.HMM_test as HMM_test
 import test.LLDS_test as LLDS_test
+import test.LQR_test as LQR_test
+import test.MonteCarlo_test as MonteCarlo_test
+import test.MPC_test as MPC_test
+import test.Noise_test as Noise_test
 import test.PF_test as PF_test
+import test.RBPF_test as RBPF_test
 import test.Reactor_test as Reactor_test
+import test.Resampling_test as Resampling_test
+import test.RNG_test as RNG_test
+import test.SPF_test as SPF_test
+import test.Store_test as Store_test
 
 
 def test_all():
+    EMPC_test.test_table()
+    EMPC_test.test_save_load()
+
     HMM_test.test_filter()
     HMM_test.test_smooth()
     HMM_test.test_viterbi()
@@ -12,10 +25,59 @@ def test_all():
 
     LLDS_test.test_filter()
     LLDS_test.test_smooth()
+    LLDS_test.test_filter_steady()
+    LLDS_test.test_steady_convergence()
+    LLDS_test.test_filter_smooth_batch()
+    LLDS_test.test_filter_sqrt()
+
+    LQR_test.test_dare()
+    LQR_test.test_dare_warm_start()
+    LQR_test.test_dare_cache_bound()
+    LQR_test.test_controller_bank()
+
+    MonteCarlo_test.test_run()
+    MonteCarlo_test.test_retries()
+    MonteCarlo_test.test_store()
+
+    MPC_test.test_controller_cache()
+    MPC_test.test_controller_cache_bound()
+    MPC_test.test_solver_fallback()
+    MPC_test.test_solver_recovery()
+    MPC_test.test_lqr_closed_form()
+    MPC_test.test_variance_terms()
+
+    Noise_test.test_statistics()
+    Noise_test.test_stream()
+    Noise_test.test_shapes()
+    Noise_test.test_logpdf()
+    Noise_test.test_stacked()
 
     PF_test.test_filter()
+    PF_test.test_filter_batch()
+    PF_test.test_extreme_residuals()
+    PF_test.test_degenerate()
+
+    RBPF_test.test_covariance_unstable()
+    RBPF_test.test_collapse()
 
     Reactor_test.test_simulation()
+    Reactor_test.test_simulation_batch()
+    Reactor_test.test_linearise_batch()
+    Reactor_test.test_linearise_cache()
+
+    Resampling_test.test_schemes()
+    Resampling_test.test_low_variance()
+    Resampling_test.test_gather()
+    Resampling_test.test_shrink()
+
+    RNG_test.test_spawn()
+    RNG_test.test_filter_rerun()
+
+    SPF_test.test_batch_dispatch()
+
+    Store_test.test_write_load()
+    Store_test.test_append()
+    Store_test.test_overwrite()
 
 
 if __name__ == '__main':